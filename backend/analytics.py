@@ -0,0 +1,346 @@
+"""
+Columnar export of the event log, aggregated into weekly impact reports.
+
+export() copies wallet_events into ANALYTICS_DIR as segment files. Segment k
+holds the events with ids in [k * SEGMENT_EVENTS, (k + 1) * SEGMENT_EVENTS) as a
+NumPy structured array of 13 bytes per event (id offset in the segment, week,
+type code, challenge code, amount). Challenge ids and their categories are
+dictionary-encoded per file, like Parquet row groups, so a file can be read
+without any other.
+
+Files are never written again. Each export adds one file per segment it has
+events for and lists the live files in manifest.json, replaced last; once the
+log has moved past a segment, its files are compacted into one. Files the
+manifest no longer lists are deleted by the next export, so a report reading
+the previous manifest can still open them. The manifest also holds the
+export's place in the log (a database.EventTail): an event committed after
+higher ids were exported goes out with a later export. Exports of a directory
+run one at a time (a lock file); `python manage.py impact` runs one.
+
+impact_report() aggregates every file on its own in a process pool and
+merges the partial sums into completions, coins earned and coins redeemed per
+week, per challenge and per category. Memory is bounded by one file per
+worker, whatever the number of events. Partial sums of files aggregated for an
+earlier report are reused. Opening balances of imported users have event types
+of their own: they were not earned or redeemed in the week they were imported.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import database
+
+logger = logging.getLogger("eco_rewards")
+
+ANALYTICS_DIR = Path(os.getenv("ANALYTICS_DIR", Path(__file__).parent / "data" / "analytics"))
+SEGMENT_EVENTS = int(os.getenv("ANALYTICS_SEGMENT_EVENTS", "1000000"))
+WORKERS = int(os.getenv("ANALYTICS_WORKERS", "0")) or os.cpu_count() or 1
+# how long an export waits for a skipped event id to be committed (exports run minutes apart)
+GAP_SECONDS = float(os.getenv("ANALYTICS_GAP_SECONDS", "3600"))
+MANIFEST = "manifest.json"
+
+# wallet_events.type values by their code in segments; other types get OTHER_TYPE
+EVENT_TYPES = (database.EARNED, database.REDEEMED, database.BADGE_AWARDED,
+               database.CHALLENGE_STARTED, database.CHALLENGE_STOPPED, database.STREAK_EXPIRED,
+               database.OPENING_EARNED, database.OPENING_REDEEMED, database.OPENING_COMPLETED)
+TYPE_CODES = {type: code for code, type in enumerate(EVENT_TYPES)}
+OTHER_TYPE = 255
+NO_CHALLENGE = -1
+
+EVENT_DTYPE = np.dtype([("offset", "<u4"), ("week", "<i2"), ("type", "u1"), ("challenge", "<i2"), ("amount", "<i4")])
+
+# weeks start on Monday; 1970-01-01 was a Thursday
+EPOCH = date(1970, 1, 1)
+
+
+def week_of(day: date) -> int:
+    return ((day - EPOCH).days + 3) // 7
+
+
+def week_start(week: int) -> date:
+    return EPOCH + timedelta(days=week * 7 - 3)
+
+
+def segment_path(directory: Path, segment: int, run: int = 0) -> Path:
+    return directory / f"events-{segment:06d}-{run:06d}.npz"
+
+
+def segment_of(name: str) -> int:
+    """Segment number of a file name ('events-000003-000012.npz', or 'events-000003.npz' before manifests)."""
+    return int(name[len("events-"):len("events-") + 6])
+
+
+def read_segment(path: Path) -> tuple[int, np.ndarray, list[str], list[str]]:
+    """First event id of its segment, events, and challenge ids and categories (by challenge code) of a file."""
+    with np.load(path) as f:
+        return int(f["first_id"]), f["events"], f["challenge_ids"].tolist(), f["categories"].tolist()
+
+
+def _write_atomic(path: Path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _write_segment(path: Path, first_id: int, events: np.ndarray, challenge_ids: list[str], categories: list[str]):
+    _write_atomic(path, lambda f: np.savez(
+        f, first_id=np.int64(first_id), events=events, challenge_ids=np.array(challenge_ids, dtype=str),
+        categories=np.array(categories, dtype=str)))
+
+
+def read_manifest(directory: Path) -> dict:
+    """
+    The files of a directory and its export position: run, last_event_id, gaps
+    and files. A directory exported before manifests existed gets one made up
+    from its files.
+    """
+    try:
+        with open(directory / MANIFEST) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        files = sorted(path.name for path in directory.glob("events-*.npz"))
+        last_event_id = 0
+        if files:
+            first_id, events, _, _ = read_segment(directory / files[-1])
+            last_event_id = first_id + int(events["offset"].max())
+        return {"run": 0, "last_event_id": last_event_id, "gaps": {}, "files": files}
+    manifest["gaps"] = {int(event_id): skipped_at for event_id, skipped_at in manifest["gaps"].items()}
+    return manifest
+
+
+def _write_manifest(directory: Path, manifest: dict):
+    data = json.dumps({**manifest, "gaps": {str(event_id): t for event_id, t in manifest["gaps"].items()}})
+    _write_atomic(directory / MANIFEST, lambda f: f.write(data.encode()))
+
+
+class _Segment:
+    """The events of one segment written by an export."""
+
+    def __init__(self, number: int, first_id: int):
+        self.number = number
+        self.first_id = first_id
+        self.parts = []
+        self.challenge_ids = []
+        self.categories = []
+        self.codes = {}
+
+    def append(self, rows, categories: dict[str, str | None]):
+        ids, types, amounts, challenge_ids, days = zip(*rows)
+        unique, inverse = np.unique(np.array([c or "" for c in challenge_ids], dtype=str), return_inverse=True)
+        lookup = np.array([self._code(c, categories) for c in unique.tolist()], dtype=np.int16)
+        unique_types, type_inverse = np.unique(np.array(types, dtype=str), return_inverse=True)
+        type_lookup = np.array([TYPE_CODES.get(t, OTHER_TYPE) for t in unique_types.tolist()], dtype=np.uint8)
+
+        events = np.empty(len(rows), dtype=EVENT_DTYPE)
+        events["offset"] = np.array(ids, dtype=np.int64) - self.first_id
+        events["week"] = (np.array(days, dtype="datetime64[D]").astype(np.int64) + 3) // 7
+        events["type"] = type_lookup[type_inverse]
+        events["challenge"] = lookup[inverse]
+        events["amount"] = np.array([a or 0 for a in amounts], dtype=np.int32)
+        self.parts.append(events)
+
+    def extend(self, events: np.ndarray, challenge_ids: list[str], categories: list[str]):
+        """Add the events of another file of the segment, re-coding its challenges."""
+        # NO_CHALLENGE (-1) picks the last entry
+        lookup = np.array([*(self._code(c, {c: category}) for c, category in zip(challenge_ids, categories)),
+                           NO_CHALLENGE], dtype=np.int16)
+        events = events.copy()
+        events["challenge"] = lookup[events["challenge"]]
+        self.parts.append(events)
+
+    def _code(self, challenge_id: str, categories: dict[str, str | None]) -> int:
+        if not challenge_id:
+            return NO_CHALLENGE
+        code = self.codes.get(challenge_id)
+        if code is None:
+            code = self.codes[challenge_id] = len(self.challenge_ids)
+            self.challenge_ids.append(challenge_id)
+            self.categories.append(categories.get(challenge_id) or "")
+        return code
+
+    def write(self, directory: Path, run: int) -> str:
+        path = segment_path(directory, self.number, run)
+        _write_segment(path, self.first_id, np.concatenate(self.parts), self.challenge_ids, self.categories)
+        return path.name
+
+
+def export(db, directory: Path = ANALYTICS_DIR, segment_events: int = SEGMENT_EVENTS,
+           batch_size: int = 100000, gap_seconds: float = GAP_SECONDS) -> int:
+    """Write the events logged (or committed late) since the last export to new files; returns how many."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / ".export.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _export(db, directory, segment_events, batch_size, gap_seconds)
+
+
+def _export(db, directory: Path, segment_events: int, batch_size: int, gap_seconds: float) -> int:
+    manifest = read_manifest(directory)
+    live = set(manifest["files"])
+    for path in directory.glob("events-*.npz"):
+        if path.name not in live:
+            path.unlink()  # replaced by the previous export, or written by one that failed
+    run = manifest["run"] + 1
+    tail = database.EventTail(manifest["last_event_id"], manifest["gaps"], gap_seconds, days=True)
+
+    categories = database.get_challenge_categories(db)
+    segments: dict[int, _Segment] = {}
+    written, exported = [], 0
+    for batch in tail.batches(db, batch_size=batch_size):
+        numbers = np.array([row.id for row in batch], dtype=np.int64) // segment_events
+        # a batch can span segments: append each run of rows to its own
+        bounds = [0, *(np.flatnonzero(np.diff(numbers)) + 1).tolist(), len(batch)]
+        for start, stop in zip(bounds, bounds[1:]):
+            number = int(numbers[start])
+            if number not in segments:
+                # past ids are only read again as late batches, which come first: write the segments behind
+                for done in [n for n in segments if n < number]:
+                    written.append(segments.pop(done).write(directory, run))
+                segments[number] = _Segment(number, number * segment_events)
+            segments[number].append(batch[start:stop], categories)
+        exported += len(batch)
+    written.extend(segment.write(directory, run) for segment in segments.values())
+
+    # segments the log has moved past are compacted into one file
+    files = manifest["files"] + written
+    by_segment: dict[int, list[str]] = {}
+    for name in files:
+        by_segment.setdefault(segment_of(name), []).append(name)
+    for number, names in by_segment.items():
+        if number < tail.last_id // segment_events and len(names) > 1:
+            merged = _Segment(number, number * segment_events)
+            for name in names:
+                _, events, challenge_ids, segment_categories = read_segment(directory / name)
+                merged.extend(events, challenge_ids, segment_categories)
+            # may replace this run's own file of the segment, whose events it holds
+            name = merged.write(directory, run)
+            files = [f for f in files if f not in names] + [name]
+
+    _write_manifest(directory, {"run": run, "last_event_id": tail.last_id, "gaps": tail.gaps,
+                                "files": sorted(set(files))})
+    if exported:
+        logger.info("Exported %s events for analytics", exported)
+    return exported
+
+
+def aggregate_segment(path: Path) -> dict:
+    """Weekly sums of one segment, by the segment's challenge codes."""
+    first_id, events, challenge_ids, categories = read_segment(path)
+    weeks = events["week"].astype(np.int64)
+    first_week = int(weeks.min())
+    n_weeks, n_challenges = int(weeks.max()) - first_week + 1, len(challenge_ids)
+    weeks -= first_week
+    amounts = events["amount"].astype(np.float64)
+    earned = events["type"] == TYPE_CODES[database.EARNED]
+    redeemed = events["type"] == TYPE_CODES[database.REDEEMED]
+    completed = earned & (events["challenge"] != NO_CHALLENGE)
+    cells = weeks[completed] * n_challenges + events["challenge"][completed]
+    return {
+        "path": str(path),
+        "last_event_id": first_id + int(events["offset"].max()),
+        "events": len(events),
+        "first_week": first_week,
+        "challenge_ids": challenge_ids,
+        "categories": categories,
+        "completions": np.bincount(cells, minlength=n_weeks * n_challenges).reshape(n_weeks, n_challenges),
+        "challenge_coins": np.bincount(cells, weights=amounts[completed], minlength=n_weeks * n_challenges)
+                             .astype(np.int64).reshape(n_weeks, n_challenges),
+        "coins_earned": np.bincount(weeks[earned], weights=amounts[earned], minlength=n_weeks).astype(np.int64),
+        "coins_redeemed": -np.bincount(weeks[redeemed], weights=amounts[redeemed], minlength=n_weeks).astype(np.int64),
+    }
+
+
+# partial sums by file path, with the (mtime, size) they were computed for
+_partials: dict[str, tuple[tuple[int, int], dict]] = {}
+_partials_lock = threading.Lock()
+
+
+def aggregate(directory: Path = ANALYTICS_DIR, workers: int = WORKERS) -> list[dict]:
+    """Partial sums of every file; files not aggregated before are aggregated in a process pool."""
+    paths = [directory / name for name in read_manifest(directory)["files"]]
+    stamps = {str(p): (p.stat().st_mtime_ns, p.stat().st_size) for p in paths}
+    with _partials_lock:
+        todo = [p for p in paths if _partials.get(str(p), (None,))[0] != stamps[str(p)]]
+    if workers > 1 and len(todo) > 1:
+        # spawn: forking a threaded web worker could copy held locks
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            computed = list(pool.map(aggregate_segment, todo))
+    else:
+        computed = [aggregate_segment(p) for p in todo]
+    with _partials_lock:
+        for partial in computed:
+            _partials[partial["path"]] = (stamps[partial["path"]], partial)
+        return [_partials[str(p)][1] for p in paths]
+
+
+def merge(partials: list[dict], since: date | None = None, until: date | None = None) -> dict:
+    """Report of the weeks from `since` to `until` (inclusive; default: all) out of segment partial sums."""
+    report = {"lastEventId": max((p["last_event_id"] for p in partials), default=0),
+              "events": sum(p["events"] for p in partials), "weeks": []}
+    if not partials:
+        return report
+    first_week = min(p["first_week"] for p in partials)
+    n_weeks = max(p["first_week"] + len(p["coins_earned"]) for p in partials) - first_week
+
+    columns, categories = {}, []
+    for p in partials:
+        for challenge_id, category in zip(p["challenge_ids"], p["categories"]):
+            if challenge_id not in columns:
+                columns[challenge_id] = len(columns)
+                categories.append(category)
+            else:
+                categories[columns[challenge_id]] = category  # the latest export's category
+    completions = np.zeros((n_weeks, len(columns)), dtype=np.int64)
+    challenge_coins = np.zeros_like(completions)
+    coins_earned = np.zeros(n_weeks, dtype=np.int64)
+    coins_redeemed = np.zeros(n_weeks, dtype=np.int64)
+    for p in partials:
+        rows = slice(p["first_week"] - first_week, p["first_week"] - first_week + len(p["coins_earned"]))
+        cols = np.array([columns[c] for c in p["challenge_ids"]], dtype=np.intp)
+        completions[rows, cols] += p["completions"]
+        challenge_coins[rows, cols] += p["challenge_coins"]
+        coins_earned[rows] += p["coins_earned"]
+        coins_redeemed[rows] += p["coins_redeemed"]
+
+    challenge_ids = list(columns)
+    category_names = sorted(set(categories))
+    by_category = np.zeros((n_weeks, len(category_names)), dtype=np.int64)
+    np.add.at(by_category.T, np.array([category_names.index(c) for c in categories], dtype=np.intp), completions.T)
+
+    low = week_of(since) - first_week if since else 0
+    high = week_of(until) - first_week + 1 if until else n_weeks
+    for w in range(max(low, 0), min(high, n_weeks)):
+        present = np.flatnonzero(completions[w]).tolist()
+        report["weeks"].append({
+            "week": week_start(first_week + w).isoformat(),
+            "completions": int(completions[w].sum()),
+            "coinsEarned": int(coins_earned[w]),
+            "coinsRedeemed": int(coins_redeemed[w]),
+            "categories": {name or "uncategorized": int(n)
+                           for name, n in zip(category_names, by_category[w].tolist()) if n},
+            "challenges": [{"challengeId": challenge_ids[c], "category": categories[c] or None,
+                            "completions": int(completions[w, c]), "coinsEarned": int(challenge_coins[w, c])}
+                           for c in present],
+        })
+    return report
+
+
+def impact_report(directory: Path = ANALYTICS_DIR, workers: int = WORKERS,
+                  since: date | None = None, until: date | None = None) -> dict:
+    """Weekly completions, coins and category mix of everything exported to `directory`."""
+    return merge(aggregate(directory, workers), since, until)
@@ -0,0 +1,265 @@
+"""
+ASGI entry point for the EcoRewards API.
+
+The read-heavy GET routes are served by async handlers: the static catalogs
+come straight from the catalog cache, /api/events streams look the user up
+through an asyncio driver (aiosqlite / asyncpg) and then wait on a queue, so a
+single process can hold thousands of concurrent clients, most of them idle
+streams. The user routes build their responses with the code of main.py
+(ranking, catalog and weight loads, synchronous queries) in a threadpool, so
+none of that blocks the event loop. Every other /api/* route is passed on to
+the Flask app from main.py, so both servers expose exactly the same API. The
+background workers start with the app (lifespan), as Flask starts them with
+its first request.
+
+Requires starlette, uvicorn, a2wsgi and the asyncio driver for DATABASE_URL
+(see the README).
+
+    python asgi.py                                  # WEB_CONCURRENCY workers on PORT (8000)
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+
+import contextlib
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from catalog_cache import catalog_cache
+import database
+import main
+import observability
+import push
+from main import logger
+
+# Threads available to the mounted Flask app for the routes without an async handler
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "32"))
+
+
+async def ensure_database():
+    if not main.is_loaded("database_seed"):
+        # before the lifespan startup has finished
+        await run_in_threadpool(main.ensure_database)
+
+
+async def run_with_user(request: Request, build):
+    """Run build(db, user) in the threadpool, with a session of its own."""
+    user_id = request.headers.get("X-User-Id", main.DEFAULT_USER_ID)
+    await ensure_database()
+
+    def run():
+        db = database.SessionLocal()
+        try:
+            user = database.get_user_by_id(db, user_id)
+            if user is None:
+                raise main.UserNotFound(user_id)
+            return build(db, user)
+        finally:
+            db.close()
+
+    return await run_in_threadpool(run)
+
+
+async def load_user_id(request: Request) -> str:
+    """The requesting user's id, checked through the async connection (no thread)."""
+    user_id = request.headers.get("X-User-Id", main.DEFAULT_USER_ID)
+    await ensure_database()
+    async with database.get_async_sessionmaker()() as db:
+        if await db.scalar(select(database.User.id).where(database.User.id == user_id)) is None:
+            raise main.UserNotFound(user_id)
+    return user_id
+
+
+def catalog_response(request: Request, filename: str) -> Response:
+    status, body, headers = catalog_cache.respond(
+        filename, request.headers.get("if-none-match"), request.headers.get("accept-encoding")
+    )
+    return Response(body, status_code=status, headers=headers)
+
+
+async def get_questions(request: Request):
+    return catalog_response(request, "question.json")
+
+
+async def get_redemption_options(request: Request):
+    return catalog_response(request, "redemptions.json")
+
+
+async def get_user_profile(request: Request):
+    return JSONResponse(await run_with_user(request, main.serialize_user))
+
+
+async def get_personalized_challenges(request: Request):
+    personalized_reasons = request.query_params.get("reasons") == "personalized"
+
+    def build(db, user):
+        main.refresh_catalogs()
+        main.refresh_weights()
+        return main.build_personalized_challenges(db, user, personalized_reasons, request.query_params)
+
+    try:
+        challenges, version = await run_with_user(request, build)
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid filter: {e}"}, status_code=400)
+    return JSONResponse(challenges, headers={"X-Weights-Version": version})
+
+
+async def get_user_stats(request: Request):
+    return JSONResponse(await run_with_user(request, main.build_user_stats))
+
+
+async def get_transactions_page(request: Request):
+    try:
+        transactions, next_cursor = await run_with_user(request, lambda db, user: main.build_transactions_page(
+            db, user.id, request.query_params.get("limit"), request.query_params.get("cursor")
+        ))
+    except (ValueError, UnicodeDecodeError):
+        return JSONResponse({"error": "Invalid 'limit' or 'cursor'"}, status_code=400)
+    return JSONResponse(transactions, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+
+async def get_transactions(scope, receive, send):
+    """Pages are served async; the streaming NDJSON export stays on the Flask implementation."""
+    request = Request(scope, receive)
+    if request.query_params.get("format") == "ndjson":
+        await flask_app(scope, receive, send)
+        return
+    response = await get_transactions_page(request)
+    await response(scope, receive, send)
+
+
+async def stream_events(request: Request):
+    """
+    The Server-Sent Events stream of main.stream_events, on the event loop: an idle
+    stream costs a queue and a coroutine instead of a thread.
+    """
+    try:
+        after_id = int(request.headers.get("last-event-id") or request.query_params.get("lastEventId") or -1)
+    except ValueError:
+        return JSONResponse({"error": "Last-Event-ID must be an event id"}, status_code=400)
+    if not main.is_loaded("push_feed"):
+        await run_in_threadpool(main.get_push_feed)
+    broker = main.get_push_feed().broker
+    user_id = await load_user_id(request)
+    try:
+        subscription = broker.subscribe(user_id)
+    except push.TooManySubscribers:
+        return JSONResponse({"error": "Too many event streams on this server, retry later"}, status_code=503,
+                            headers={"Retry-After": "5"})
+    try:
+        replayed = await run_with_user(request, lambda db, user: push.replay(db, user.id, after_id)) \
+            if after_id >= 0 else []
+    except BaseException:
+        broker.unsubscribe(subscription)
+        raise
+
+    async def generate():
+        seen = max([after_id, *(message.get("id", 0) for message in replayed)])
+        try:
+            yield f"retry: {push.RETRY_MS}\n\n" + "".join(push.format_sse(message) for message in replayed)
+            while True:
+                messages = [m for m in await subscription.get_async(push.HEARTBEAT) if m.get("id", seen + 1) > seen]
+                yield "".join(push.format_sse(message) for message in messages) or push.HEARTBEAT_FRAME
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def handle_user_not_found(request: Request, error: main.UserNotFound):
+    return JSONResponse({"error": "User not found", "userId": str(error)}, status_code=404)
+
+
+async def handle_unexpected_error(request: Request, error: Exception):
+    logger.exception("Unhandled exception: %s", error)
+    return JSONResponse({"error": "Internal server error", "message": str(error)}, status_code=500)
+
+
+class ASGIEndpoint:
+    """Mark a coroutine as a raw ASGI app so Starlette doesn't wrap it as a request handler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+
+
+class RequestMetrics:
+    """Count and time the async routes; requests passed on to Flask are measured by main.py."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status, elapsed = 500, None
+
+        async def send_with_status(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                # time to the response headers, so a long-lived event stream counts as fast
+                status, elapsed = message["status"], time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            if isinstance(route, Route):
+                elapsed = elapsed if elapsed is not None else time.perf_counter() - started
+                observability.HTTP_REQUESTS.inc(method=scope["method"], route=route.path, status=status)
+                observability.HTTP_LATENCY.observe(elapsed, method=scope["method"], route=route.path)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(main.start_background_workers)
+    yield
+
+
+flask_app = WSGIMiddleware(main.app, workers=WSGI_WORKERS)
+
+app = Starlette(
+    routes=[
+        Route("/api/questions", get_questions, methods=["GET"]),
+        Route("/api/wallet/redemptions", get_redemption_options, methods=["GET"]),
+        Route("/api/user/profile", get_user_profile, methods=["GET"]),
+        Route("/api/user/stats", get_user_stats, methods=["GET"]),
+        Route("/api/challenges/personalized", get_personalized_challenges, methods=["GET"]),
+        Route("/api/wallet/transactions", ASGIEndpoint(get_transactions), methods=["GET"]),
+        Route("/api/events", stream_events, methods=["GET"]),
+        # everything else, including the non-GET methods of the routes above
+        Mount("/", app=flask_app),
+    ],
+    middleware=[
+        Middleware(RequestMetrics),
+        Middleware(CORSMiddleware, allow_origins=["http://localhost:8080", "http://localhost:5173"],
+                   allow_credentials=True, allow_methods=["*"],
+                   allow_headers=["Content-Type", "X-User-Id", "Idempotency-Key"],
+                   expose_headers=["X-Next-Cursor", "X-Weights-Version"]),
+    ],
+    exception_handlers={main.UserNotFound: handle_user_not_found, Exception: handle_unexpected_error},
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.getenv("PORT", "8000"))
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    logger.info("Starting EcoRewards ASGI API on 0.0.0.0:%s with %s worker(s)", port, workers)
+    uvicorn.run("asgi:app", host="0.0.0.0", port=port, workers=workers, log_level="warning")
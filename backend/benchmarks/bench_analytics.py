@@ -0,0 +1,135 @@
+"""
+Benchmark of the columnar impact analytics.
+
+Writes --events synthetic events as analytics segments and builds the weekly
+impact report from them with 1, 2 and 4 aggregation processes (cold: no
+partial sums cached), then once more with the partial sums cached and only the
+last segment changed, as on repeated /api/admin/impact requests. It also logs
+--export-events events to a temporary SQLite database and times their export
+into segments, which bounds the first export of a large event log. Run from
+the backend directory:
+
+    python benchmarks/bench_analytics.py [--events 100000000] [--export-events 1000000]
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Point the app at a throwaway database before database.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/analytics.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from sqlalchemy import insert
+
+import analytics
+import database
+import synthetic
+
+WORKER_COUNTS = (1, 2, 4)
+N_CHALLENGES = 14
+FIRST_DAY = datetime(2024, 1, 1)
+DAYS = 730
+
+
+def write_segments(directory: Path, n_events: int, segment_events: int, seed: int = 0):
+    """Segment files of synthetic events: mostly completions, some redemptions and starts, over two years."""
+    rng = np.random.default_rng(seed)
+    challenges = synthetic.make_challenges(N_CHALLENGES, seed=seed)
+    challenge_ids = [c["id"] for c in challenges]
+    categories = [c["category"] for c in challenges]
+    first_week = analytics.week_of(FIRST_DAY.date())
+    for number, first_id in enumerate(range(0, n_events, segment_events)):
+        n = min(segment_events, n_events - first_id)
+        events = np.empty(n, dtype=analytics.EVENT_DTYPE)
+        events["offset"] = np.arange(n)
+        # ids follow time, so each segment covers a stretch of weeks
+        events["week"] = first_week + (first_id + np.arange(n)) * (DAYS // 7) // n_events
+        types = rng.choice([analytics.TYPE_CODES[database.EARNED], analytics.TYPE_CODES[database.REDEEMED],
+                            analytics.TYPE_CODES[database.CHALLENGE_STARTED]], size=n, p=[0.7, 0.1, 0.2])
+        events["type"] = types
+        events["challenge"] = np.where(types == analytics.TYPE_CODES[database.REDEEMED], analytics.NO_CHALLENGE,
+                                       rng.integers(0, N_CHALLENGES, size=n))
+        events["amount"] = np.where(types == analytics.TYPE_CODES[database.EARNED], rng.integers(10, 100, size=n),
+                                    np.where(types == analytics.TYPE_CODES[database.REDEEMED], -200, 0))
+        analytics._write_segment(analytics.segment_path(directory, number), first_id, events, challenge_ids, categories)
+
+
+def log_events(n_events: int, seed: int = 0):
+    """Log n_events wallet events for 1000 users into the temporary database."""
+    rng = np.random.default_rng(seed)
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        db.execute(insert(database.User), [{"id": f"bench-{u}", "wallet_balance": 0} for u in range(1000)])
+        database.load_challenges(db, synthetic.make_challenges(N_CHALLENGES, seed=seed))
+        for start in range(0, n_events, 50000):
+            n = min(50000, n_events - start)
+            users = rng.integers(0, 1000, size=n).tolist()
+            challenges = rng.integers(1, N_CHALLENGES + 1, size=n).tolist()
+            minutes = (np.arange(start, start + n) * (DAYS * 1440 // n_events)).tolist()
+            db.execute(insert(database.WalletEvent), [
+                {"user_id": f"bench-{u}", "type": database.EARNED, "amount": 50, "challenge_id": str(c),
+                 "created_at": FIRST_DAY + timedelta(minutes=m)}
+                for u, c, m in zip(users, challenges, minutes)
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100_000_000)
+    parser.add_argument("--segment-events", type=int, default=analytics.SEGMENT_EVENTS)
+    parser.add_argument("--export-events", type=int, default=1_000_000, help="0 to skip the export benchmark")
+    args = parser.parse_args()
+
+    directory = Path(tmp_dir) / "segments"
+    directory.mkdir()
+    started = time.perf_counter()
+    write_segments(directory, args.events, args.segment_events)
+    size = sum(p.stat().st_size for p in directory.iterdir())
+    print(f"{args.events:,} events in {len(list(directory.iterdir()))} segments, {size / 2**20:,.0f} MiB "
+          f"({size / args.events:.1f} bytes/event), written in {time.perf_counter() - started:.1f} s")
+
+    print(f"{'workers':>7} {'report s':>9} {'events/s':>13}")
+    for workers in WORKER_COUNTS:
+        analytics._partials.clear()
+        started = time.perf_counter()
+        report = analytics.impact_report(directory, workers=workers)
+        seconds = time.perf_counter() - started
+        assert report["events"] == args.events
+        print(f"{workers:>7} {seconds:>9.2f} {args.events / seconds:>13,.0f}")
+    # repeated report: only the last segment changed
+    os.utime(sorted(directory.iterdir())[-1])
+    started = time.perf_counter()
+    analytics.impact_report(directory, workers=1)
+    print(f"repeated report with the partial sums cached: {(time.perf_counter() - started) * 1000:.0f} ms")
+    shutil.rmtree(directory)
+
+    if args.export_events:
+        log_events(args.export_events)
+        db = database.SessionLocal()
+        try:
+            started = time.perf_counter()
+            exported = analytics.export(db, Path(tmp_dir) / "exported", args.segment_events)
+            seconds = time.perf_counter() - started
+        finally:
+            db.close()
+        print(f"export from SQLite: {exported:,} events in {seconds:.1f} s ({exported / seconds:,.0f} events/s)")
+
+
+if __name__ == "__main__":
+    main()
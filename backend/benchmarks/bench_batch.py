@@ -0,0 +1,127 @@
+"""
+Latency of loading the home screen: separate calls versus one POST /api/batch.
+
+Starts the Flask server against a temporary SQLite database and loads the five
+home screen endpoints --iterations times each way:
+- sequential: one request after another over a kept-alive connection, as the
+  frontend does today (5 round trips);
+- parallel: the five requests at once over five connections (1 round trip, 5
+  connections, as a browser with HTTP/1.1 can do);
+- batch / batch+gzip: one POST /api/batch (1 round trip).
+It reports the p50 / p95 time measured on localhost, the bytes received, and the
+p50 once the network round-trip time of --rtt-ms (e.g. a mobile network) is
+added for each sequential round trip. Run from the backend directory:
+
+    python benchmarks/bench_batch.py [--iterations 200] [--rtt-ms 50,150]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from load_test import wait_until_up
+
+backend_dir = Path(__file__).parent.parent
+
+HOME_SCREEN = [
+    "/api/user/profile",
+    "/api/challenges/personalized",
+    "/api/user/stats",
+    "/api/wallet/transactions",
+    "/api/wallet/redemptions",
+]
+SERVER = [sys.executable, "-c",
+          "import main, logging; main.logger.setLevel(logging.WARNING); "
+          "logging.getLogger('werkzeug').setLevel(logging.ERROR); "
+          "main.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+
+
+def request(connection: http.client.HTTPConnection, method: str, path: str, body: bytes | None = None,
+            headers: dict | None = None) -> int:
+    """Send one request and read the whole response; returns the bytes received."""
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    data = response.read()
+    assert response.status == 200, (path, response.status, data[:200])
+    return len(data)
+
+
+def sequential(connections) -> int:
+    return sum(request(connections[0], "GET", path) for path in HOME_SCREEN)
+
+
+def make_parallel(pool: ThreadPoolExecutor):
+    def parallel(connections) -> int:
+        return sum(pool.map(lambda i: request(connections[i], "GET", HOME_SCREEN[i]), range(len(HOME_SCREEN))))
+    return parallel
+
+
+BATCH_BODY = json.dumps({"requests": [{"id": path, "method": "GET", "path": path} for path in HOME_SCREEN]}).encode()
+
+
+def batch(connections) -> int:
+    return request(connections[0], "POST", "/api/batch", BATCH_BODY, {"Content-Type": "application/json"})
+
+
+def batch_gzip(connections) -> int:
+    return request(connections[0], "POST", "/api/batch", BATCH_BODY,
+                   {"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+
+
+def measure(load, port: int, iterations: int) -> tuple[np.ndarray, int]:
+    connections = [http.client.HTTPConnection("127.0.0.1", port) for _ in HOME_SCREEN]
+    try:
+        load(connections)  # warm up the connections and the server's caches
+        seconds = np.empty(iterations)
+        for i in range(iterations):
+            started = time.perf_counter()
+            received = load(connections)
+            seconds[i] = time.perf_counter() - started
+    finally:
+        for connection in connections:
+            connection.close()
+    return seconds, received
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=lambda text: [float(v) for v in text.split(",")], default=[50.0, 150.0],
+                        help="network round-trip times to add, comma-separated")
+    parser.add_argument("--port", type=int, default=18100)
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tempfile.mkdtemp()}/batch.db")
+    subprocess.run([sys.executable, "-c", "import main; main.ensure_database()"], cwd=backend_dir, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server = subprocess.Popen([part.format(port=args.port) for part in SERVER], cwd=backend_dir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(args.port)
+        with ThreadPoolExecutor(max_workers=len(HOME_SCREEN)) as pool:
+            modes = [("sequential", sequential, len(HOME_SCREEN)), ("parallel", make_parallel(pool), 1),
+                     ("batch", batch, 1), ("batch+gzip", batch_gzip, 1)]
+            rtt_columns = "".join(f" {f'p50 @{rtt:.0f}ms':>12}" for rtt in args.rtt_ms)
+            print(f"home screen ({len(HOME_SCREEN)} endpoints), {args.iterations} loads per mode")
+            print(f"{'mode':<11} {'round trips':>11} {'p50 ms':>8} {'p95 ms':>8} {'bytes':>8}{rtt_columns}")
+            for name, load, round_trips in modes:
+                seconds, received = measure(load, args.port, args.iterations)
+                p50, p95 = np.percentile(seconds, 50) * 1000, np.percentile(seconds, 95) * 1000
+                with_rtt = "".join(f" {p50 + round_trips * rtt:>12.1f}" for rtt in args.rtt_ms)
+                print(f"{name:<11} {round_trips:>11} {p50:>8.1f} {p95:>8.1f} {received:>8,}{with_rtt}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
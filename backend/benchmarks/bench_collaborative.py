@@ -0,0 +1,92 @@
+"""
+Benchmark for the collaborative-filtering recommender.
+
+Generates a wallet event log for users with clustered tastes (each cluster
+prefers a few challenges), then measures: training from the full log, an
+incremental update with a small batch of new events, rebuilding the item
+embeddings, and scoring one user and blending their scores with the
+answer-based ones (as rank_challenges does). Run from the backend directory:
+
+    python benchmarks/bench_collaborative.py [--users 100000] [--challenges 14]
+"""
+
+from pathlib import Path
+import argparse
+import sys
+import time
+
+import numpy as np
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from database import EARNED, CHALLENGE_STARTED, CHALLENGE_STOPPED
+from recommendation.collaborative import CollaborativeRecommender, CollaborativeState, item_embeddings
+
+N_CLUSTERS = 8
+
+
+def make_events(n_users: int, n_challenges: int, events_per_user: int, seed: int = 0, first_id: int = 1):
+    """(id, user_id, type, amount, challenge_id) rows in id order, as iter_event_batches yields them."""
+    rng = np.random.default_rng(seed)
+    preferences = rng.dirichlet(np.full(n_challenges, 0.3), size=N_CLUSTERS)
+    clusters = rng.integers(0, N_CLUSTERS, size=n_users)
+    kinds = rng.choice((EARNED, CHALLENGE_STARTED, CHALLENGE_STOPPED), p=(0.8, 0.15, 0.05),
+                       size=n_users * events_per_user)
+    events = []
+    for user in range(n_users):
+        items = rng.choice(n_challenges, size=events_per_user, p=preferences[clusters[user]]) + 1
+        for j, item in enumerate(items.tolist()):
+            events.append((first_id + len(events), f"user-{user}", kinds[user * events_per_user + j], 0, str(item)))
+    return events
+
+
+def timed(label: str, fn, items: int | None = None):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    rate = f"  {items / elapsed:12,.0f} items/s" if items else ""
+    print(f"{label:<40} {elapsed * 1000:10.2f} ms{rate}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--challenges", type=int, default=14)
+    parser.add_argument("--events-per-user", type=int, default=20)
+    args = parser.parse_args()
+
+    events = make_events(args.users, args.challenges, args.events_per_user)
+    model = CollaborativeRecommender([str(i + 1) for i in range(args.challenges)])
+    print(f"{len(events):,} events, {args.users:,} users, {args.challenges} challenges")
+
+    timed("train: apply_events (full log)", lambda: model.apply_events(events), items=len(events))
+    embeddings = timed("train: item_embeddings", lambda: item_embeddings(model._cooccurrence, model.dim))
+
+    new_events = make_events(1_000, args.challenges, 5, seed=1, first_id=len(events) + 1)
+    timed("update: apply_events (5,000 new)", lambda: model.apply_events(new_events), items=len(new_events))
+    model.state = timed("update: item_embeddings",
+                        lambda: CollaborativeState(item_embeddings(model._cooccurrence, model.dim), len(events)))
+    print(f"embedding dim {embeddings.shape[1]}")
+
+    rng = np.random.default_rng(2)
+    user_ids = [f"user-{u}" for u in rng.integers(0, args.users, size=10_000).tolist()]
+    static_scores = rng.standard_normal(args.challenges)
+
+    start = time.perf_counter()
+    for user_id in user_ids:
+        model.score(user_id)
+    per_user = (time.perf_counter() - start) / len(user_ids)
+    print(f"{'serve: score one user':<40} {per_user * 1e6:10.1f} us")
+
+    start = time.perf_counter()
+    for user_id in user_ids:
+        model.blend(user_id, static_scores)
+    per_user = (time.perf_counter() - start) / len(user_ids)
+    print(f"{'serve: blend one user':<40} {per_user * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Benchmark of the database layer: journal mode, read routing and bulk helpers.
+
+Mixed load: --readers threads look users and their last transactions up (as
+the profile and wallet routes do) while --writers threads record rewards, for
+--seconds each, in three setups on a fresh SQLite file:
+- rollback: SQLite's default rollback journal;
+- wal: WAL journal with synchronous=NORMAL (the default now);
+- wal+replica: WAL, with the reads on a read-only engine of their own, the local
+  stand-in for a read replica.
+With --database-url (e.g. a local Postgres) the setups are "primary" and
+"replica" (--replica-url, by default the same server through a second pool).
+
+Then it compares the per-call commits of create_user / save_onboarding with
+the bulk create_users / save_onboardings helpers. Run from the backend directory:
+
+    python benchmarks/bench_database.py [--users 2000] [--readers 8] [--writers 2] [--seconds 5]
+"""
+
+from pathlib import Path
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+tmp_dir = tempfile.mkdtemp()
+# Point the app at a throwaway database before database.py creates its engine
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/setup.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from sqlalchemy.orm import sessionmaker
+
+import database
+import synthetic
+
+
+def seed(url: str, n_users: int):
+    database.configure(url)
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        database.bulk_load_users(db, synthetic.make_users(n_users, 8, 14, 20, habits_per_user=0))
+    finally:
+        db.close()
+
+
+def mixed_load(write_engine, read_engine, n_users: int, readers: int, writers: int, seconds: float) -> dict:
+    write_session, read_session = sessionmaker(bind=write_engine), sessionmaker(bind=read_engine)
+    stop = time.perf_counter() + seconds
+    latencies = {"read": [], "write": []}
+    errors = []
+    lock = threading.Lock()
+
+    def reader(seed: int):
+        rng, done = random.Random(seed), []
+        db = read_session()
+        while time.perf_counter() < stop:
+            user_id = f"bench-{rng.randrange(n_users)}"
+            started = time.perf_counter()
+            try:
+                database.get_user_by_id(db, user_id)
+                database.get_transactions_page(db, user_id, 50)
+                db.rollback()  # end the read transaction, as closing a request session does
+            except Exception as e:
+                db.rollback()
+                with lock:
+                    errors.append(e)
+                continue
+            done.append(time.perf_counter() - started)
+        db.close()
+        with lock:
+            latencies["read"].extend(done)
+
+    def writer(seed: int):
+        rng, done = random.Random(seed), []
+        db = write_session()
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            try:
+                database.record_earned(db, f"bench-{rng.randrange(n_users)}", 10, "bench")
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                with lock:
+                    errors.append(e)
+                continue
+            done.append(time.perf_counter() - started)
+        db.close()
+        with lock:
+            latencies["write"].extend(done)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(1000 + i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        "reads_per_s": len(latencies["read"]) / seconds,
+        "writes_per_s": len(latencies["write"]) / seconds,
+        "read_p95_ms": float(np.percentile(latencies["read"], 95) * 1000) if latencies["read"] else 0.0,
+        "write_p95_ms": float(np.percentile(latencies["write"], 95) * 1000) if latencies["write"] else 0.0,
+        "errors": len(errors),
+    }
+
+
+def bulk_helpers(url: str, n: int, batch: int) -> list[tuple[str, float]]:
+    """Rows/s of the per-call commit helpers and of their bulk versions."""
+    database.configure(url)
+    db = database.SessionLocal()
+    run = time.time_ns()
+    results = []
+    try:
+        started = time.perf_counter()
+        for i in range(n):
+            database.create_user(db, {"id": f"one-{run}-{i}", "name": "New User"})
+        results.append(("create_user (commit each)", n / (time.perf_counter() - started)))
+
+        started = time.perf_counter()
+        for start in range(0, n, batch):
+            database.create_users(db, [{"id": f"bulk-{run}-{i}", "name": "New User"}
+                                       for i in range(start, min(start + batch, n))])
+            db.commit()
+        results.append((f"create_users (commit per {batch})", n / (time.perf_counter() - started)))
+
+        answers = {str(q + 1): 1 for q in range(8)}
+        started = time.perf_counter()
+        for i in range(n):
+            database.save_onboarding(db, f"one-{run}-{i}", {"answers": answers})
+        results.append(("save_onboarding (commit each)", n / (time.perf_counter() - started)))
+
+        started = time.perf_counter()
+        for start in range(0, n, batch):
+            database.save_onboardings(db, [{"user_id": f"bulk-{run}-{i}", "answers": answers}
+                                           for i in range(start, min(start + batch, n))])
+            db.commit()
+        results.append((f"save_onboardings (commit per {batch})", n / (time.perf_counter() - started)))
+    finally:
+        db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--bulk-rows", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--database-url", help="server database to use instead of temporary SQLite files")
+    parser.add_argument("--replica-url", help="read replica of --database-url (default: a second pool on it)")
+    args = parser.parse_args()
+
+    if args.database_url:
+        setups = [("primary", args.database_url, None, True), ("replica", args.database_url,
+                                                                args.replica_url or args.database_url, True)]
+    else:
+        setups = []
+        for name, wal, replica in (("rollback", False, False), ("wal", True, False), ("wal+replica", True, True)):
+            path = f"{tmp_dir}/{name}.db"
+            setups.append((name, f"sqlite:///{path}", f"sqlite:///file:{path}?mode=ro&uri=true" if replica else None,
+                           wal))
+
+    print(f"{args.users:,} users, {args.readers} readers and {args.writers} writers for {args.seconds:.0f} s each")
+    print(f"{'setup':<12} {'reads/s':>9} {'writes/s':>9} {'read p95 ms':>12} {'write p95 ms':>13} {'errors':>7}")
+    for name, url, replica_url, wal in setups:
+        database.SQLITE_WAL = wal
+        seed(url, args.users)
+        write_engine = database.make_engine(url)
+        read_engine = database.make_engine(replica_url, read_only=True) if replica_url else write_engine
+        r = mixed_load(write_engine, read_engine, args.users, args.readers, args.writers, args.seconds)
+        print(f"{name:<12} {r['reads_per_s']:>9,.0f} {r['writes_per_s']:>9,.0f} {r['read_p95_ms']:>12.1f} "
+              f"{r['write_p95_ms']:>13.1f} {r['errors']:>7}")
+        for engine in {write_engine, read_engine}:
+            engine.dispose()
+
+    print()
+    database.SQLITE_WAL = True
+    for name, rows_per_s in bulk_helpers(setups[-1][1], args.bulk_rows, args.batch):
+        print(f"{name:<36} {rows_per_s:>10,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark of the leaderboard ranking indexes at 1M and 10M users.
+
+For each --users size, builds Leaderboards from synthetic scores spread over
+--regions regions and reports
+- build: the bulk load from arrays, as done at startup after reading the users table;
+- update: a reward event (every metric of one user set, as after a completion);
+- top / rank / around: the top --top users, one user's rank and the --k users
+  around them, globally and in the user's region;
+- friends: a leaderboard of one user and --friends others.
+Each operation is run --operations times and reported as p50 / p95 microseconds.
+
+Then --rebuild-users users are written to a temporary SQLite database and read
+back by Leaderboards.rebuild, to measure the read side of a startup. Run from
+the backend directory:
+
+    python benchmarks/bench_leaderboards.py [--users 1000000,10000000] [--operations 20000]
+"""
+
+from pathlib import Path
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Point the app at a throwaway database before database.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/leaderboards.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from sqlalchemy import insert
+
+import database
+from leaderboards import METRICS, Leaderboards
+
+
+def make_scores(n_users: int, n_regions: int, seed: int = 0):
+    """User ids, regions and per-metric scores with the long tail of real activity."""
+    rng = np.random.default_rng(seed)
+    completed = rng.geometric(0.02, size=n_users) - 1
+    scores = {
+        "challengesCompleted": completed,
+        "totalImpact": completed * rng.integers(10, 100, size=n_users),
+        "longestStreak": np.minimum(completed, rng.geometric(0.1, size=n_users) - 1),
+    }
+    regions = [f"region-{r}" for r in range(n_regions)]
+    user_regions = [regions[r] for r in rng.integers(0, n_regions, size=n_users).tolist()]
+    return [f"bench-{i}" for i in range(n_users)], user_regions, scores
+
+
+def timed(operation, arguments) -> tuple[float, float]:
+    """p50 and p95 of operation(*a) over the arguments, in microseconds."""
+    latencies = np.empty(len(arguments))
+    for i, a in enumerate(arguments):
+        started = time.perf_counter()
+        operation(*a)
+        latencies[i] = time.perf_counter() - started
+    return float(np.percentile(latencies, 50) * 1e6), float(np.percentile(latencies, 95) * 1e6)
+
+
+def run(n_users: int, n_regions: int, operations: int, top: int, k: int, n_friends: int):
+    user_ids, regions, scores = make_scores(n_users, n_regions)
+    leaderboards = Leaderboards()
+    started = time.perf_counter()
+    leaderboards.load(user_ids, regions, scores)
+    print(f"{n_users:,} users, {n_regions} regions: built in {time.perf_counter() - started:.1f} s")
+
+    rng = np.random.default_rng(1)
+    users = [user_ids[i] for i in rng.integers(0, n_users, size=operations).tolist()]
+    current = {metric: scores[metric] for metric in METRICS}
+
+    def reward(user_id: str, region: str, slot: int):
+        # one more completion, its impact, and a streak that may have grown
+        values = {METRICS[metric]: int(current[metric][slot]) for metric in METRICS}
+        values["total_challenges_completed"] += 1
+        values["total_impact"] += 50
+        values["longest_streak"] += slot % 2
+        leaderboards.update(user_id, region, values)
+
+    slots = [int(user_id.removeprefix("bench-")) for user_id in users]
+    rows = [
+        ("update", reward, [(u, regions[s], s) for u, s in zip(users, slots)]),
+        ("top", leaderboards.top, [("totalImpact", top)] * operations),
+        ("top region", leaderboards.top, [("totalImpact", top, regions[s]) for s in slots]),
+        ("rank", leaderboards.rank, [("totalImpact", u) for u in users]),
+        ("rank region", leaderboards.rank, [("totalImpact", u, regions[s]) for u, s in zip(users, slots)]),
+        ("around", leaderboards.around, [("totalImpact", u, k) for u in users]),
+        ("around region", leaderboards.around, [("totalImpact", u, k, regions[s]) for u, s in zip(users, slots)]),
+        ("friends", leaderboards.among,
+         [("totalImpact", [u, *(user_ids[f] for f in rng.integers(0, n_users, size=n_friends).tolist())])
+          for u in users]),
+    ]
+    print(f"{'operation':<14} {'p50 us':>8} {'p95 us':>8}")
+    for name, operation, arguments in rows:
+        p50, p95 = timed(operation, arguments)
+        print(f"{name:<14} {p50:>8.1f} {p95:>8.1f}")
+
+
+def run_rebuild(n_users: int, n_regions: int):
+    user_ids, regions, scores = make_scores(n_users, n_regions)
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        for start in range(0, n_users, 50000):
+            db.execute(insert(database.User), [
+                {"id": user_ids[i], "name": user_ids[i], "wallet_balance": 0, "region": regions[i],
+                 **{column: int(scores[metric][i]) for metric, column in METRICS.items()}}
+                for i in range(start, min(start + 50000, n_users))
+            ])
+        db.commit()
+        started = time.perf_counter()
+        loaded = Leaderboards().rebuild(db)
+    finally:
+        db.close()
+    seconds = time.perf_counter() - started
+    print(f"rebuild from the users table: {loaded:,} users in {seconds:.1f} s ({loaded / seconds:,.0f} users/s)")
+
+
+def ints(text: str) -> list[int]:
+    return [int(v) for v in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=ints, default=[1_000_000, 10_000_000])
+    parser.add_argument("--regions", type=int, default=20)
+    parser.add_argument("--operations", type=int, default=20_000)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--k", type=int, default=5, help="users listed above and below in 'around'")
+    parser.add_argument("--friends", type=int, default=50)
+    parser.add_argument("--rebuild-users", type=int, default=200_000, help="0 to skip the database rebuild")
+    args = parser.parse_args()
+
+    for n_users in args.users:
+        run(n_users, args.regions, args.operations, args.top, args.k, args.friends)
+        print()
+    if args.rebuild_users:
+        run_rebuild(args.rebuild_users, args.regions)
+
+
+if __name__ == "__main__":
+    main()
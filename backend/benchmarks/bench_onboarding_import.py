@@ -0,0 +1,86 @@
+"""
+Benchmark for bulk onboarding ingestion.
+
+Writes a CSV export of 200k onboarding surveys (1% of them invalid) and imports
+it with onboarding_import.ingest into a temporary SQLite database. For
+comparison, a sample goes through the single-user POST /api/onboarding endpoint
+one survey at a time. Run from the backend directory:
+
+    python benchmarks/bench_onboarding_import.py [--rows 200000]
+"""
+
+from pathlib import Path
+import argparse
+import csv
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Point the app at a throwaway database before main.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+import database
+import main
+import onboarding_import
+
+PER_REQUEST_SAMPLE = 1_000
+
+
+def write_export(path: str, n_rows: int, n_questions: int):
+    rng = np.random.default_rng(0)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id", "name"] + [f"q{i + 1}" for i in range(n_questions)])
+        for start in range(0, n_rows, 10_000):
+            answers = rng.integers(-1, 2, size=(min(10_000, n_rows - start), n_questions)).astype(str)
+            answers[rng.random(answers.shape) < 0.001] = "2"  # ~1% of rows get an invalid answer
+            writer.writerows([f"partner-{start + i}", f"User {start + i}", *row]
+                             for i, row in enumerate(answers.tolist()))
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    main.warmup()
+    n_questions = len(main.get_questions_data())
+    export = os.path.join(tmp_dir, "onboarding.csv")
+    write_export(export, args.rows, n_questions)
+    print(f"export: {args.rows:,} rows, {os.path.getsize(export) / 1e6:.1f} MB")
+
+    db = database.SessionLocal()
+    start = time.perf_counter()
+    with open(export, encoding="utf-8", newline="") as f:
+        records = onboarding_import.iter_records(f, "csv", main.get_questions_data())
+        report = onboarding_import.ingest(db, records, main.get_recommender(), main.get_catalog().ids)
+    elapsed = time.perf_counter() - start
+    db.close()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"bulk ingest:      {elapsed:8.2f} s  {report.processed / elapsed:9,.0f} rows/s  "
+          f"({report.imported:,} imported, {report.rejected:,} rejected, max RSS {max_rss:.0f} MB)")
+
+    # the single-user endpoint, one request per survey
+    client = main.app.test_client()
+    rng = np.random.default_rng(1)
+    answers = rng.integers(-1, 2, size=(PER_REQUEST_SAMPLE, n_questions)).tolist()
+    start = time.perf_counter()
+    for i, row in enumerate(answers):
+        client.post("/api/onboarding", json={"answers": {str(q + 1): v for q, v in enumerate(row)}},
+                    headers={"X-User-Id": f"single-{i}"})
+    elapsed = time.perf_counter() - start
+    print(f"per-request path: {elapsed:8.2f} s  {PER_REQUEST_SAMPLE / elapsed:9,.0f} rows/s  "
+          f"({PER_REQUEST_SAMPLE:,} requests)")
+
+
+if __name__ == "__main__":
+    main_bench()
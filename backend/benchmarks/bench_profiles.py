@@ -0,0 +1,120 @@
+"""
+Benchmark of profile edits: write-behind ProfileStore versus write-through.
+
+Applies --updates profile edits spread over --users users from 1, 4 and 16
+threads, against a temporary SQLite database. Write-through commits every edit
+on its own, as PUT /api/user/profile used to. Write-behind goes through a
+ProfileStore, with its flush worker running. For each mode and thread count the
+benchmark reports
+- acknowledged edits/s: how fast the requests return;
+- durable edits/s: edits committed, counting the final flush, over the total time.
+
+With --hot-share a share of the edits goes to a single user. Run from the
+backend directory:
+
+    python benchmarks/bench_profiles.py [--updates 20000] [--users 10000] [--hot-share 0.5]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Point the app at a throwaway database before database.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/profiles.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from sqlalchemy import select
+
+import database
+from profiles import ProfileStore
+import synthetic
+
+THREAD_COUNTS = (1, 4, 16)
+
+
+def make_edits(n_updates: int, n_users: int, hot_share: float, seed: int = 0) -> list[tuple[str, dict]]:
+    rng = random.Random(seed)
+    edits = []
+    for i in range(n_updates):
+        user = 0 if rng.random() < hot_share else rng.randrange(n_users)
+        edits.append((f"bench-{user}", {"name": f"User {user} v{i}"}))
+    return edits
+
+
+def write_through(user_id: str, changes: dict):
+    db = database.SessionLocal()
+    try:
+        database.bulk_update_users(db, [{"id": user_id, **changes}])
+        db.commit()
+    finally:
+        db.close()
+
+
+def run(mode: str, edits, threads: int) -> tuple[float, float]:
+    """Acknowledged and durable edits per second."""
+    store = ProfileStore() if mode == "write-behind" else None
+    apply = store.update if store is not None else write_through
+    if store is not None:
+        store.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda edit: apply(*edit), edits))
+    acknowledged = time.perf_counter() - started
+    if store is not None:
+        store.close()
+    durable = time.perf_counter() - started
+    return len(edits) / acknowledged, len(edits) / durable
+
+
+def check(edits, threads: int):
+    """No edit is lost: each user ends up with one of their edits, their last one when edited from a single thread."""
+    sent = {}
+    for user_id, changes in edits:
+        sent.setdefault(user_id, []).append(changes["name"])
+    db = database.SessionLocal()
+    try:
+        rows = dict(db.execute(select(database.User.id, database.User.name)
+                               .where(database.User.id.in_(list(sent)))).all())
+    finally:
+        db.close()
+    for user_id, names in sent.items():
+        if threads == 1:
+            assert rows[user_id] == names[-1], (user_id, rows[user_id], names[-1])
+        else:
+            assert rows[user_id] in names, (user_id, rows[user_id])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--hot-share", type=float, default=0.0, help="share of the edits that go to one user")
+    args = parser.parse_args()
+
+    database.init_db()
+    db = database.SessionLocal()
+    database.bulk_load_users(db, synthetic.make_users(args.users, 8, 14, 0, habits_per_user=0))
+    db.close()
+
+    print(f"{args.updates:,} profile edits over {args.users:,} users (hot share {args.hot_share:.0%})")
+    print(f"{'mode':<14} {'threads':>7} {'acknowledged/s':>15} {'durable/s':>12}")
+    for mode in ("write-through", "write-behind"):
+        for threads in THREAD_COUNTS:
+            edits = make_edits(args.updates, args.users, args.hot_share, seed=threads)
+            acknowledged, durable = run(mode, edits, threads)
+            check(edits, threads)
+            print(f"{mode:<14} {threads:>7} {acknowledged:>15,.0f} {durable:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark for StaticChallengeRecommender batch scoring.
+
+Compares the per-user cost of recommend_batch against calling
+recommend_challenges once per user. Run from the backend directory:
+
+    python benchmarks/bench_recommendation.py
+"""
+
+from pathlib import Path
+import sys
+import json
+import time
+
+import numpy as np
+
+# Add the backend directory to sys.path so we can import the recommender
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from recommendation.recommendation import StaticChallengeRecommender
+
+USER_COUNTS = [1, 1_000, 1_000_000]
+# The per-user loop is only timed up to this many users; beyond that it is extrapolated
+LOOP_LIMIT = 10_000
+
+
+def load_questions():
+    with open(Path(backend_dir) / "data" / "question.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def random_answers(n_users: int, n_questions: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(-1, 2, size=(n_users, n_questions), dtype=np.int8)
+
+
+def time_batch(recommender, answers_matrix, k=None, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        recommender.recommend_batch(answers_matrix, k=k)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_loop(recommender, answers_matrix):
+    answers_list = [
+        {q_id + 1: int(a) for q_id, a in enumerate(row)} for row in answers_matrix[:LOOP_LIMIT]
+    ]
+    start = time.perf_counter()
+    for answers in answers_list:
+        recommender.recommend_challenges(answers)
+    return time.perf_counter() - start, len(answers_list)
+
+
+def main():
+    questions = load_questions()
+    recommender = StaticChallengeRecommender(questions)
+
+    print(f"{'users':>10} {'batch (all)':>14} {'batch (k=4)':>14} {'per-user loop':>14}   (microseconds per user)")
+    for n_users in USER_COUNTS:
+        answers_matrix = random_answers(n_users, len(questions))
+
+        batch_all = time_batch(recommender, answers_matrix)
+        batch_top4 = time_batch(recommender, answers_matrix, k=4)
+        loop_total, loop_users = time_loop(recommender, answers_matrix)
+
+        print(f"{n_users:>10} "
+              f"{batch_all / n_users * 1e6:>14.3f} "
+              f"{batch_top4 / n_users * 1e6:>14.3f} "
+              f"{loop_total / loop_users * 1e6:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark for replaying the wallet event log.
+
+Fills a temporary SQLite database with 10M wallet events spread over 10k users
+and measures reading the whole log, replaying it, and rebuilding single wallets
+from the first event versus from their latest snapshot. Run from the backend
+directory (takes a few minutes at the default size):
+
+    python benchmarks/bench_replay.py [--events 10000000] [--users 10000]
+"""
+
+from datetime import datetime
+from pathlib import Path
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Point the app at a throwaway database before database.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+import database
+import ledger
+
+INSERT_CHUNK = 200_000
+# (type, share of the log)
+EVENT_MIX = (
+    (database.EARNED, 0.70),
+    (database.REDEEMED, 0.15),
+    (database.BADGE_AWARDED, 0.05),
+    (database.CHALLENGE_STARTED, 0.05),
+    (database.CHALLENGE_STOPPED, 0.05),
+)
+
+
+def generate_events(n_events: int, n_users: int):
+    rng = random.Random(42)
+    types = [t for t, _ in EVENT_MIX]
+    weights = [w for _, w in EVENT_MIX]
+    created_at = datetime(2024, 1, 1).isoformat(" ")
+    for chunk_start in range(0, n_events, INSERT_CHUNK):
+        size = min(INSERT_CHUNK, n_events - chunk_start)
+        rows = []
+        for type_ in rng.choices(types, weights, k=size):
+            amount = 35 if type_ == database.EARNED else -20 if type_ == database.REDEEMED else 0
+            challenge_id = None if type_ == database.REDEEMED else str(rng.randrange(1, 12))
+            rows.append((str(rng.randrange(n_users)), type_, amount, challenge_id, created_at))
+        yield rows
+
+
+def load_events(n_events: int, n_users: int):
+    # raw executemany: filling the log is setup, not what is measured
+    connection = database.get_engine().raw_connection()
+    try:
+        cursor = connection.cursor()
+        for rows in generate_events(n_events, n_users):
+            cursor.executemany(
+                "INSERT INTO wallet_events (user_id, type, amount, challenge_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def read_log(db):
+    return sum(len(batch) for batch in database.iter_event_batches(db, batch_size=50_000))
+
+
+def replay_log(db):
+    # one fold over the whole log: measures fetch + replay throughput, not per-user states
+    state = ledger.WalletState()
+    for batch in database.iter_event_batches(db, batch_size=50_000):
+        ledger.replay(batch, state)
+    return state
+
+
+def rebuild_sample(db, user_ids, use_snapshot):
+    for user_id in user_ids:
+        ledger.rebuild_wallet(db, user_id, use_snapshot=use_snapshot)
+
+
+def append_recent_events(db, user_ids, per_user: int):
+    """Events logged after the snapshots were taken, like a live system between snapshot runs."""
+    for user_id in user_ids:
+        for _ in range(per_user):
+            database.append_event(db, user_id, database.EARNED, 35, "1")
+    db.commit()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--sample", type=int, default=200, help="wallets rebuilt per measurement")
+    args = parser.parse_args()
+
+    database.init_db()
+    elapsed, _ = timed(lambda: load_events(args.events, args.users))
+    print(f"loaded {args.events:,} events for {args.users:,} users in {elapsed:.1f} s")
+
+    db = database.SessionLocal()
+    try:
+        elapsed, n = timed(lambda: read_log(db))
+        print(f"read whole log:              {elapsed:8.2f} s  {n / elapsed / 1e6:6.2f} M events/s")
+
+        elapsed, state = timed(lambda: replay_log(db))
+        print(f"read + replay whole log:     {elapsed:8.2f} s  {args.events / elapsed / 1e6:6.2f} M events/s")
+
+        batch = next(database.iter_event_batches(db, batch_size=1_000_000))
+        elapsed, _ = timed(lambda: ledger.replay(batch))
+        print(f"replay only (in memory):     {elapsed:8.2f} s  {len(batch) / elapsed / 1e6:6.2f} M events/s "
+              f"({len(batch):,} events)")
+
+        sample = random.Random(7).sample([str(i) for i in range(args.users)], min(args.sample, args.users))
+        per_user = args.events // args.users
+
+        elapsed, written = timed(lambda: ledger.take_snapshots(db, min_events=1))
+        print(f"snapshot all wallets:        {elapsed:8.2f} s  {written:,} snapshots")
+        append_recent_events(db, sample, ledger.SNAPSHOT_EVERY // 2)
+
+        elapsed, _ = timed(lambda: rebuild_sample(db, sample, use_snapshot=False))
+        print(f"rebuild from first event:    {elapsed / len(sample) * 1e3:8.2f} ms per wallet "
+              f"(~{per_user + ledger.SNAPSHOT_EVERY // 2:,} events)")
+        elapsed, _ = timed(lambda: rebuild_sample(db, sample, use_snapshot=True))
+        print(f"rebuild from snapshot:       {elapsed / len(sample) * 1e3:8.2f} ms per wallet "
+              f"({ledger.SNAPSHOT_EVERY // 2} events)")
+
+        for user_id in sample[:20]:
+            assert ledger.rebuild_wallet(db, user_id) == ledger.rebuild_wallet(db, user_id, use_snapshot=False)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main_bench()
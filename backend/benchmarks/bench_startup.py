@@ -0,0 +1,89 @@
+"""
+Cold-start benchmark: import and initialization cost of each component.
+
+Every run is a fresh interpreter that starts the app the way a worker does
+(Flask, SQLAlchemy and the models, main.py, create_app()), then warms up with
+main.warmup(), timed per lazily loaded resource, and serves its first requests.
+With --lazy the warmup is skipped, so the first requests pay for whatever they
+load themselves. Each step is reported as the median over --runs runs, against
+a throwaway SQLite database seeded beforehand. Run from the backend directory:
+
+    python benchmarks/bench_startup.py [--runs 5] [--lazy] [--json]
+"""
+
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+backend_dir = str(Path(__file__).parent.parent)
+
+FIRST_REQUESTS = ("/api/questions", "/api/challenges/personalized")
+
+
+def child(lazy: bool):
+    """Time the startup steps in this (fresh) interpreter and print them as JSON."""
+    steps = []
+
+    def timed(step, fn):
+        started = time.perf_counter()
+        result = fn()
+        steps.append((step, time.perf_counter() - started))
+        return result
+
+    started = time.perf_counter()
+    sys.path.insert(0, backend_dir)
+    timed("import flask", lambda: __import__("flask_cors"))
+    timed("import sqlalchemy", lambda: __import__("sqlalchemy.orm"))
+    timed("import database", lambda: __import__("database"))
+    main = timed("import main", lambda: __import__("main"))
+    app = timed("create_app", main.create_app)
+    if not lazy:
+        main.warmup()
+        steps.extend((f"warmup: {name}", seconds) for name, seconds in main.startup_timings.items())
+    client = app.test_client()
+    for path in FIRST_REQUESTS:
+        response = timed(f"first GET {path}", lambda: client.get(path))
+        assert response.status_code == 200, (path, response.status_code)
+    steps.append(("total", time.perf_counter() - started))
+    print(json.dumps(steps))
+
+
+def run_child(env: dict, lazy: bool) -> list[tuple[str, float]]:
+    command = [sys.executable, __file__, "--child"] + (["--lazy"] if lazy else [])
+    output = subprocess.run(command, cwd=backend_dir, env=env, check=True, capture_output=True, text=True).stdout
+    return [tuple(step) for step in json.loads(output.splitlines()[-1])]
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--lazy", action="store_true", help="skip main.warmup(); first requests load what they use")
+    parser.add_argument("--json", action="store_true", help="print {step: median seconds} as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.lazy)
+        return
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tempfile.mkdtemp()}/startup.db", LOG_LEVEL="WARNING")
+    run_child(env, lazy=False)  # creates and seeds the database; not counted
+
+    runs = [run_child(env, args.lazy) for _ in range(args.runs)]
+    medians = {step: statistics.median(dict(run)[step] for run in runs) for step, _ in runs[0]}
+    if args.json:
+        print(json.dumps(medians, indent=2))
+        return
+    print(f"startup ({'lazy' if args.lazy else 'warmup'}), median of {args.runs} runs:")
+    for step, seconds in medians.items():
+        print(f"  {step:<42} {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,107 @@
+"""
+Benchmark for the wallet transaction history endpoint.
+
+Loads 100k transactions for one user into a temporary SQLite database and
+compares serializing the whole history, cursor-paginated pages (first and
+deep) and the NDJSON export. Run from the backend directory:
+
+    python benchmarks/bench_transactions.py
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Point the app at a throwaway database before main.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from sqlalchemy import insert
+import database
+import main
+
+main.ensure_database()
+
+N_TRANSACTIONS = 100_000
+USER_ID = main.DEFAULT_USER_ID
+
+
+def load_transactions(n: int):
+    db = database.SessionLocal()
+    start = datetime(2024, 1, 1)
+    rows = [
+        {
+            "user_id": USER_ID,
+            "type": "redeemed" if i % 3 == 0 else "earned",
+            "amount": -50 if i % 3 == 0 else 35,
+            "description": f"transaction {i}",
+            "created_at": start + timedelta(minutes=i),
+        }
+        for i in range(n)
+    ]
+    db.execute(insert(database.Transaction), rows)
+    db.commit()
+    db.close()
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def full_history():
+    # what the endpoint did before pagination: load and serialize every row
+    db = database.SessionLocal()
+    try:
+        transactions = db.query(database.Transaction).filter(database.Transaction.user_id == USER_ID).all()
+        return main.app.json.dumps([main.serialize_transaction(t) for t in transactions])
+    finally:
+        db.close()
+
+
+def main_bench():
+    load_transactions(N_TRANSACTIONS)
+    client = main.app.test_client()
+
+    elapsed, body = timed(full_history, repeat=3)
+    print(f"full history (old behaviour): {elapsed * 1e3:9.2f} ms  {len(body) / 1e6:.1f} MB")
+
+    elapsed, response = timed(lambda: client.get("/api/wallet/transactions"))
+    print(f"first page (50):              {elapsed * 1e3:9.2f} ms  {len(response.data) / 1e3:.1f} kB")
+
+    # walk halfway into the history, then time the next page
+    cursor = None
+    for _ in range(N_TRANSACTIONS // 2 // 500):
+        response = client.get("/api/wallet/transactions", query_string={"limit": 500, **({"cursor": cursor} if cursor else {})})
+        cursor = response.headers["X-Next-Cursor"]
+    elapsed, response = timed(lambda: client.get("/api/wallet/transactions", query_string={"cursor": cursor}))
+    print(f"page at offset {N_TRANSACTIONS // 2} (50):      {elapsed * 1e3:9.2f} ms")
+
+    def export():
+        response = client.get("/api/wallet/transactions", query_string={"format": "ndjson"}, buffered=False)
+        return sum(len(chunk) for chunk in response.response)
+
+    elapsed, n_bytes = timed(export, repeat=3)
+    # measured separately, tracemalloc slows the run down considerably
+    tracemalloc.start()
+    export()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"ndjson export:                {elapsed * 1e3:9.2f} ms  {n_bytes / 1e6:.1f} MB streamed, "
+          f"peak Python memory {peak / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main_bench()
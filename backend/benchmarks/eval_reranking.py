@@ -0,0 +1,159 @@
+"""
+Offline evaluation of the diversity and exploration re-ranking.
+
+Replays a log of challenge completions: for each completion, the user is ranked
+as at request time and the completed challenge counts as a hit if it is among
+the top --k. For every (diversity, epsilon) setting of DiversityReranker it
+reports
+- hit rate: share of completions that were in the user's top k;
+- coverage: share of the catalog shown in anyone's top k;
+- categories: mean number of distinct categories in a top k;
+- latency: p50 / p95 of one request ranked on its own, as the endpoint does it,
+  and the throughput of the batch scoring path.
+
+The log comes from the app database (--database, reading DATABASE_URL as the app
+does) or, by default, is generated: synthetic users answer at random and
+complete challenges drawn from their answer-based scores plus a taste per
+category that the weights do not know about. Run from the backend directory:
+
+    python benchmarks/eval_reranking.py [--users 2000] [--k 4] [--diversity 1,0.85,0.7,0.5] [--epsilon 0,0.1]
+    python benchmarks/eval_reranking.py --database [--json]
+"""
+
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+from catalog import Catalog
+from recommendation.recommendation import StaticChallengeRecommender
+from recommendation.reranking import DiversityReranker, request_rng
+import synthetic
+
+DATA_DIR = Path(backend_dir) / "data"
+# requests ranked one at a time for the latency percentiles
+LATENCY_SAMPLE = 2000
+
+
+def load_json(name: str):
+    with open(DATA_DIR / name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synthetic_log(recommender: StaticChallengeRecommender, catalog: Catalog, n_users: int,
+                  completions_per_user: int, seed: int = 0):
+    """Answer dicts per user and (user index, challenge row) completions in log order."""
+    rng = np.random.default_rng(seed)
+    answers = synthetic.make_answers(n_users, len(recommender.questions), seed=seed)
+    categories = [c.get("category") for c in catalog.challenges]
+    codes = {category: code for code, category in enumerate(dict.fromkeys(categories))}
+    taste = rng.normal(scale=1.5, size=(n_users, len(codes)))[:, [codes[c] for c in categories]]
+    scores = answers.astype(np.float64) @ recommender.weights.T
+    scores = (scores - scores.mean(axis=1, keepdims=True)) / scores.std(axis=1, keepdims=True)
+    preference = np.exp(scores + taste)
+    preference /= preference.sum(axis=1, keepdims=True)
+    log = [(user, int(rng.choice(len(catalog), p=preference[user])))
+           for _ in range(completions_per_user) for user in range(n_users)]
+    return synthetic.answers_dicts(answers), log
+
+
+def database_log(catalog: Catalog):
+    """Answer dicts of the onboarded users and their logged completions, from the app database."""
+    import database
+    from sqlalchemy import select
+
+    db = database.SessionLocal()
+    try:
+        users = db.execute(select(database.User.id, database.User.answers)
+                           .where(database.User.answers.is_not(None))).all()
+        rows = {user_id: row for row, (user_id, _) in enumerate(users)}
+        log = []
+        for batch in database.iter_event_batches(db):
+            for _, user_id, type, _, challenge_id in batch:
+                if type == database.EARNED and user_id in rows and challenge_id in catalog.positions:
+                    log.append((rows[user_id], catalog.positions[challenge_id]))
+    finally:
+        db.close()
+    return [{int(q): a for q, a in answers.items()} for _, answers in users], log
+
+
+def evaluate(recommender, catalog: Catalog, reranker: DiversityReranker, answers: list[dict], log, k: int) -> dict:
+    matrix = recommender.answers_to_matrix(answers)
+    categories = np.array([c.get("category") or "" for c in catalog.challenges])
+
+    # every logged completion is one request, all ranked in one pass of the batch scoring path
+    requested = np.array([user for user, _ in log], dtype=np.intp)
+    completed = np.array([row for _, row in log], dtype=np.intp)
+    started = time.perf_counter()
+    rankings, _ = recommender.recommend_batch(matrix[requested], k=k, reranker=reranker,
+                                              rng=np.random.default_rng(0))
+    batch_seconds = time.perf_counter() - started
+
+    latencies = []
+    for n in range(min(LATENCY_SAMPLE, len(log))):
+        user = int(requested[n])
+        started = time.perf_counter()
+        recommender(answers[user], k=k, reranker=reranker, rng=request_rng(user, n))
+        latencies.append(time.perf_counter() - started)
+
+    hits = (rankings == completed[:, None]).any(axis=1)
+    return {
+        "diversity": reranker.diversity,
+        "epsilon": reranker.epsilon,
+        "hit_rate": float(hits.mean()) if len(log) else 0.0,
+        "coverage": len(np.unique(rankings)) / len(catalog),
+        "categories": float(np.mean([len(set(row)) for row in categories[rankings].tolist()])) if len(log) else 0.0,
+        "p50_us": float(np.percentile(latencies, 50) * 1e6) if latencies else 0.0,
+        "p95_us": float(np.percentile(latencies, 95) * 1e6) if latencies else 0.0,
+        "batch_requests_per_s": len(log) / batch_seconds if batch_seconds else 0.0,
+    }
+
+
+def floats(text: str) -> list[float]:
+    return [float(v) for v in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", action="store_true", help="replay the app database instead of a synthetic log")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--completions-per-user", type=int, default=5)
+    parser.add_argument("--k", type=int, default=4, help="positions that count as shown")
+    parser.add_argument("--diversity", type=floats, default=[1.0, 0.85, 0.7, 0.5])
+    parser.add_argument("--epsilon", type=floats, default=[0.0, 0.1])
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    catalog = Catalog(load_json("challenge.json"))
+    recommender = StaticChallengeRecommender(load_json("question.json"))
+    if args.database:
+        from recommendation.weights_registry import WeightsRegistry
+        version, weights = WeightsRegistry(catalog, len(recommender.questions)).load_current()
+        recommender.set_weights(weights, version)
+        answers, log = database_log(catalog)
+    else:
+        answers, log = synthetic_log(recommender, catalog, args.users, args.completions_per_user)
+
+    results = [evaluate(recommender, catalog, DiversityReranker.from_catalog(catalog, diversity=d, epsilon=e),
+                        answers, log, args.k)
+               for d in args.diversity for e in args.epsilon]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(log):,} completions by {len(answers):,} users, {len(catalog)} challenges, top {args.k}")
+    print(f"{'diversity':>9} {'epsilon':>7} {'hit rate':>9} {'coverage':>9} {'categories':>10} "
+          f"{'p50 us':>8} {'p95 us':>8} {'batch req/s':>12}")
+    for r in results:
+        print(f"{r['diversity']:>9.2f} {r['epsilon']:>7.2f} {r['hit_rate']:>9.3f} {r['coverage']:>9.2f} "
+              f"{r['categories']:>10.2f} {r['p50_us']:>8.1f} {r['p95_us']:>8.1f} {r['batch_requests_per_s']:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
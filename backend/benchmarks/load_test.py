@@ -0,0 +1,141 @@
+"""
+Load test comparing the Flask server (main.py) with the ASGI server (asgi.py).
+
+Starts both servers against the same temporary SQLite database, then keeps
+--concurrency connections busy on each endpoint for --duration seconds and
+reports requests/sec and p50 / p99 latency. Run from the backend directory:
+
+    python benchmarks/load_test.py [--concurrency 200] [--duration 5]
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+backend_dir = Path(__file__).parent.parent
+
+ENDPOINTS = [
+    "/api/questions",
+    "/api/wallet/redemptions",
+    "/api/user/profile",
+    "/api/challenges/personalized",
+    "/api/user/stats",
+    "/api/wallet/transactions",
+]
+
+SERVERS = {
+    "flask": [sys.executable, "-c",
+              "import main, logging; main.logger.setLevel(logging.WARNING); "
+              "logging.getLogger('werkzeug').setLevel(logging.ERROR); "
+              "main.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    "asgi": [sys.executable, "-c",
+             "import uvicorn, asgi, logging; asgi.logger.setLevel(logging.WARNING); "
+             "uvicorn.run(asgi.app, host='127.0.0.1', port={port}, log_level='warning')"],
+}
+
+
+async def fetch(host: str, port: int, path: str, connection):
+    """Send one GET over a kept-alive connection; reconnects when the server closes it."""
+    if connection[0] is None:
+        connection[0], connection[1] = await asyncio.open_connection(host, port)
+    reader, writer = connection
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+
+    head = await reader.readuntil(b"\r\n\r\n")
+    headers = head.decode("latin-1").lower()
+    status = int(headers.split(" ", 2)[1])
+    length = int(headers.split("content-length:", 1)[1].split("\r\n", 1)[0]) if "content-length:" in headers else None
+    if length is not None:
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+    if length is None or "connection: close" in headers or headers.startswith("http/1.0"):
+        writer.close()
+        connection[0] = connection[1] = None
+    return status
+
+
+async def run_load(port: int, path: str, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        connection = [None, None]
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await fetch("127.0.0.1", port, path, connection)
+            except (OSError, asyncio.IncompleteReadError):
+                errors += 1
+                connection[0] = connection[1] = None
+                continue
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else float("nan")
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else float("nan")
+    return len(latencies) / elapsed, p50, p99, errors
+
+
+def wait_until_up(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--base-port", type=int, default=18000)
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tempfile.mkdtemp()}/load.db")
+    # create and seed the database once, before both servers start
+    subprocess.run([sys.executable, "-c", "import main; main.ensure_database()"], cwd=backend_dir, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    processes = {}
+    try:
+        for offset, (name, command) in enumerate(SERVERS.items()):
+            port = args.base_port + offset
+            command = [part.format(port=port) for part in command]
+            processes[name] = (port, subprocess.Popen(command, cwd=backend_dir, env=env,
+                                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for port, _ in processes.values():
+            wait_until_up(port)
+
+        print(f"{args.concurrency} concurrent connections, {args.duration:.0f}s per endpoint")
+        print(f"{'endpoint':<32} {'server':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for path in ENDPOINTS:
+            for name, (port, _) in processes.items():
+                rps, p50, p99, errors = asyncio.run(run_load(port, path, args.concurrency, args.duration))
+                print(f"{path:<32} {name:<6} {rps:>9.0f} {p50 * 1e3:>9.1f} {p99 * 1e3:>9.1f} {errors:>7}")
+    finally:
+        for _, process in processes.values():
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
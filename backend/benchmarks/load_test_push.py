@@ -0,0 +1,196 @@
+"""
+Load test of the /api/events push streams: how many idle streams one process holds.
+
+Seeds --connections users into a temporary SQLite database, starts the ASGI
+server (asgi.py) and/or the threaded Flask server (main.py) on it, and opens one
+event stream per user. It reports how long opening them took, then holds them
+open for --idle seconds and counts the heartbeats each stream got. It also
+reports the server process's memory (RSS) and threads, before the streams and
+with all of them open. Last, it logs one reward per user straight into the
+database, as another worker would, and times its delivery to every stream
+(fan-out through the server's event log feed). Run from the backend directory:
+
+    python benchmarks/load_test_push.py [--connections 5000] [--servers asgi,flask] [--idle 12]
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+tmp_dir = tempfile.mkdtemp()
+# Point the app at a throwaway database before database.py creates its engine
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/push.db"
+
+backend_dir = Path(__file__).parent.parent
+if str(backend_dir) not in sys.path:
+    sys.path.append(str(backend_dir))
+
+from sqlalchemy import insert
+
+import database
+import synthetic
+from load_test import SERVERS, wait_until_up
+
+# streams opened at once; more only overflow the server's listen backlog
+CONNECT_CONCURRENCY = 200
+
+
+def seed(n_users: int):
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        database.bulk_load_users(db, synthetic.make_users(n_users, 8, 14, 0, habits_per_user=0))
+    finally:
+        db.close()
+
+
+def log_rewards(n_users: int) -> float:
+    """One reward event per user, committed at once; returns the commit time (perf_counter)."""
+    db = database.SessionLocal()
+    try:
+        db.execute(insert(database.WalletEvent), [
+            {"user_id": f"bench-{u}", "type": database.EARNED, "amount": 10} for u in range(n_users)
+        ])
+        db.commit()
+        return time.perf_counter()
+    finally:
+        db.close()
+
+
+def process_stats(pid: int) -> tuple[float, int]:
+    """RSS in MiB and threads of a process."""
+    status = dict(line.split(":", 1) for line in Path(f"/proc/{pid}/status").read_text().splitlines())
+    return int(status["VmRSS"].split()[0]) / 1024, int(status["Threads"])
+
+
+class Stream:
+    """One idle event stream: counts heartbeats and notes when the first wallet event arrives."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.opened = asyncio.Event()
+        self.failed: str | None = None
+        self.pings = 0
+        self.wallet_at: float | None = None
+        self.writer = None
+
+    async def run(self, port: int):
+        try:
+            reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+            self.writer.write(f"GET /api/events HTTP/1.1\r\nHost: 127.0.0.1\r\nX-User-Id: {self.user_id}\r\n"
+                              f"Accept: text/event-stream\r\n\r\n".encode())
+            await self.writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            if status != 200:
+                raise RuntimeError(f"status {status}")
+            self.opened.set()
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    raise RuntimeError("closed by the server")
+                self.pings += data.count(b": ping")
+                if self.wallet_at is None and b"event: wallet" in data:
+                    self.wallet_at = time.perf_counter()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed = f"{type(e).__name__}: {e}"
+            self.opened.set()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def run_streams(port: int, pid: int, n: int, idle: float) -> dict:
+    result = {"rss_before": process_stats(pid)[0]}
+    streams = [Stream(f"bench-{u}") for u in range(n)]
+    gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    tasks = []
+
+    async def open_stream(stream: Stream):
+        async with gate:
+            tasks.append(asyncio.create_task(stream.run(port)))
+            await stream.opened.wait()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(open_stream(stream) for stream in streams))
+    result["connect_s"] = time.perf_counter() - started
+    result["open"] = sum(stream.failed is None for stream in streams)
+    result["errors"] = sorted({stream.failed for stream in streams if stream.failed})[:3]
+
+    await asyncio.sleep(idle)
+    result["rss"], result["threads"] = process_stats(pid)
+    result["alive"] = sum(stream.failed is None for stream in streams)
+    result["min_pings"] = min((stream.pings for stream in streams if stream.failed is None), default=0)
+
+    committed = await asyncio.to_thread(log_rewards, n)
+    deadline = time.perf_counter() + 30
+    while time.perf_counter() < deadline and any(s.wallet_at is None for s in streams if s.failed is None):
+        await asyncio.sleep(0.05)
+    latencies = np.array([s.wallet_at - committed for s in streams if s.wallet_at is not None])
+    result["delivered"] = len(latencies)
+    result["fanout_p50_ms"] = float(np.percentile(latencies, 50) * 1000) if len(latencies) else float("nan")
+    result["fanout_p99_ms"] = float(np.percentile(latencies, 99) * 1000) if len(latencies) else float("nan")
+    result["fanout_max_ms"] = float(latencies.max() * 1000) if len(latencies) else float("nan")
+
+    for stream in streams:
+        stream.close()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--servers", default="asgi", help="comma-separated: asgi, flask")
+    parser.add_argument("--idle", type=float, default=12.0, help="seconds to hold the streams open")
+    parser.add_argument("--heartbeat", type=float, default=5.0, help="server heartbeat interval in seconds")
+    parser.add_argument("--port", type=int, default=18300)
+    args = parser.parse_args()
+
+    # a socket per stream on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if args.connections + 100 > hard:
+        sys.exit(f"--connections {args.connections} needs a higher open files limit than {hard}")
+
+    seed(args.connections)
+    env = dict(os.environ, PUSH_HEARTBEAT_SECONDS=str(args.heartbeat),
+               PUSH_MAX_SUBSCRIBERS=str(args.connections + 10))
+    print(f"{args.connections:,} idle event streams per server, held {args.idle:.0f} s "
+          f"(heartbeat every {args.heartbeat:.0f} s)")
+    print(f"{'server':<6} {'open':>7} {'connect s':>10} {'alive':>7} {'min pings':>9} {'RSS MiB':>15} "
+          f"{'KiB/stream':>11} {'threads':>8} {'delivered':>10} {'fan-out p50/p99/max ms':>23}")
+    for offset, name in enumerate(args.servers.split(",")):
+        port = args.port + offset
+        server = subprocess.Popen([part.format(port=port) for part in SERVERS[name]], cwd=backend_dir, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(port)
+            r = asyncio.run(run_streams(port, server.pid, args.connections, args.idle))
+        finally:
+            server.terminate()
+            server.wait()
+        per_stream = (r["rss"] - r["rss_before"]) * 1024 / max(r["open"], 1)
+        print(f"{name:<6} {r['open']:>7,} {r['connect_s']:>10.1f} {r['alive']:>7,} "
+              f"{r['min_pings']:>9} {r['rss_before']:>6.0f} -> {r['rss']:>5.0f} "
+              f"{per_stream:>11.1f} {r['threads']:>8,} {r['delivered']:>10,} "
+              f"{r['fanout_p50_ms']:>7.0f}/{r['fanout_p99_ms']:.0f}/{r['fanout_max_ms']:.0f}")
+        for error in r["errors"]:
+            print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+    main()
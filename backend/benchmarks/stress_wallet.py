@@ -0,0 +1,150 @@
+"""
+Concurrency stress test for the wallet and challenge completion routes.
+
+Fires thousands of concurrent redeems and completes (a share of them retried
+with the same Idempotency-Key) against a temporary SQLite database, then checks
+that the ledger, the balance and the stats still agree. Reports throughput.
+Run from the backend directory:
+
+    python benchmarks/stress_wallet.py [--requests 4000] [--threads 16]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Point the app at a throwaway database before main.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/stress.db"
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+import logging
+from sqlalchemy import func, select
+import database
+import main
+
+main.logger.setLevel(logging.WARNING)
+main.ensure_database()
+
+USER_ID = main.DEFAULT_USER_ID
+RETRY_SHARE = 0.1
+
+thread_local = threading.local()
+
+
+def client():
+    if not hasattr(thread_local, "client"):
+        thread_local.client = main.app.test_client()
+    return thread_local.client
+
+
+def make_operations(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    operations = []
+    for i in range(n):
+        key = f"op-{i}"
+        if rng.random() < 0.5:
+            operation = ("redeem", rng.randint(1, 80), key)
+        else:
+            operation = ("complete", str(rng.randint(1, len(main.get_challenges_data()))), key)
+        operations.append(operation)
+        # client retries of the same request
+        if rng.random() < RETRY_SHARE:
+            operations.append(operation)
+    rng.shuffle(operations)
+    return operations
+
+
+def run_operation(operation):
+    kind, arg, key = operation
+    headers = {"Idempotency-Key": key}
+    if kind == "redeem":
+        response = client().post("/api/wallet/redeem", json={"amount": arg, "description": "stress"}, headers=headers)
+    else:
+        response = client().post(f"/api/challenges/{arg}/complete", headers=headers)
+    return kind, arg, key, response.status_code
+
+
+def check_consistency(results):
+    db = database.SessionLocal()
+    try:
+        user = database.get_user_by_id(db, USER_ID)
+        ledger_balance = db.execute(
+            select(func.sum(database.Transaction.amount)).where(database.Transaction.user_id == USER_ID)
+        ).scalar_one()
+        completions = db.execute(
+            select(func.count()).where(
+                database.Transaction.user_id == USER_ID,
+                database.Transaction.type == "earned",
+                database.Transaction.challenge_id.is_not(None),
+            )
+        ).scalar_one()
+        redeemed_rows = db.execute(
+            select(func.count()).where(database.Transaction.user_id == USER_ID, database.Transaction.type == "redeemed",
+                                       database.Transaction.description == "stress")
+        ).scalar_one()
+
+        ok_keys = {(kind, key) for kind, _, key, status in results if status == 200}
+        ok_redeems = sum(1 for kind, _ in ok_keys if kind == "redeem")
+        ok_completes = sum(1 for kind, _ in ok_keys if kind == "complete")
+
+        assert user.wallet_balance >= 0, "wallet was overdrawn"
+        assert user.wallet_balance == ledger_balance, (user.wallet_balance, ledger_balance)
+        assert redeemed_rows == ok_redeems, ("a retried redeem was applied twice", redeemed_rows, ok_redeems)
+        assert completions == ok_completes, ("a retried complete was applied twice", completions, ok_completes)
+
+        # all completions happen within the streak window, so each streak equals its completion count
+        for user_challenge in database.get_active_challenges(db, USER_ID):
+            expected = db.execute(
+                select(func.count()).where(
+                    database.Transaction.user_id == USER_ID,
+                    database.Transaction.challenge_id == user_challenge.challenge_id,
+                )
+            ).scalar_one()
+            assert user_challenge.current_streak == expected, (user_challenge.challenge_id,
+                                                               user_challenge.current_streak, expected)
+        return user.wallet_balance, completions, redeemed_rows
+    finally:
+        db.close()
+
+
+def main_stress():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    # start from a clean slate: no active habits, a known balance
+    db = database.SessionLocal()
+    db.query(database.UserChallenge).filter(database.UserChallenge.user_id == USER_ID).delete()
+    db.commit()
+    database.reconcile_user_summaries(db)
+    db.close()
+
+    operations = make_operations(args.requests)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(run_operation, operations))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for _, _, _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    balance, completions, redeems = check_consistency(results)
+    print(f"{len(operations)} requests on {args.threads} threads in {elapsed:.2f}s "
+          f"({len(operations) / elapsed:.0f} req/s), status counts {dict(sorted(statuses.items()))}")
+    print(f"ledger consistent: balance={balance}, completions={completions}, redeems={redeems}")
+
+
+if __name__ == "__main__":
+    main_stress()
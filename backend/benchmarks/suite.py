@@ -0,0 +1,356 @@
+"""
+Benchmark suite for the backend hot paths, with JSON results for regression checks.
+
+Covers the recommender (recommend_challenges / __call__ / recommend_batch at
+several user and challenge counts), the database.py helpers on SQLite, and the
+Flask routes /api/challenges/personalized, /api/onboarding,
+/api/challenges/<id>/complete and /api/wallet/redeem through the test client.
+The database and route benchmarks run once per user-count level, growing one
+temporary SQLite database with seeded synthetic users (see synthetic.py).
+
+Each benchmark is repeated until it ran at least --min-iterations times and
+--min-time seconds; the JSON output records min / median / mean / p95 per
+benchmark together with the parameters and the environment. Run from the
+backend directory:
+
+    python benchmarks/suite.py [--quick] [--filter route.] [--output results.json]
+    python benchmarks/suite.py --compare baseline.json [--tolerance 0.25]
+
+With --compare, benchmarks whose median got slower than the baseline by more
+than the tolerance are listed and the exit status is 1.
+"""
+
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Point the app at a throwaway database before main.py creates its engine
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+backend_dir = str(Path(__file__).parent.parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+import numpy as np
+import sqlalchemy
+
+import database
+import main
+from catalog import Catalog, ChallengeFilter
+from recommendation.cache import recommendation_cache
+from recommendation.recommendation import StaticChallengeRecommender
+from recommendation.reranking import DiversityReranker
+import synthetic
+
+FULL = {
+    "recommender_users": (1, 100, 1_000),
+    "batch_users": (1_000, 100_000),
+    "challenges": (14, 200),
+    "db_users": (1_000, 10_000),
+    "transactions_per_user": 50,
+}
+QUICK = {
+    "recommender_users": (1, 100),
+    "batch_users": (1_000,),
+    "challenges": (14,),
+    "db_users": (200,),
+    "transactions_per_user": 10,
+}
+main.warmup()  # seed the database and load the recommender before anything is timed
+N_QUESTIONS = len(main.get_questions_data())
+
+
+class Runner:
+    def __init__(self, name_filter: str | None, min_iterations: int, min_time: float, max_iterations: int = 10_000):
+        self.name_filter = name_filter
+        self.min_iterations = min_iterations
+        self.min_time = min_time
+        self.max_iterations = max_iterations
+        self.results = []
+
+    def wants(self, name: str) -> bool:
+        return not self.name_filter or self.name_filter in name
+
+    def run(self, name: str, params: dict, op, items: int = 1, warmup: int = 3):
+        """Time op(i) repeatedly; `items` is the amount of work (users, rows) one call does."""
+        if not self.wants(name):
+            return
+        for i in range(warmup):
+            op(i)
+        timings = []
+        started = time.perf_counter()
+        i = warmup
+        while len(timings) < self.max_iterations and (
+                len(timings) < self.min_iterations or time.perf_counter() - started < self.min_time):
+            t0 = time.perf_counter()
+            op(i)
+            timings.append(time.perf_counter() - t0)
+            i += 1
+
+        timings.sort()
+        median = statistics.median(timings)
+        result = {
+            "name": name,
+            "params": params,
+            "items": items,
+            "iterations": len(timings),
+            "seconds": {
+                "min": timings[0],
+                "median": median,
+                "mean": statistics.fmean(timings),
+                "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            },
+            "items_per_second": items / median if median else None,
+        }
+        self.results.append(result)
+        print(f"{name:<44} {format_params(params):<52} {median * 1e3:10.3f} ms  "
+              f"{result['items_per_second']:>14,.0f} items/s", flush=True)
+
+
+def format_params(params: dict) -> str:
+    return " ".join(f"{k}={v}" for k, v in params.items())
+
+
+# --- Recommender ---
+
+def bench_recommender(runner: Runner, scale: dict):
+    questions = synthetic.make_questions(N_QUESTIONS)
+    for n_challenges in scale["challenges"]:
+        recommender = StaticChallengeRecommender(questions, synthetic.make_weights(n_challenges, N_QUESTIONS))
+        catalog = Catalog(synthetic.make_challenges(n_challenges))
+        for n_users in scale["recommender_users"]:
+            answers = synthetic.answers_dicts(synthetic.make_answers(n_users, N_QUESTIONS))
+            params = {"users": n_users, "challenges": n_challenges}
+
+            def recommend_challenges(_):
+                for user_answers in answers:
+                    recommender.recommend_challenges(user_answers)
+            runner.run("recommender.recommend_challenges", params, recommend_challenges, items=n_users)
+
+            mask = catalog.mask(ChallengeFilter(categories=frozenset({"transport", "energy"}), max_reward=60))
+
+            def recommend_filtered(_):
+                for user_answers in answers:
+                    recommender.recommend_challenges(user_answers, mask=mask, k=5)
+            runner.run("recommender.recommend_challenges", {**params, "filtered": True, "k": 5},
+                       recommend_filtered, items=n_users)
+
+            reranker = DiversityReranker.from_catalog(catalog)
+
+            def recommend_reranked(_):
+                for user_answers in answers:
+                    recommender.recommend_challenges(user_answers, reranker=reranker)
+            runner.run("recommender.recommend_challenges", {**params, "reranked": True},
+                       recommend_reranked, items=n_users)
+
+            for personalized in (False, True):
+                def call(_, personalized=personalized):
+                    for user_answers in answers:
+                        recommender(user_answers, personalized=personalized)
+                runner.run("recommender.__call__", {**params, "personalized": personalized}, call, items=n_users)
+
+        for n_users in scale["batch_users"]:
+            matrix = synthetic.make_answers(n_users, N_QUESTIONS)
+            runner.run("recommender.recommend_batch", {"users": n_users, "challenges": n_challenges},
+                       lambda _: recommender.recommend_batch(matrix), items=n_users)
+            runner.run("recommender.recommend_batch", {"users": n_users, "challenges": n_challenges, "reranked": True},
+                       lambda _: recommender.recommend_batch(matrix, k=10, reranker=reranker,
+                                                             rng=np.random.default_rng(0)), items=n_users)
+
+
+# --- database.py helpers and Flask routes, on a growing SQLite database ---
+
+def load_users(start: int, stop: int, transactions_per_user: int):
+    db = database.SessionLocal()
+    try:
+        users = synthetic.make_users(stop - start, N_QUESTIONS, len(main.get_challenges_data()), transactions_per_user,
+                                     seed=start, id_prefix="bench-")
+        # ids continue where the previous level stopped
+        database.bulk_load_users(db, ({**u, "id": f"bench-{start + i}"} for i, u in enumerate(users)))
+    finally:
+        db.close()
+
+
+def bench_database(runner: Runner, n_users: int, transactions_per_user: int):
+    params = {"users": n_users, "transactions_per_user": transactions_per_user}
+    rng = random.Random(n_users)
+    user_ids = [f"bench-{rng.randrange(n_users)}" for _ in range(4096)]
+    uid = lambda i: user_ids[i % len(user_ids)]
+    db = database.SessionLocal()
+
+    def get_user(i):
+        db.expire_all()
+        database.get_user_by_id(db, uid(i))
+    runner.run("db.get_user_by_id", params, get_user)
+
+    run_id = time.time_ns()
+
+    def create_user(i):
+        database.create_user(db, {"id": f"new-{run_id}-{i}", "name": "New User"})
+    runner.run("db.create_user", params, create_user)
+
+    answers = {str(q + 1): 1 for q in range(N_QUESTIONS)}
+    runner.run("db.save_onboarding", params,
+               lambda i: database.save_onboarding(db, uid(i), {"answers": answers}))
+
+    runner.run("db.get_active_challenges", params, lambda i: database.get_active_challenges(db, uid(i)))
+
+    def record_earned(i):
+        database.record_earned(db, uid(i), 10, "bench", challenge_id="1", streak=1)
+        db.commit()
+    runner.run("db.record_earned", params, record_earned)
+
+    def record_redeemed(i):
+        database.record_redeemed(db, uid(i), 1, "bench")
+        db.commit()
+    runner.run("db.record_redeemed", params, record_redeemed)
+
+    def activate(i):
+        database.activate_user_challenge(db, uid(i), str(i % len(main.get_challenges_data()) + 1), "P1W", datetime.utcnow())
+        db.commit()
+    runner.run("db.activate_user_challenge", params, activate)
+
+    runner.run("db.get_transactions_page", {**params, "limit": 50},
+               lambda i: database.get_transactions_page(db, uid(i), 50))
+    db.close()
+
+
+def bench_routes(runner: Runner, n_users: int, transactions_per_user: int):
+    params = {"users": n_users, "transactions_per_user": transactions_per_user}
+    client = main.app.test_client()
+    rng = random.Random(n_users + 1)
+    user_ids = [f"bench-{rng.randrange(n_users)}" for _ in range(4096)]
+    headers = lambda i: {"X-User-Id": user_ids[i % len(user_ids)]}
+
+    def check(response):
+        assert response.status_code < 400, (response.status_code, response.get_data(as_text=True)[:200])
+
+    def personalized_cold(i):
+        recommendation_cache.clear()
+        check(client.get("/api/challenges/personalized", headers=headers(i)))
+    runner.run("route.GET /api/challenges/personalized", {**params, "cache": "cold"}, personalized_cold)
+    runner.run("route.GET /api/challenges/personalized", {**params, "cache": "warm"},
+               lambda i: check(client.get("/api/challenges/personalized", headers=headers(0))))
+    runner.run("route.GET /api/challenges/personalized", {**params, "filtered": True},
+               lambda i: check(client.get("/api/challenges/personalized?category=transport&exclude=active&limit=3",
+                                          headers=headers(i))))
+
+    answer_rows = synthetic.answers_dicts(synthetic.make_answers(512, N_QUESTIONS, seed=n_users))
+    runner.run("route.POST /api/onboarding", params, lambda i: check(client.post(
+        "/api/onboarding", json={"answers": answer_rows[i % len(answer_rows)]}, headers=headers(i))))
+
+    n_challenges = len(main.get_challenges_data())
+    runner.run("route.POST /api/challenges/<id>/complete", params, lambda i: check(client.post(
+        f"/api/challenges/{i % n_challenges + 1}/complete", headers=headers(i))))
+
+    runner.run("route.POST /api/wallet/redeem", params, lambda i: check(client.post(
+        "/api/wallet/redeem", json={"amount": 1, "description": "bench"}, headers=headers(i))))
+
+
+# --- Results ---
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=backend_dir, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "sqlalchemy": sqlalchemy.__version__,
+        "database": database.get_engine().dialect.name,
+    }
+
+
+def result_key(result: dict) -> str:
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    """Lines describing benchmarks whose median is more than `tolerance` slower than the baseline."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\ncompared with {baseline_path} (tolerance {tolerance:.0%}):")
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        ratio = result["seconds"]["median"] / before["seconds"]["median"]
+        line = f"{result['name']:<44} {format_params(result['params']):<52} {ratio:6.2f}x"
+        if ratio > 1 + tolerance:
+            regressions.append(line)
+            line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main_bench(argv=None):
+    parser = argparse.ArgumentParser(description="Backend benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="small scales, for CI and smoke runs")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-iterations", type=int, default=20)
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds per benchmark")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    scale = QUICK if args.quick else FULL
+    runner = Runner(args.filter, args.min_iterations, args.min_time)
+    random.seed(0)
+
+    bench_recommender(runner, scale)
+
+    loaded = 0
+    for n_users in scale["db_users"]:
+        if not (runner.wants("db.") or runner.wants("route.")):
+            break
+        load_users(loaded, n_users, scale["transactions_per_user"])
+        loaded = n_users
+        bench_database(runner, n_users, scale["transactions_per_user"])
+        bench_routes(runner, n_users, scale["transactions_per_user"])
+
+    report = {
+        "suite": "backend",
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": {"scale": "quick" if args.quick else "full", **{k: list(v) if isinstance(v, tuple) else v
+                                                                    for k, v in scale.items()},
+                   "min_iterations": args.min_iterations, "min_time": args.min_time},
+        "results": runner.results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nwrote {len(runner.results)} results to {args.output}")
+
+    if args.compare:
+        regressions = compare(runner.results, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench())
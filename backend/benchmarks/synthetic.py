@@ -0,0 +1,99 @@
+"""
+Seeded synthetic data for the benchmarks: catalogs, recommender weights and users.
+
+Everything is generated from a fixed seed, so repeated runs (and runs on other
+machines) measure the same workload. Users are produced in the user.json format
+accepted by database.bulk_load_users.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+TIME_HORIZONS = ("P1D", "P1W", "P2W", "P1M")
+CATEGORIES = ("community", "energy", "food", "transport", "waste")
+DEFAULT_SEED = 1234
+
+
+def make_questions(n_questions: int) -> list[dict]:
+    return [
+        {"id": i + 1, "question": f"Synthetic question {i + 1}?", "shortForm": f"Question {i + 1}"}
+        for i in range(n_questions)
+    ]
+
+
+def make_challenges(n_challenges: int, seed: int = DEFAULT_SEED) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    rewards = rng.integers(10, 100, size=n_challenges).tolist()
+    horizons = rng.choice(TIME_HORIZONS, size=n_challenges).tolist()
+    categories = rng.choice(CATEGORIES, size=n_challenges).tolist()
+    return [
+        {
+            "id": str(i + 1),
+            "challenge": f"Synthetic challenge {i + 1}",
+            "category": categories[i],
+            "time_variable": horizons[i],
+            "badge_image_theme": "leaf_plant_sprout",
+            "currency_reward_points": rewards[i],
+            "impact": "Synthetic impact.",
+        }
+        for i in range(n_challenges)
+    ]
+
+
+def make_weights(n_challenges: int, n_questions: int, seed: int = DEFAULT_SEED) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n_challenges, n_questions))
+
+
+def make_answers(n_users: int, n_questions: int, seed: int = DEFAULT_SEED) -> np.ndarray:
+    """(n_users x n_questions) matrix of answers in {-1, 0, 1}."""
+    return np.random.default_rng(seed).integers(-1, 2, size=(n_users, n_questions), dtype=np.int8)
+
+
+def answers_dicts(answers: np.ndarray) -> list[dict[int, int]]:
+    """Answer matrix rows as the {question_id: answer} dicts the recommender and API take."""
+    return [{q + 1: a for q, a in enumerate(row)} for row in answers.tolist()]
+
+
+def make_users(n_users: int, n_questions: int, n_challenges: int, transactions_per_user: int,
+               habits_per_user: int = 3, seed: int = DEFAULT_SEED, id_prefix: str = "bench-"):
+    """
+    Yield users in the user.json format with answers, active habits and a transaction history.
+
+    Balances are consistent with the generated transactions (earned rewards minus
+    redemptions, never negative).
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1)
+    for i in range(n_users):
+        answers = rng.integers(-1, 2, size=n_questions).tolist()
+        habit_ids = rng.choice(n_challenges, size=min(habits_per_user, n_challenges), replace=False) + 1
+        transactions, balance, earned = [], 0, 0
+        for t in range(transactions_per_user):
+            date = (start + timedelta(hours=int(t * 7 + i % 7))).isoformat()
+            amount = int(rng.integers(10, 100))
+            if balance >= amount and rng.random() < 0.25:
+                transactions.append({"type": "redeemed", "amount": -amount, "description": "Synthetic reward",
+                                     "date": date})
+                balance -= amount
+            else:
+                challenge_id = str(int(rng.integers(1, n_challenges + 1)))
+                transactions.append({"type": "earned", "amount": amount, "description": "Synthetic challenge",
+                                     "challengeId": challenge_id, "date": date})
+                balance += amount
+                earned += amount
+        yield {
+            "id": f"{id_prefix}{i}",
+            "name": f"Bench User {i}",
+            "email": f"bench{i}@example.com",
+            "answers": {str(q + 1): a for q, a in enumerate(answers)},
+            "walletBalance": balance,
+            "totalImpact": earned,
+            "activeHabits": {
+                str(c): {"currentStreak": int(rng.integers(0, 10)), "lastCompleted": start.isoformat(),
+                         "timeHorizon": "P1W"}
+                for c in habit_ids.tolist()
+            },
+            "stats": {"currentStreak": 0, "longestStreak": 0, "totalChallengesCompleted": 0, "badges": []},
+            "transactions": transactions,
+        }
@@ -0,0 +1,149 @@
+"""
+Challenge catalog: stable ids and the indexes used for filtered ranking.
+
+Every challenge.json entry carries an "id" that never changes. User challenges,
+wallet events and recommender weights all refer to it. An entry's position in
+the file only gives its row in the scoring arrays.
+
+The catalog keeps these indexes:
+- a hash index from id to row;
+- bitmap indexes (one boolean mask over the rows per value) for category and
+  duration;
+- the rows sorted by reward, for reward ranges.
+
+A ChallengeFilter is compiled into one boolean row mask. The recommender
+applies it while scoring (excluded rows score -inf before the top-k
+selection), so filtering is a vectorized pass however many challenges it
+removes.
+"""
+
+from dataclasses import dataclass
+import hashlib
+
+import numpy as np
+
+
+class CatalogError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ChallengeFilter:
+    """Which challenges a ranking may contain; None means no restriction."""
+    categories: frozenset[str] | None = None
+    durations: frozenset[str] | None = None  # ISO-8601 time horizons, e.g. {"P1W"}
+    min_reward: int | None = None
+    max_reward: int | None = None
+    exclude_ids: frozenset[str] = frozenset()
+
+    @classmethod
+    def from_query(cls, args, exclude_ids=frozenset()) -> "ChallengeFilter":
+        """
+        Filter from query parameters: category and duration (comma-separated), minReward, maxReward.
+
+        Raises ValueError for rewards that are not integers.
+        """
+        def values(name):
+            raw = args.get(name)
+            return frozenset(v.strip() for v in raw.split(",") if v.strip()) if raw else None
+
+        def integer(name):
+            raw = args.get(name)
+            return int(raw) if raw not in (None, "") else None
+
+        return cls(categories=values("category"), durations=values("duration"),
+                   min_reward=integer("minReward"), max_reward=integer("maxReward"),
+                   exclude_ids=frozenset(exclude_ids))
+
+    @property
+    def is_empty(self) -> bool:
+        return self == ChallengeFilter()
+
+
+def _bitmap_index(values: list) -> dict[object, np.ndarray]:
+    index = {}
+    for row, value in enumerate(values):
+        if value not in index:
+            index[value] = np.zeros(len(values), dtype=bool)
+        index[value][row] = True
+    return index
+
+
+class Catalog:
+    def __init__(self, challenges: list[dict]):
+        ids = [challenge.get("id") for challenge in challenges]
+        if any(not isinstance(challenge_id, str) or not challenge_id for challenge_id in ids):
+            raise CatalogError("every challenge needs a non-empty string 'id'")
+        if len(set(ids)) != len(ids):
+            raise CatalogError("challenge ids must be unique")
+
+        self.challenges = challenges
+        self.ids = tuple(ids)
+        self.positions = {challenge_id: row for row, challenge_id in enumerate(ids)}
+        self.version = hashlib.sha256("\n".join(ids).encode()).hexdigest()[:12]
+
+        self.rewards = np.array([c.get("currency_reward_points", 0) for c in challenges], dtype=np.int64)
+        self._reward_order = np.argsort(self.rewards, kind="stable")
+        self._sorted_rewards = self.rewards[self._reward_order]
+        self._category_index = _bitmap_index([c.get("category") for c in challenges])
+        self._duration_index = _bitmap_index([c.get("time_variable") for c in challenges])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, challenge_id: str) -> dict | None:
+        """The challenge with this id, None if there is none."""
+        row = self.positions.get(challenge_id)
+        return None if row is None else self.challenges[row]
+
+    def categories(self) -> list[str]:
+        return sorted(c for c in self._category_index if c is not None)
+
+    def _any_of(self, index: dict, values) -> np.ndarray:
+        mask = np.zeros(len(self), dtype=bool)
+        for value in values:
+            if value in index:
+                mask |= index[value]
+        return mask
+
+    def mask(self, filters: ChallengeFilter) -> np.ndarray | None:
+        """Rows the filter allows as a boolean mask; None if it allows every challenge."""
+        if filters.is_empty:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        if filters.categories is not None:
+            mask &= self._any_of(self._category_index, filters.categories)
+        if filters.durations is not None:
+            mask &= self._any_of(self._duration_index, filters.durations)
+        if filters.min_reward is not None or filters.max_reward is not None:
+            low = 0 if filters.min_reward is None else np.searchsorted(self._sorted_rewards, filters.min_reward, "left")
+            high = len(self) if filters.max_reward is None else np.searchsorted(
+                self._sorted_rewards, filters.max_reward, "right")
+            in_range = np.zeros(len(self), dtype=bool)
+            in_range[self._reward_order[low:high]] = True
+            mask &= in_range
+        excluded = [self.positions[i] for i in filters.exclude_ids if i in self.positions]
+        mask[excluded] = False
+        return mask
+
+    def align(self, weights: np.ndarray, weight_ids: list[str]) -> tuple[np.ndarray, list[str]]:
+        """
+        Reorder weight rows, given per challenge id, into catalog rows.
+
+        Rows for ids not in the catalog are dropped. Challenges without a row get
+        zeros, so they score neutrally until new weights are trained. Returns the
+        aligned weights and the ids of the challenges that had no row. The
+        weights are returned unchanged (still memory-mapped) if they already match.
+        """
+        if tuple(weight_ids) == self.ids:
+            return weights, []
+        rows = {challenge_id: row for row, challenge_id in enumerate(weight_ids)}
+        aligned = np.zeros((len(self), weights.shape[1]), dtype=weights.dtype)
+        missing = []
+        for position, challenge_id in enumerate(self.ids):
+            row = rows.get(challenge_id)
+            if row is None:
+                missing.append(challenge_id)
+            else:
+                aligned[position] = weights[row]
+        return aligned, missing
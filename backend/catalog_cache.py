@@ -0,0 +1,114 @@
+"""
+Cache of the static JSON catalogs in data/ (challenges, questions, redemptions).
+
+Each file is parsed and encoded once: the cache keeps the response bytes, their
+gzip (and, if the brotli package is installed, brotli) variants and a strong
+ETag. Files are re-read when their mtime changes, checked at most once per
+CHECK_INTERVAL seconds. respond() is framework independent so the Flask and
+ASGI apps can both serve from it.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+DATA_DIR = Path(__file__).parent / "data"
+CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "1.0"))
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    data: object
+    mtime_ns: int
+    etag: str
+    bodies: dict  # content-encoding ("identity", "gzip", "br") -> bytes
+
+
+class CatalogCache:
+    def __init__(self, data_dir: Path = DATA_DIR, check_interval: float = CHECK_INTERVAL):
+        self.data_dir = Path(data_dir)
+        self.check_interval = check_interval
+        self._entries: dict[str, CatalogEntry] = {}
+        self._checked_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, filename: str, mtime_ns: int) -> CatalogEntry:
+        with open(self.data_dir / filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body)
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        return CatalogEntry(data=data, mtime_ns=mtime_ns, etag=etag, bodies=bodies)
+
+    def get(self, filename: str) -> CatalogEntry:
+        """Current entry for a data file, reloading it if the file changed on disk."""
+        now = time.monotonic()
+        entry = self._entries.get(filename)
+        if entry is not None and now - self._checked_at.get(filename, 0) < self.check_interval:
+            return entry
+
+        mtime_ns = (self.data_dir / filename).stat().st_mtime_ns
+        if entry is None or entry.mtime_ns != mtime_ns:
+            with self._lock:
+                entry = self._entries.get(filename)
+                if entry is None or entry.mtime_ns != mtime_ns:
+                    entry = self._load(filename, mtime_ns)
+                    # swapping the dict value is atomic; readers see the old or the new entry
+                    self._entries[filename] = entry
+        self._checked_at[filename] = now
+        return entry
+
+    def respond(self, filename: str, if_none_match: str | None = None,
+                accept_encoding: str | None = None) -> tuple[int, bytes, dict]:
+        """
+        Build (status, body, headers) for serving a catalog.
+
+        Returns 304 with an empty body if If-None-Match matches, otherwise the
+        best encoding the client accepts.
+        """
+        entry = self.get(filename)
+        encoding = self._pick_encoding(entry, accept_encoding)
+        etag = f'"{entry.etag}"' if encoding == "identity" else f'"{entry.etag}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+        if if_none_match and self._etag_matches(entry.etag, if_none_match):
+            return 304, b"", headers
+
+        headers["Content-Type"] = "application/json"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return 200, entry.bodies[encoding], headers
+
+    @staticmethod
+    def _pick_encoding(entry: CatalogEntry, accept_encoding: str | None) -> str:
+        accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in entry.bodies:
+                return encoding
+        return "identity"
+
+    @staticmethod
+    def _etag_matches(etag: str, if_none_match: str) -> bool:
+        if if_none_match.strip() == "*":
+            return True
+        for tag in if_none_match.split(","):
+            tag = tag.strip().removeprefix("W/").strip('"')
+            # any encoding of the same content is still valid for the client
+            if tag == etag or tag.startswith(etag + "-"):
+                return True
+        return False
+
+
+catalog_cache = CatalogCache()
@@ -5,18 +5,175 @@ Example using SQLAlchemy for database operations.
 Replace with your preferred database solution.
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import bindparam, cast, create_engine, event, make_url, insert, select, update, case, func, or_, tuple_, Column, Integer, String, Boolean, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import itertools
 import os
+import threading
+import time
 
-# Database connection
+# Database connection; the engine is created on first use, so importing this module doesn't connect
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ecorewards.db")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Read replicas (comma-separated URLs) for read-only sessions; reads use the primary when empty
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Connection pool of each engine (in-memory SQLite keeps its single connection); size it for the
+# server's request threads plus the background workers, or requests wait up to POOL_TIMEOUT
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; -1 keeps connections forever
+# test connections before handing them out; default: on for server databases, whose connections can drop
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING")
+# SQLite files: WAL lets readers run alongside the writer; writers wait up to the busy timeout for the lock
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# after writing, a user's reads go to the primary for this long, to cover replication lag
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# users tracked for read-your-writes in this process; the oldest are forgotten first
+MAX_RECENT_WRITERS = 100_000
+# how long a reader of wallet_events waits for a skipped event id to be committed (see EventTail)
+EVENT_GAP_SECONDS = float(os.getenv("EVENT_GAP_SECONDS", "60"))
+MAX_EVENT_GAPS = 10_000
+
+_engine = None
+_read_engines = None
+_engine_lock = threading.Lock()
+_session_factory = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+# asyncio drivers used by the ASGI app for each sync DATABASE_URL scheme
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+_async_sessionmaker = None
+
+
+def is_memory_sqlite(url: str) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and (url.database in (None, "", ":memory:")
+                                                   or url.query.get("mode") == "memory")
+
+
+def engine_options(url: str) -> dict:
+    """create_engine() keyword arguments for url: pool sizing, recycling and pre-ping."""
+    if is_memory_sqlite(url):
+        return {}
+    server = make_url(url).get_backend_name() != "sqlite"
+    pre_ping = POOL_PRE_PING == "1" if POOL_PRE_PING is not None else server
+    return {"pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT,
+            "pool_recycle": POOL_RECYCLE, "pool_pre_ping": pre_ping}
+
+
+def set_sqlite_pragmas(engine, read_only: bool = False):
+    """Set the busy timeout, and WAL with synchronous=NORMAL unless read_only, on each new SQLite connection."""
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        if SQLITE_WAL and not read_only:
+            cursor.execute("PRAGMA journal_mode = WAL")  # stored in the file; memory databases ignore it
+            cursor.execute("PRAGMA synchronous = NORMAL")  # with WAL a power loss can only drop the last commits
+        cursor.close()
+
+
+def make_engine(url: str, read_only: bool = False):
+    """Engine for url with the pool settings above, and the pragmas for SQLite."""
+    engine = create_engine(url, **engine_options(url))
+    if engine.dialect.name == "sqlite":
+        set_sqlite_pragmas(engine, read_only)
+    return engine
+
+
+def get_engine():
+    """The engine for DATABASE_URL, created on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = make_engine(DATABASE_URL)
+    return _engine
+
+
+def get_read_engines() -> list:
+    """Engines of the read replicas, created on first use; empty without replicas."""
+    global _read_engines
+    if _read_engines is None:
+        with _engine_lock:
+            if _read_engines is None:
+                _read_engines = [make_engine(url, read_only=True) for url in DATABASE_REPLICA_URLS]
+    return _read_engines
+
+
+def SessionLocal():
+    """New session on the engine's connection pool"""
+    return _session_factory(bind=get_engine())
+
+
+_read_counter = itertools.count()
+
+
+def ReadSessionLocal():
+    """New session for read-only work: on the read replicas in turn, or on the primary without replicas."""
+    engines = get_read_engines()
+    if not engines:
+        return SessionLocal()
+    return _session_factory(bind=engines[next(_read_counter) % len(engines)])
+
+
+# user id -> time.monotonic() until which their reads go to the primary, oldest first
+_recent_writers: OrderedDict[str, float] = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def note_write(user_id: str):
+    """Send the user's reads to the primary for READ_YOUR_WRITES_SECONDS (see reads_from_primary)."""
+    now = time.monotonic()
+    with _recent_writers_lock:
+        _recent_writers[user_id] = now + READ_YOUR_WRITES_SECONDS
+        _recent_writers.move_to_end(user_id)
+        while _recent_writers and (len(_recent_writers) > MAX_RECENT_WRITERS
+                                   or next(iter(_recent_writers.values())) <= now):
+            _recent_writers.popitem(last=False)
+
+
+def reads_from_primary(user_id: str) -> bool:
+    """Whether the user wrote through this process within READ_YOUR_WRITES_SECONDS."""
+    with _recent_writers_lock:
+        return _recent_writers.get(user_id, 0.0) > time.monotonic()
+
+
+def configure(url: str, replica_urls: list[str] | None = None):
+    """Point this process at another database (and replicas, if given); the engines are recreated on next use."""
+    global DATABASE_URL, DATABASE_REPLICA_URLS, _engine, _read_engines, _async_sessionmaker
+    with _engine_lock:
+        for engine in [_engine, *(_read_engines or [])]:
+            if engine is not None:
+                engine.dispose()
+        DATABASE_URL, _engine, _read_engines, _async_sessionmaker = url, None, None, None
+        if replica_urls is not None:
+            DATABASE_REPLICA_URLS = list(replica_urls)
+
+
+def async_database_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+def get_async_sessionmaker():
+    """AsyncSession factory for the ASGI app, created on first use (needs aiosqlite / asyncpg)"""
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        async_engine = create_async_engine(async_database_url(DATABASE_URL), **engine_options(DATABASE_URL))
+        if async_engine.dialect.name == "sqlite":
+            set_sqlite_pragmas(async_engine.sync_engine)
+        _async_sessionmaker = async_sessionmaker(async_engine, autocommit=False, autoflush=False,
+                                                 expire_on_commit=False)
+    return _async_sessionmaker
+
 # ========== DATABASE MODELS ==========
 
 class User(Base):
@@ -24,16 +181,24 @@ class User(Base):
     
     id = Column(String, primary_key=True, index=True)
     name = Column(String)
+    email = Column(String)
+    answers = Column(JSON)
+    recommended_challenges = Column(JSON)
     daily_commute_mode = Column(String)
     home_ownership = Column(String)
     diet_preference = Column(String)
     wallet_balance = Column(Integer, default=0)
     total_impact = Column(Integer, default=0)
+    current_streak = Column(Integer, default=0)
+    longest_streak = Column(Integer, default=0)
+    total_challenges_completed = Column(Integer, default=0)
+    region = Column(String, nullable=True)  # regional leaderboards
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     challenges = relationship("UserChallenge", back_populates="user")
     transactions = relationship("Transaction", back_populates="user")
+    badges = relationship("Badge", back_populates="user")
     onboarding = relationship("OnboardingData", back_populates="user", uselist=False)
 
 
@@ -41,7 +206,8 @@ class OnboardingData(Base):
     __tablename__ = "onboarding_data"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String, ForeignKey("users.id"))
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    answers = Column(JSON)
     location_type = Column(String)
     daily_commute_mode = Column(String)
     home_ownership = Column(String)
@@ -80,12 +246,21 @@ class UserChallenge(Base):
     challenge_id = Column(String, ForeignKey("challenges.id"))
     is_active = Column(Boolean, default=False)
     is_completed = Column(Boolean, default=False)
+    current_streak = Column(Integer, default=0)
+    time_horizon = Column(String)
+    # when the streak lapses unless the challenge is completed again; ordered index for expiry
+    streak_deadline = Column(DateTime, index=True)
     started_at = Column(DateTime)
     completed_at = Column(DateTime)
     
     user = relationship("User", back_populates="challenges")
     challenge = relationship("Challenge", back_populates="user_challenges")
 
+    __table_args__ = (
+        # one row per (user, challenge); also serves lookups by user_id alone
+        Index("ix_user_challenges_user_challenge", "user_id", "challenge_id", unique=True),
+    )
+
 
 class Transaction(Base):
     __tablename__ = "transactions"
@@ -100,6 +275,89 @@ class Transaction(Base):
     
     user = relationship("User", back_populates="transactions")
 
+    __table_args__ = (
+        Index("ix_transactions_user_created", "user_id", "created_at"),
+    )
+
+
+# wallet_events.type values
+EARNED = "earned"
+REDEEMED = "redeemed"
+BADGE_AWARDED = "badge_awarded"
+CHALLENGE_STARTED = "challenge_started"
+CHALLENGE_STOPPED = "challenge_stopped"
+STREAK_EXPIRED = "streak_expired"
+# the balance and impact a user was imported with (bulk_load_users), earned / redeemed before the log began
+OPENING_EARNED = "opening_earned"
+OPENING_REDEEMED = "opening_redeemed"
+# challenges an imported user completed before the log began; amount is their number
+OPENING_COMPLETED = "opening_completed"
+
+
+class WalletEvent(Base):
+    """Append-only log of everything that happened to a wallet; rows are never updated or deleted."""
+    __tablename__ = "wallet_events"
+
+    id = Column(Integer, primary_key=True)  # monotonic, gives the replay order
+    user_id = Column(String, ForeignKey("users.id"))
+    type = Column(String)
+    amount = Column(Integer, default=0)  # signed balance change
+    challenge_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_wallet_events_user_id", "user_id", "id"),
+        # AUTOINCREMENT: SQLite never reuses ids, so they stay monotonic
+        {"sqlite_autoincrement": True},
+    )
+
+
+class WalletSnapshot(Base):
+    """A user's wallet state folded from wallet_events up to and including last_event_id."""
+    __tablename__ = "wallet_snapshots"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    last_event_id = Column(Integer)
+    balance = Column(Integer)
+    total_impact = Column(Integer)
+    challenges_completed = Column(Integer)
+    badges = Column(Integer)
+    active_challenges = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Badge(Base):
+    __tablename__ = "badges"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    challenge_id = Column(String, nullable=True)
+    title = Column(String)
+    icon = Column(String)
+    earned_at = Column(DateTime, default=datetime.utcnow)
+
+    user = relationship("User", back_populates="badges")
+
+
+class Friendship(Base):
+    """One row per direction: friends see each other on their friend leaderboards."""
+    __tablename__ = "friendships"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    friend_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    key = Column(String, primary_key=True)
+    endpoint = Column(String)
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is still running
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
 class RedemptionOption(Base):
     __tablename__ = "redemption_options"
@@ -116,7 +374,7 @@ class RedemptionOption(Base):
 
 def init_db():
     """Initialize database tables"""
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
 
 
 def get_db():
@@ -130,36 +388,872 @@ def get_db():
 
 # Example usage functions
 
-def create_user(db, user_data: dict):
-    """Create a new user"""
+def create_user(db, user_data: dict, commit: bool = True):
+    """Create a new user; with commit=False it is only flushed, to commit with the caller's other writes"""
     user = User(**user_data)
     db.add(user)
+    if not commit:
+        db.flush()
+        return user
     db.commit()
     db.refresh(user)
     return user
 
 
+def create_users(db, users: list[dict]) -> int:
+    """Insert users (dicts of users columns) in one executemany. Does not commit."""
+    if users:
+        db.execute(insert(User), users)
+    return len(users)
+
+
 def get_user_by_id(db, user_id: str):
     """Get user by ID"""
     return db.query(User).filter(User.id == user_id).first()
 
 
-def save_onboarding(db, user_id: str, onboarding_data: dict):
-    """Save onboarding responses"""
+def save_onboarding(db, user_id: str, onboarding_data: dict, commit: bool = True):
+    """Save onboarding responses; with commit=False they are only flushed"""
     onboarding = OnboardingData(user_id=user_id, **onboarding_data)
     db.add(onboarding)
-    db.commit()
+    if commit:
+        db.commit()
+    else:
+        db.flush()
     return onboarding
 
 
+def save_onboardings(db, rows: list[dict]) -> int:
+    """Insert onboarding responses (dicts of onboarding_data columns, with user_id) in one executemany. Does not commit."""
+    if rows:
+        db.execute(insert(OnboardingData), rows)
+    return len(rows)
+
+
 def get_user_challenges(db, user_id: str):
     """Get all challenges for a user"""
     return db.query(UserChallenge).filter(UserChallenge.user_id == user_id).all()
 
 
-def add_transaction(db, user_id: str, transaction_data: dict):
-    """Add a transaction"""
-    transaction = Transaction(user_id=user_id, **transaction_data)
+def get_active_challenges(db, user_id: str):
+    """Get the challenges a user is currently doing"""
+    return db.query(UserChallenge).filter(
+        UserChallenge.user_id == user_id, UserChallenge.is_active.is_(True)
+    ).all()
+
+
+def get_completed_challenge_ids(db, user_id: str) -> set[str]:
+    """Ids of the challenges a user has completed at least once"""
+    return set(db.execute(
+        select(UserChallenge.challenge_id).where(
+            UserChallenge.user_id == user_id, UserChallenge.completed_at.is_not(None)
+        )
+    ).scalars())
+
+
+def get_user_challenge(db, user_id: str, challenge_id: str):
+    """Get a single user/challenge row"""
+    return db.query(UserChallenge).filter(
+        UserChallenge.user_id == user_id, UserChallenge.challenge_id == challenge_id
+    ).first()
+
+
+def _insert_ignore(db, model, values: dict) -> bool:
+    """INSERT a row unless it conflicts with an existing key. Returns True if a row was inserted."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        try:
+            with db.begin_nested():
+                db.execute(insert(model).values(**values))
+            return True
+        except IntegrityError:
+            return False
+    return db.execute(dialect_insert(model).values(**values).on_conflict_do_nothing()).rowcount > 0
+
+
+def activate_user_challenge(db, user_id: str, challenge_id: str, time_horizon: str | None, now: datetime):
+    """
+    Make sure the user is doing the challenge; (re)starting it resets the streak.
+
+    Safe against concurrent requests for the same (user, challenge). Returns True
+    (and logs a challenge_started event) if the challenge was not active. Does not commit.
+    """
+    started = db.execute(update(UserChallenge).where(
+        UserChallenge.user_id == user_id,
+        UserChallenge.challenge_id == challenge_id,
+        UserChallenge.is_active.is_not(True),
+    ).values(is_active=True, current_streak=0, completed_at=None, started_at=now, time_horizon=time_horizon)
+    ).rowcount > 0
+    started = _insert_ignore(db, UserChallenge, {
+        "user_id": user_id,
+        "challenge_id": challenge_id,
+        "is_active": True,
+        "is_completed": False,
+        "current_streak": 0,
+        "started_at": now,
+        "time_horizon": time_horizon,
+    }) or started
+    if started:
+        append_event(db, user_id, CHALLENGE_STARTED, challenge_id=challenge_id, created_at=now)
+    return started
+
+
+def stop_user_challenge(db, user_id: str, challenge_id: str, now: datetime) -> bool:
+    """
+    Stop an active challenge, dropping its streak. Returns False if it was not active.
+
+    Logs a challenge_stopped event and refreshes the user's current streak. Does not commit.
+    """
+    stopped = db.execute(update(UserChallenge).where(
+        UserChallenge.user_id == user_id,
+        UserChallenge.challenge_id == challenge_id,
+        UserChallenge.is_active.is_(True),
+    ).values(is_active=False, current_streak=0).execution_options(synchronize_session=False)).rowcount > 0
+    if stopped:
+        append_event(db, user_id, CHALLENGE_STOPPED, challenge_id=challenge_id, created_at=now)
+        refresh_current_streak(db, user_id)
+    return stopped
+
+
+def advance_streak(db, user_id: str, challenge_id: str, now: datetime, window: timedelta) -> int:
+    """
+    Count a completion of an active challenge and return the new streak.
+
+    The streak restarts at 1 if the previous completion is `window` or more in
+    the past; the next deadline becomes now + window. Done in one UPDATE, which
+    also locks the row until the caller commits, so concurrent completions cannot
+    lose increments. Does not commit.
+    """
+    row = (UserChallenge.user_id == user_id) & (UserChallenge.challenge_id == challenge_id)
+    db.execute(update(UserChallenge).where(row).values(
+        current_streak=case(
+            (or_(UserChallenge.completed_at.is_(None), UserChallenge.completed_at <= now - window), 1),
+            else_=func.coalesce(UserChallenge.current_streak, 0) + 1,
+        ),
+        completed_at=now,
+        streak_deadline=now + window,
+        is_completed=True,
+    ))
+    return db.execute(select(UserChallenge.current_streak).where(row)).scalar_one()
+
+
+def get_streak_deadlines(db, until: datetime, limit: int):
+    """(deadline, user_id, challenge_id) of running streaks that lapse before `until`, earliest first"""
+    return db.execute(
+        select(UserChallenge.streak_deadline, UserChallenge.user_id, UserChallenge.challenge_id)
+        .where(UserChallenge.streak_deadline <= until, UserChallenge.is_active.is_(True),
+               UserChallenge.current_streak > 0)
+        .order_by(UserChallenge.streak_deadline)
+        .limit(limit)
+    ).all()
+
+
+def expire_streaks(db, keys: list[tuple[str, str]], now: datetime) -> int:
+    """
+    Reset the streaks of the given (user_id, challenge_id) pairs whose deadline has passed.
+
+    Pairs completed again in the meantime have a later deadline and are left
+    alone. Also refreshes the current streak of the affected users and logs a
+    streak_expired event per reset streak. Returns the number of streaks reset;
+    does not commit.
+    """
+    if not keys:
+        return 0
+    expired = db.execute(
+        update(UserChallenge)
+        .where(tuple_(UserChallenge.user_id, UserChallenge.challenge_id).in_(keys),
+               UserChallenge.streak_deadline <= now, UserChallenge.current_streak > 0)
+        .values(current_streak=0)
+        .returning(UserChallenge.user_id, UserChallenge.challenge_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    user_ids = {user_id for user_id, _ in keys}
+    db.execute(
+        update(User).where(User.id.in_(user_ids)).values(current_streak=_active_streak_max(User.id))
+        .execution_options(synchronize_session=False)
+    )
+    if expired:
+        db.execute(insert(WalletEvent), [
+            {"user_id": user_id, "type": STREAK_EXPIRED, "amount": 0, "challenge_id": challenge_id, "created_at": now}
+            for user_id, challenge_id in expired
+        ])
+    return len(expired)
+
+
+def backfill_streak_deadlines(db, window_for, batch_size: int = 1000) -> int:
+    """
+    Set streak_deadline on running streaks that have none (rows imported by bulk_load_users).
+
+    `window_for(time_horizon)` gives the streak window of a challenge. Commits per batch.
+    """
+    filled = 0
+    while True:
+        rows = db.execute(
+            select(UserChallenge.id, UserChallenge.completed_at, UserChallenge.time_horizon)
+            .where(UserChallenge.streak_deadline.is_(None), UserChallenge.completed_at.is_not(None))
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return filled
+        db.execute(update(UserChallenge), [
+            {"id": row.id, "streak_deadline": row.completed_at + window_for(row.time_horizon)} for row in rows
+        ])
+        db.commit()
+        filled += len(rows)
+
+
+def get_badges(db, user_id: str):
+    """Get all badges of a user, oldest first"""
+    return db.query(Badge).filter(Badge.user_id == user_id).order_by(Badge.earned_at, Badge.id).all()
+
+
+def get_transactions_page(db, user_id: str, limit: int, before: tuple[datetime, int] | None = None):
+    """
+    Get up to `limit` transactions of a user, newest first.
+
+    Keyset pagination on (created_at, id): pass the (created_at, id) of the last
+    row of the previous page as `before` to continue after it. Served by the
+    (user_id, created_at) index, so deep pages cost the same as the first one.
+    """
+    query = db.query(Transaction).filter(Transaction.user_id == user_id)
+    if before is not None:
+        query = query.filter(tuple_(Transaction.created_at, Transaction.id) < tuple_(*before))
+    return query.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit).all()
+
+
+def iter_transaction_batches(db, user_id: str, batch_size: int = 1000):
+    """
+    Yield all transactions of a user, oldest first, as lists of at most `batch_size` rows.
+
+    Rows are plain column tuples (no ORM objects) fetched one keyset batch at a
+    time, so memory stays flat however long the history is.
+    """
+    columns = select(
+        Transaction.id, Transaction.type, Transaction.amount, Transaction.description, Transaction.created_at
+    ).where(Transaction.user_id == user_id).order_by(Transaction.created_at, Transaction.id).limit(batch_size)
+
+    after = None
+    while True:
+        query = columns
+        if after is not None:
+            query = query.where(tuple_(Transaction.created_at, Transaction.id) > tuple_(*after))
+        batch = db.execute(query).all()
+        if not batch:
+            return
+        yield batch
+        after = (batch[-1].created_at, batch[-1].id)
+
+
+# ========== LEDGER AND USER SUMMARIES ==========
+#
+# The wallet / stats columns on the users row (wallet_balance, total_impact,
+# current_streak, longest_streak, total_challenges_completed) are a summary of
+# the transactions ledger. They are only changed through record_earned /
+# record_redeemed, which insert the ledger row and bump the summary in the same
+# DB transaction, so reading balance and stats is a single row lookup.
+# reconcile_user_summaries rebuilds them from the ledger.
+#
+# Both also append to wallet_events, the append-only event log that ledger.py
+# replays (together with badge and challenge start / stop events). Events are
+# written in the same DB transaction as the change they record, so the log and
+# the summary always commit together.
+
+def _active_streak_max(user_id):
+    return select(func.coalesce(func.max(UserChallenge.current_streak), 0)).where(
+        UserChallenge.user_id == user_id, UserChallenge.is_active.is_(True)
+    ).scalar_subquery()
+
+
+def record_earned(db, user_id: str, amount: int, description: str, challenge_id: str | None = None,
+                  streak: int = 0, created_at: datetime | None = None) -> Transaction:
+    """
+    Add an 'earned' ledger entry and update the user's summary row.
+
+    Pass the challenge and its new streak for challenge completions. Does not
+    commit; the caller commits both writes together.
+    """
+    created_at = created_at or datetime.utcnow()
+    transaction = Transaction(
+        user_id=user_id, type="earned", amount=amount, description=description,
+        challenge_id=challenge_id, created_at=created_at,
+    )
     db.add(transaction)
-    db.commit()
+    append_event(db, user_id, EARNED, amount, challenge_id, created_at)
+    # the streak subquery below must see the caller's habit changes
+    db.flush()
+
+    values = {
+        "wallet_balance": func.coalesce(User.wallet_balance, 0) + amount,
+        "total_impact": func.coalesce(User.total_impact, 0) + amount,
+    }
+    if challenge_id is not None:
+        values["total_challenges_completed"] = func.coalesce(User.total_challenges_completed, 0) + 1
+        values["longest_streak"] = case(
+            (func.coalesce(User.longest_streak, 0) < streak, streak), else_=User.longest_streak
+        )
+        values["current_streak"] = _active_streak_max(user_id)
+    db.execute(update(User).where(User.id == user_id).values(**values))
     return transaction
+
+
+def record_redeemed(db, user_id: str, amount: int, description: str,
+                    created_at: datetime | None = None) -> Transaction | None:
+    """
+    Take `amount` from the user's balance and add a 'redeemed' ledger entry of -amount.
+
+    The balance check and the subtraction are one conditional UPDATE, so concurrent
+    redeems can never overdraw the wallet. Returns None (and writes nothing) if the
+    balance is too low. Does not commit.
+    """
+    result = db.execute(
+        update(User)
+        .where(User.id == user_id, func.coalesce(User.wallet_balance, 0) >= amount)
+        .values(wallet_balance=func.coalesce(User.wallet_balance, 0) - amount)
+    )
+    if result.rowcount == 0:
+        return None
+
+    created_at = created_at or datetime.utcnow()
+    transaction = Transaction(
+        user_id=user_id, type="redeemed", amount=-amount, description=description,
+        created_at=created_at,
+    )
+    db.add(transaction)
+    append_event(db, user_id, REDEEMED, -amount, created_at=created_at)
+    return transaction
+
+
+def award_badge(db, user_id: str, challenge_id: str | None, title: str, icon: str,
+                earned_at: datetime | None = None) -> Badge:
+    """Give the user a badge and log it. Does not commit."""
+    earned_at = earned_at or datetime.utcnow()
+    badge = Badge(user_id=user_id, challenge_id=challenge_id, title=title, icon=icon, earned_at=earned_at)
+    db.add(badge)
+    append_event(db, user_id, BADGE_AWARDED, challenge_id=challenge_id, created_at=earned_at)
+    return badge
+
+
+def refresh_current_streak(db, user_id: str):
+    """Recompute the user's current streak after habits were stopped or reset. Does not commit."""
+    db.flush()
+    db.execute(update(User).where(User.id == user_id).values(current_streak=_active_streak_max(user_id)))
+
+
+def reconcile_user_summaries(db, chunk_size: int = 1000) -> int:
+    """
+    Rebuild the summary columns of every user from the ledger, `chunk_size` users at a time.
+
+    Balance, impact and completions come from the transactions table (completions
+    are 'earned' rows that reference a challenge), plus the completions a user was
+    imported with (their opening_completed event). The current streak comes from
+    the active habits; the longest streak is kept unless a habit is above it.
+    Commits after each chunk and returns the number of users reconciled.
+    """
+    reconciled = 0
+    last_id = None
+    while True:
+        query = select(User.id, User.longest_streak).order_by(User.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(User.id > last_id)
+        users = db.execute(query).all()
+        if not users:
+            return reconciled
+        user_ids = [u.id for u in users]
+
+        ledger = {
+            row.user_id: row for row in db.execute(
+                select(
+                    Transaction.user_id,
+                    func.coalesce(func.sum(Transaction.amount), 0).label("balance"),
+                    func.coalesce(func.sum(case((Transaction.type == "earned", Transaction.amount), else_=0)), 0)
+                    .label("impact"),
+                    func.count(case(((Transaction.type == "earned") & Transaction.challenge_id.is_not(None), 1)))
+                    .label("completed"),
+                ).where(Transaction.user_id.in_(user_ids)).group_by(Transaction.user_id)
+            )
+        }
+        opening_completed = dict(db.execute(
+            select(WalletEvent.user_id, func.sum(WalletEvent.amount))
+            .where(WalletEvent.user_id.in_(user_ids), WalletEvent.type == OPENING_COMPLETED)
+            .group_by(WalletEvent.user_id)
+        ).all())
+        streaks = dict(db.execute(
+            select(UserChallenge.user_id, func.max(UserChallenge.current_streak))
+            .where(UserChallenge.user_id.in_(user_ids), UserChallenge.is_active.is_(True))
+            .group_by(UserChallenge.user_id)
+        ).all())
+
+        summaries = []
+        for user in users:
+            row = ledger.get(user.id)
+            current_streak = streaks.get(user.id) or 0
+            summaries.append({
+                "id": user.id,
+                "wallet_balance": row.balance if row else 0,
+                "total_impact": row.impact if row else 0,
+                "total_challenges_completed": (row.completed if row else 0) + (opening_completed.get(user.id) or 0),
+                "current_streak": current_streak,
+                "longest_streak": max(user.longest_streak or 0, current_streak),
+            })
+        db.execute(update(User), summaries)
+        db.commit()
+
+        reconciled += len(users)
+        last_id = user_ids[-1]
+
+
+# ========== WALLET EVENT LOG AND SNAPSHOTS ==========
+
+def append_event(db, user_id: str, type: str, amount: int = 0, challenge_id: str | None = None,
+                 created_at: datetime | None = None) -> WalletEvent:
+    """
+    Append an event to the wallet log. Does not commit.
+
+    Events are added to the session, so all events of a request are inserted
+    with one executemany when it commits.
+    """
+    event = WalletEvent(user_id=user_id, type=type, amount=amount, challenge_id=challenge_id,
+                        created_at=created_at or datetime.utcnow())
+    db.add(event)
+    return event
+
+
+def _event_columns(days: bool = False):
+    """(id, user_id, type, amount, challenge_id), or with days (id, type, amount, challenge_id, day)."""
+    if days:
+        return select(WalletEvent.id, WalletEvent.type, WalletEvent.amount, WalletEvent.challenge_id,
+                      func.substr(cast(WalletEvent.created_at, String), 1, 10))
+    return select(WalletEvent.id, WalletEvent.user_id, WalletEvent.type, WalletEvent.amount, WalletEvent.challenge_id)
+
+
+def iter_event_batches(db, user_id: str | None = None, after_id: int = 0, batch_size: int = 10000,
+                       until_id: int | None = None):
+    """
+    Yield batches of (id, user_id, type, amount, challenge_id) rows with after_id < id <= until_id, in id order.
+
+    Limited to one user if user_id is given. Plain rows keyed on id, so replaying
+    a long log reads it in constant memory.
+    """
+    columns = _event_columns()
+    if user_id is not None:
+        columns = columns.where(WalletEvent.user_id == user_id)
+    if until_id is not None:
+        columns = columns.where(WalletEvent.id <= until_id)
+    while True:
+        batch = db.execute(columns.where(WalletEvent.id > after_id).order_by(WalletEvent.id).limit(batch_size)).all()
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1].id
+
+
+def iter_event_days(db, after_id: int = 0, before_id: int | None = None, batch_size: int = 100000):
+    """
+    Yield batches of (id, type, amount, challenge_id, day) rows with after_id < id < before_id, in id order.
+
+    day is the 'YYYY-MM-DD' date of created_at, cut in SQL so no datetimes are built per row.
+    """
+    columns = _event_columns(days=True)
+    if before_id is not None:
+        columns = columns.where(WalletEvent.id < before_id)
+    while True:
+        batch = db.execute(columns.where(WalletEvent.id > after_id).order_by(WalletEvent.id).limit(batch_size)).all()
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1].id
+
+
+class EventTail:
+    """
+    A reader's position in wallet_events, for following the log by id.
+
+    Ids are handed out when an event is inserted, not when it commits: on
+    Postgres a transaction can commit an event after higher ids were read. So
+    the tail keeps the ids it skipped (gaps, with the time they were skipped)
+    and reads them again on every call until they show up. A rolled-back insert
+    leaves a gap that never fills; gaps still missing gap_seconds after they
+    were skipped are dropped. At most MAX_EVENT_GAPS are kept, the newest.
+
+    Rows are those of iter_event_batches, or of iter_event_days with days=True.
+    last_id and gaps are plain values, so a tail can be saved and restored.
+    """
+
+    def __init__(self, last_id: int = 0, gaps: dict[int, float] | None = None,
+                 gap_seconds: float = EVENT_GAP_SECONDS, days: bool = False):
+        self.last_id = last_id
+        self.gaps = dict(gaps or {})
+        self.gap_seconds = gap_seconds
+        self.days = days
+
+    def batches(self, db, batch_size: int = 10000):
+        """
+        Yield batches of the events not read before: first the skipped ones committed
+        since, then those after last_id, in id order.
+
+        The position moves past a batch when the next one is asked for, so a
+        reader that fails on a batch reads it again on its next call.
+        """
+        columns = _event_columns(self.days)
+        if self.gaps:
+            late = db.execute(columns.where(WalletEvent.id.in_(list(self.gaps))).order_by(WalletEvent.id)).all()
+            if late:
+                yield late
+            found = {row.id for row in late}
+            expired = time.time() - self.gap_seconds
+            self.gaps = {event_id: skipped_at for event_id, skipped_at in self.gaps.items()
+                         if event_id not in found and skipped_at > expired}
+        while True:
+            batch = db.execute(columns.where(WalletEvent.id > self.last_id)
+                               .order_by(WalletEvent.id).limit(batch_size)).all()
+            if not batch:
+                return
+            yield batch
+            self._skip(batch)
+
+    def _skip(self, batch):
+        """Move past a batch, noting the ids missing from it."""
+        if batch[-1].id - self.last_id > len(batch):
+            now, expected = time.time(), self.last_id + 1
+            for row in batch:
+                if row.id > expected:
+                    self.gaps.update(dict.fromkeys(range(max(expected, row.id - MAX_EVENT_GAPS), row.id), now))
+                expected = row.id + 1
+            if len(self.gaps) > MAX_EVENT_GAPS:
+                self.gaps = dict(sorted(self.gaps.items())[-MAX_EVENT_GAPS:])
+        self.last_id = batch[-1].id
+
+
+def get_challenge_categories(db) -> dict[str, str | None]:
+    return dict(db.execute(select(Challenge.id, Challenge.category)).all())
+
+
+def get_last_event_id(db) -> int:
+    return db.execute(select(func.max(WalletEvent.id))).scalar() or 0
+
+
+def get_settled_event_id(db, gap_seconds: float = EVENT_GAP_SECONDS) -> int:
+    """
+    The id of the newest event logged more than gap_seconds ago.
+
+    The log up to here is settled: as EventTail assumes, an event commits within
+    gap_seconds or not at all, so no lower id can still show up. Found by walking
+    the ids down from the newest, which only reads the last gap_seconds of events.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=gap_seconds)
+    return db.execute(select(WalletEvent.id).where(WalletEvent.created_at <= cutoff)
+                      .order_by(WalletEvent.id.desc()).limit(1)).scalar() or 0
+
+
+# Columns the leaderboards rank users by, plus their region
+LEADERBOARD_COLUMNS = (User.id, User.region, User.total_impact, User.longest_streak, User.total_challenges_completed)
+
+
+def iter_leaderboard_rows(db, batch_size: int = 50000):
+    """Yield batches of every user's leaderboard columns, in id order (keyset pagination)."""
+    after_id = None
+    while True:
+        query = select(*LEADERBOARD_COLUMNS).order_by(User.id).limit(batch_size)
+        if after_id is not None:
+            query = query.where(User.id > after_id)
+        batch = db.execute(query).all()
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1].id
+
+
+def get_leaderboard_rows(db, user_ids: list[str]) -> list:
+    return db.execute(select(*LEADERBOARD_COLUMNS).where(User.id.in_(user_ids))).all()
+
+
+def get_user_names(db, user_ids: list[str]) -> dict[str, str]:
+    return dict(db.execute(select(User.id, User.name).where(User.id.in_(user_ids))).all())
+
+
+def get_friend_ids(db, user_id: str) -> list[str]:
+    return db.execute(select(Friendship.friend_id).where(Friendship.user_id == user_id)).scalars().all()
+
+
+def add_friend(db, user_id: str, friend_id: str) -> bool:
+    """Make two users friends (both directions); False if they already were. Does not commit."""
+    existing = set(db.execute(
+        select(Friendship.user_id, Friendship.friend_id).where(
+            or_(tuple_(Friendship.user_id, Friendship.friend_id) == (user_id, friend_id),
+                tuple_(Friendship.user_id, Friendship.friend_id) == (friend_id, user_id)))
+    ).all())
+    rows = [{"user_id": a, "friend_id": b} for a, b in ((user_id, friend_id), (friend_id, user_id))
+            if (a, b) not in existing]
+    if rows:
+        db.execute(insert(Friendship), rows)
+    return len(rows) > 0
+
+
+def remove_friend(db, user_id: str, friend_id: str) -> bool:
+    """Undo add_friend; False if they were not friends. Does not commit."""
+    result = db.execute(Friendship.__table__.delete().where(
+        or_(tuple_(Friendship.user_id, Friendship.friend_id) == (user_id, friend_id),
+            tuple_(Friendship.user_id, Friendship.friend_id) == (friend_id, user_id))))
+    return result.rowcount > 0
+
+
+def get_wallet_snapshot(db, user_id: str) -> WalletSnapshot | None:
+    return db.get(WalletSnapshot, user_id)
+
+
+def users_due_for_snapshot(db, min_events: int, until_id: int) -> list[str]:
+    """
+    Users with at least `min_events` events logged after their latest snapshot and up to
+    until_id (one pass over the log).
+    """
+    last_event_id = func.coalesce(WalletSnapshot.last_event_id, 0)
+    return db.execute(
+        select(WalletEvent.user_id)
+        .outerjoin(WalletSnapshot, WalletSnapshot.user_id == WalletEvent.user_id)
+        .where(WalletEvent.id > last_event_id, WalletEvent.id <= until_id)
+        .group_by(WalletEvent.user_id)
+        .having(func.count() >= min_events)
+        .order_by(WalletEvent.user_id)
+    ).scalars().all()
+
+
+def save_wallet_snapshots(db, snapshots: list[dict]):
+    """Insert or replace the snapshots of several users with one statement. Does not commit."""
+    if not snapshots:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        for snapshot in snapshots:
+            db.merge(WalletSnapshot(**snapshot))
+        return
+    statement = dialect_insert(WalletSnapshot)
+    columns = {name: statement.excluded[name] for name in snapshots[0] if name != "user_id"}
+    # never replace a snapshot with an older one written concurrently
+    db.execute(statement.on_conflict_do_update(
+        index_elements=["user_id"], set_=columns,
+        where=WalletSnapshot.last_event_id < statement.excluded.last_event_id,
+    ), snapshots)
+
+
+# ========== IDEMPOTENCY KEYS ==========
+
+def claim_idempotency_key(db, user_id: str, key: str, endpoint: str) -> bool:
+    """
+    Claim an Idempotency-Key for a request. Returns False if it was used before.
+
+    The claim is part of the caller's DB transaction: if the request fails and
+    rolls back, the key is released again.
+    """
+    return _insert_ignore(db, IdempotencyKey, {
+        "user_id": user_id, "key": key, "endpoint": endpoint, "created_at": datetime.utcnow(),
+    })
+
+
+def get_idempotency_key(db, user_id: str, key: str):
+    return db.get(IdempotencyKey, (user_id, key))
+
+
+def store_idempotent_response(db, user_id: str, key: str, status_code: int, response):
+    """Remember the response of a claimed key so retries can replay it. Does not commit."""
+    db.execute(update(IdempotencyKey).where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key
+    ).values(status_code=status_code, response=response))
+
+
+# ========== BULK LOADING ==========
+
+def parse_timestamp(value):
+    """Parse an ISO-8601 string into a naive UTC datetime (the format stored in the DB)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def load_challenges(db, challenges: list[dict]):
+    """Sync the challenge catalog (challenge.json) into the challenges table"""
+    existing = {challenge_id for (challenge_id,) in db.query(Challenge.id)}
+    rows = [
+        {
+            "id": challenge["id"],
+            "title": challenge.get("challenge"),
+            "description": challenge.get("impact"),
+            "category": challenge.get("category"),
+            "reward": challenge.get("currency_reward_points", 0),
+            "duration": challenge.get("time_variable"),
+            "icon": challenge.get("badge_image_theme"),
+        }
+        for challenge in challenges
+        if challenge["id"] not in existing
+    ]
+    if rows:
+        db.execute(insert(Challenge), rows)
+    db.commit()
+    return len(rows)
+
+
+def bulk_save_onboarding(db, onboarded: list[dict], now: datetime):
+    """
+    Store the answers and recommendations of many onboarded users.
+
+    Each item has user_id, name, email, answers and recommended_challenges. New
+    users are inserted, existing ones get their answers and recommendations
+    replaced; every user gets an onboarding_data row. One statement per table.
+    Does not commit.
+    """
+    user_ids = [item["user_id"] for item in onboarded]
+    existing = set(db.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+    new_users = [
+        {"id": item["user_id"], "name": item["name"], "email": item["email"], "answers": item["answers"],
+         "recommended_challenges": item["recommended_challenges"], "wallet_balance": 0, "total_impact": 0,
+         "created_at": now}
+        for item in onboarded if item["user_id"] not in existing
+    ]
+    updated_users = [
+        {"id": item["user_id"], "answers": item["answers"], "recommended_challenges": item["recommended_challenges"]}
+        for item in onboarded if item["user_id"] in existing
+    ]
+    if new_users:
+        db.execute(insert(User), new_users)
+    if updated_users:
+        db.execute(update(User), updated_users)
+    db.execute(insert(OnboardingData), [
+        {"user_id": item["user_id"], "answers": item["answers"], "created_at": now} for item in onboarded
+    ])
+
+
+def bulk_update_users(db, rows: list[dict]):
+    """
+    Update many users by id, each row holding "id" and the columns to set.
+
+    Rows setting the same columns share one executemany; ids without a user
+    are skipped. Does not commit.
+    """
+    users = User.__table__
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(column for column in row if column != "id")), []).append(row)
+    for columns, group in groups.items():
+        statement = update(users).where(users.c.id == bindparam("user_id")).values(
+            {column: bindparam(column) for column in columns})
+        db.execute(statement, [{"user_id": row["id"], **{c: row[c] for c in columns}} for row in group])
+
+
+def bulk_load_users(db, users, batch_size: int = 1000):
+    """
+    Bulk insert users given in the API / user.json format.
+
+    Users, their active habits, badges and transactions (plus the matching wallet
+    events) are flushed with one executemany per table every `batch_size` users.
+    Transactions without a date are dated at the time of the load.
+    Returns the number of users loaded.
+    """
+    tables = {User: [], UserChallenge: [], Badge: [], Transaction: [], WalletEvent: []}
+    friendships = []  # inserted last, once every user they reference exists
+    loaded = 0
+    loaded_at = datetime.utcnow()
+
+    def flush():
+        for model, rows in tables.items():
+            if rows:
+                db.execute(insert(model), rows)
+                rows.clear()
+        db.commit()
+
+    for user in users:
+        user_id = str(user["id"])
+        stats = user.get("stats") or {}
+        tables[User].append({
+            "id": user_id,
+            "name": user.get("name"),
+            "email": user.get("email"),
+            "answers": user.get("answers"),
+            "recommended_challenges": user.get("recommendedChallenges"),
+            "wallet_balance": user.get("walletBalance", 0),
+            "total_impact": user.get("totalImpact", 0),
+            "current_streak": stats.get("currentStreak", 0),
+            "longest_streak": stats.get("longestStreak", 0),
+            "total_challenges_completed": stats.get("totalChallengesCompleted", 0),
+            "region": user.get("region"),
+        })
+        # friendships are listed on both users; each side loads its own direction
+        friendships.extend({"user_id": user_id, "friend_id": str(friend_id)} for friend_id in user.get("friends") or [])
+        for challenge_id, habit in (user.get("activeHabits") or {}).items():
+            tables[UserChallenge].append({
+                "user_id": user_id,
+                "challenge_id": str(challenge_id),
+                "is_active": True,
+                "current_streak": habit.get("currentStreak", 0),
+                "completed_at": parse_timestamp(habit.get("lastCompleted")),
+                "time_horizon": habit.get("timeHorizon"),
+            })
+            tables[WalletEvent].append({
+                "user_id": user_id, "type": CHALLENGE_STARTED, "amount": 0, "challenge_id": str(challenge_id),
+                "created_at": parse_timestamp(habit.get("lastCompleted")) or datetime.utcnow(),
+            })
+        for badge in stats.get("badges") or []:
+            tables[Badge].append({
+                "user_id": user_id,
+                "challenge_id": badge.get("challengeId"),
+                "title": badge.get("title"),
+                "icon": badge.get("icon"),
+                "earned_at": parse_timestamp(badge.get("earnedAt")),
+            })
+            tables[WalletEvent].append({
+                "user_id": user_id, "type": BADGE_AWARDED, "amount": 0, "challenge_id": badge.get("challengeId"),
+                "created_at": parse_timestamp(badge.get("earnedAt")) or datetime.utcnow(),
+            })
+        # Opening ledger entries so the imported balance / impact / completions survive a reconcile
+        transactions = user.get("transactions") or []
+        earned = sum(t.get("amount", 0) for t in transactions if t.get("type") == "earned")
+        balance = sum(t.get("amount", 0) for t in transactions)
+        completions = sum(1 for t in transactions if t.get("type") == "earned" and t.get("challengeId") is not None)
+        opening_earned = user.get("totalImpact", 0) - earned
+        opening_redeemed = user.get("walletBalance", 0) - balance - opening_earned
+        opening_completed = stats.get("totalChallengesCompleted", 0) - completions
+        dates = [parse_timestamp(t["date"]) for t in transactions if t.get("date")]
+        opened_at = parse_timestamp(user.get("createdAt")) or (min(dates) if dates else loaded_at)
+        # (transaction row, wallet event type) pairs; the imported ledger also starts the user's event log
+        ledger = [
+            ({"user_id": user_id, "type": type_, "amount": amount, "description": "Opening balance",
+              "challenge_id": None, "created_at": opened_at}, event_type)
+            for type_, event_type, amount in (("earned", OPENING_EARNED, opening_earned),
+                                              ("redeemed", OPENING_REDEEMED, opening_redeemed)) if amount
+        ]
+        for transaction in transactions:
+            ledger.append(({
+                "user_id": user_id,
+                "type": transaction.get("type"),
+                "amount": transaction.get("amount"),
+                "description": transaction.get("description"),
+                "challenge_id": transaction.get("challengeId"),
+                "created_at": parse_timestamp(transaction.get("date")) or loaded_at,
+            }, transaction.get("type")))
+        tables[Transaction].extend(row for row, _ in ledger)
+        tables[WalletEvent].extend({
+            "user_id": user_id, "type": event_type, "amount": row["amount"], "challenge_id": row["challenge_id"],
+            "created_at": row["created_at"],
+        } for row, event_type in ledger)
+        if opening_completed > 0:
+            tables[WalletEvent].append({"user_id": user_id, "type": OPENING_COMPLETED, "amount": opening_completed,
+                                        "challenge_id": None, "created_at": opened_at})
+
+        loaded += 1
+        if loaded % batch_size == 0:
+            flush()
+
+    flush()
+    if friendships:
+        db.execute(insert(Friendship), friendships)
+        db.commit()
+    return loaded
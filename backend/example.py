@@ -2,13 +2,31 @@ from pathlib import Path
 import sys
 import json
 
-# Add the parent directory to sys.path so we can import from main.py
-parent_dir = str(Path(__file__).parent.parent)
-if parent_dir not in sys.path:
-    sys.path.append(parent_dir)
+# Make the backend modules importable when run from another directory
+backend_dir = str(Path(__file__).parent)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
 
-# Import the recommender and data from main.py
-from main import recommender, load_json_data, user_data, questions_data, challenges_data
+# Only the recommender and the catalogs are needed; importing main would also
+# set up the database and the background workers
+from catalog import Catalog
+from recommendation.recommendation import StaticChallengeRecommender
+from recommendation.reranking import DiversityReranker
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def load_json_data(filename: str):
+    with open(DATA_DIR / filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+questions_data = load_json_data("question.json")
+challenges_data = load_json_data("challenge.json")
+recommender = StaticChallengeRecommender(questions_data)
+# spreads the top of the ranking over categories and badge themes, as the API does
+reranker = DiversityReranker.from_catalog(Catalog(challenges_data))
+user_data = load_json_data("user.json")
 
 def main():
     print("\nLoaded user profile:")
@@ -30,7 +48,7 @@ def main():
     
     # Get personalized challenge recommendations based on combined answers
     print("\nGetting challenge recommendations...")
-    recommendations = recommender(example_answers)
+    recommendations = recommender(example_answers, reranker=reranker)
     
     print("\nRecommended challenges:")
     
@@ -41,7 +59,7 @@ def main():
     for challenge_idx, reasons in recommendations[:4]:
         if 0 <= challenge_idx < len(challenges_data):
             challenge = challenges_data[challenge_idx]
-            challenge_id = str(challenge_idx + 1)
+            challenge_id = challenge["id"]
             
             status = ""
             if challenge_id in active_habits:
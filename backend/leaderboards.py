@@ -0,0 +1,378 @@
+"""
+Leaderboards on total impact, longest streak and challenges completed.
+
+RankingIndex keeps users ordered by score (highest first, ties by slot) as
+int64 keys ((MAX_SCORE - score) << 32 | slot) in sorted numpy blocks of up to
+2 * BLOCK_SIZE keys, with a Fenwick tree over the block lengths:
+- a score change is a removal plus an insertion: a bisect over the block
+  maxima, a searchsorted and a memmove inside one block, and a tree update;
+- a user's position is the tree's prefix sum before their block plus their
+  offset inside it;
+- the k-th position is found by descending the tree.
+All of these are O(log n) plus an O(BLOCK_SIZE) memmove in C. Ranks are
+competition ranks: 1 + the number of users with a strictly higher score.
+
+Leaderboards holds one index per metric for everyone and one per region.
+Friend leaderboards only hold a few users; they are ranked per request from
+the scores kept next to the indexes.
+
+The indexes are built in bulk from the users table on first use. After that
+LeaderboardUpdater reads the events logged every LEADERBOARD_SYNC_INTERVAL
+seconds and reloads the summary rows of the users they touch. As with the
+collaborative model, every worker process keeps its own copy; the process that
+handled a completion updates its copy right away.
+"""
+
+from bisect import bisect_left
+import logging
+import os
+import threading
+
+import numpy as np
+
+import database
+
+logger = logging.getLogger("eco_rewards")
+
+# API name of each metric -> users column
+METRICS = {
+    "totalImpact": "total_impact",
+    "longestStreak": "longest_streak",
+    "challengesCompleted": "total_challenges_completed",
+}
+BLOCK_SIZE = int(os.getenv("LEADERBOARD_BLOCK_SIZE", "1024"))
+SYNC_INTERVAL = float(os.getenv("LEADERBOARD_SYNC_INTERVAL", "5"))
+
+MAX_SCORE = 2 ** 31 - 1
+SLOT_BITS = 32
+
+
+def encode_keys(scores: np.ndarray, slots: np.ndarray) -> np.ndarray:
+    """Keys ordering (score, slot) pairs by score descending, then slot ascending."""
+    scores = np.clip(np.asarray(scores, dtype=np.int64), 0, MAX_SCORE)
+    return ((MAX_SCORE - scores) << SLOT_BITS) | np.asarray(slots, dtype=np.int64)
+
+
+def encode_key(score: int, slot: int) -> int:
+    return ((MAX_SCORE - min(max(int(score), 0), MAX_SCORE)) << SLOT_BITS) | slot
+
+
+def decode_keys(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(scores, slots) of keys."""
+    return MAX_SCORE - (keys >> SLOT_BITS), keys & ((1 << SLOT_BITS) - 1)
+
+
+class RankingIndex:
+    """Sorted multiset of int64 keys with O(log n) insert, remove, position and slice."""
+
+    def __init__(self, keys: np.ndarray | None = None):
+        keys = np.sort(np.asarray(keys if keys is not None else (), dtype=np.int64))
+        self._blocks = [keys[i:i + BLOCK_SIZE].copy() for i in range(0, len(keys), BLOCK_SIZE)]
+        self._maxes = [int(block[-1]) for block in self._blocks]
+        self._size = len(keys)
+        self._build_tree()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _build_tree(self):
+        tree = [0] + [len(block) for block in self._blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _add(self, block: int, delta: int):
+        i = block + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, block: int) -> int:
+        """Keys in the blocks before `block`."""
+        total = 0
+        while block > 0:
+            total += self._tree[block]
+            block -= block & -block
+        return total
+
+    def _find(self, position: int) -> tuple[int, int]:
+        """(block, offset in the block) of the key at `position`."""
+        block = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = block + step
+            if nxt < len(self._tree) and self._tree[nxt] <= position:
+                block = nxt
+                position -= self._tree[nxt]
+            step >>= 1
+        return block, position
+
+    def insert(self, key: int):
+        if not self._blocks:
+            self._blocks, self._maxes, self._size = [np.array([key], dtype=np.int64)], [key], 1
+            self._build_tree()
+            return
+        b = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+        block = self._blocks[b]
+        block = np.insert(block, np.searchsorted(block, key), key)
+        self._size += 1
+        if len(block) > 2 * BLOCK_SIZE:
+            self._blocks[b:b + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self._maxes[b:b + 1] = [int(block[BLOCK_SIZE - 1]), int(block[-1])]
+            self._build_tree()
+        else:
+            self._blocks[b] = block
+            self._maxes[b] = int(block[-1])
+            self._add(b, 1)
+
+    def remove(self, key: int) -> bool:
+        """Remove one occurrence of key; False if there is none."""
+        b = bisect_left(self._maxes, key)
+        if b == len(self._blocks):
+            return False
+        block = self._blocks[b]
+        i = int(np.searchsorted(block, key))
+        if i == len(block) or block[i] != key:
+            return False
+        block = np.delete(block, i)
+        self._size -= 1
+        if len(block):
+            self._blocks[b] = block
+            self._maxes[b] = int(block[-1])
+            self._add(b, -1)
+        else:
+            del self._blocks[b], self._maxes[b]
+            self._build_tree()
+        return True
+
+    def position(self, key: int) -> int:
+        """Number of keys smaller than key."""
+        b = bisect_left(self._maxes, key)
+        if b == len(self._blocks):
+            return self._size
+        return self._prefix(b) + int(np.searchsorted(self._blocks[b], key))
+
+    def slice(self, start: int, stop: int) -> np.ndarray:
+        """Keys at positions start..stop-1."""
+        start, stop = max(start, 0), min(stop, self._size)
+        if start >= stop:
+            return np.empty(0, dtype=np.int64)
+        b, offset = self._find(start)
+        parts, remaining = [], stop - start
+        while remaining > 0:
+            part = self._blocks[b][offset:offset + remaining]
+            parts.append(part)
+            remaining -= len(part)
+            b, offset = b + 1, 0
+        return np.concatenate(parts)
+
+
+class Leaderboards:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots: dict[str, int] = {}
+        self._user_ids: list[str] = []
+        self._regions: list[str | None] = []  # per slot
+        self._scores = {metric: np.zeros(0, dtype=np.int64) for metric in METRICS}  # per slot
+        self._global = {metric: RankingIndex() for metric in METRICS}
+        self._regional: dict[str, dict[str, RankingIndex]] = {metric: {} for metric in METRICS}
+        self.tail = database.EventTail()
+
+    @property
+    def last_event_id(self) -> int:
+        return self.tail.last_id
+
+    def __len__(self) -> int:
+        return len(self._user_ids)
+
+    def load(self, user_ids: list[str], regions: list[str | None], scores: dict[str, np.ndarray]):
+        """Replace the contents with these users (slots in list order) and their scores per metric."""
+        slots = np.arange(len(user_ids), dtype=np.int64)
+        codes = {}
+        region_codes = np.fromiter((codes.setdefault(r, len(codes)) for r in regions), dtype=np.int32,
+                                   count=len(regions))
+        global_indexes, regional_indexes, arrays = {}, {}, {}
+        for metric in METRICS:
+            arrays[metric] = np.asarray(scores[metric], dtype=np.int64)
+            keys = encode_keys(arrays[metric], slots)
+            global_indexes[metric] = RankingIndex(keys)
+            regional_indexes[metric] = {region: RankingIndex(keys[region_codes == code])
+                                        for region, code in codes.items() if region is not None}
+        with self._lock:
+            self._slots = {user_id: slot for slot, user_id in enumerate(user_ids)}
+            self._user_ids, self._regions = list(user_ids), list(regions)
+            self._scores, self._global, self._regional = arrays, global_indexes, regional_indexes
+
+    def rebuild(self, db, batch_size: int = 50000) -> int:
+        """Load every user from the users table in bulk; returns the number of users."""
+        last_event_id = database.get_last_event_id(db)  # read first: events after it are synced later
+        user_ids, regions, scores = [], [], {metric: [] for metric in METRICS}
+        for batch in database.iter_leaderboard_rows(db, batch_size=batch_size):
+            for row in batch:
+                user_ids.append(row.id)
+                regions.append(row.region)
+                for metric, column in METRICS.items():
+                    scores[metric].append(getattr(row, column) or 0)
+        self.load(user_ids, regions, {metric: np.array(values, dtype=np.int64) for metric, values in scores.items()})
+        self.tail = database.EventTail(last_event_id)
+        return len(user_ids)
+
+    def _slot(self, user_id: str) -> int:
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._slots[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+            self._regions.append(None)
+            for metric, scores in self._scores.items():
+                if slot == len(scores):
+                    scores = self._scores[metric] = np.resize(scores, max(16, 2 * len(scores)))
+                scores[slot] = 0
+                self._global[metric].insert(encode_key(0, slot))
+        return slot
+
+    def update(self, user_id: str, region: str | None, values: dict[str, int]):
+        """Set a user's region and their scores given by users column (e.g. {"total_impact": 120})."""
+        with self._lock:
+            slot = self._slot(user_id)
+            old_region = self._regions[slot]
+            for metric, column in METRICS.items():
+                scores = self._scores[metric]
+                old, new = int(scores[slot]), int(values.get(column) or 0)
+                if old == new and old_region == region:
+                    continue
+                old_key, new_key = encode_key(old, slot), encode_key(new, slot)
+                if old != new:
+                    self._global[metric].remove(old_key)
+                    self._global[metric].insert(new_key)
+                    scores[slot] = new
+                regional = self._regional[metric]
+                if old_region is not None:
+                    regional[old_region].remove(old_key)
+                if region is not None:
+                    regional.setdefault(region, RankingIndex()).insert(new_key)
+            self._regions[slot] = region
+
+    def update_rows(self, rows) -> int:
+        """Apply users rows as read by database.iter_leaderboard_rows."""
+        for row in rows:
+            self.update(row.id, row.region, {column: getattr(row, column) for column in METRICS.values()})
+        return len(rows)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._slots
+
+    def region_of(self, user_id: str) -> str | None:
+        slot = self._slots.get(user_id)
+        return None if slot is None else self._regions[slot]
+
+    def _index(self, metric: str, region: str | None) -> RankingIndex:
+        if region is None:
+            return self._global[metric]
+        return self._regional[metric].get(region) or RankingIndex()
+
+    def _entries(self, index: RankingIndex, start: int, stop: int) -> list[dict]:
+        start = max(start, 0)
+        scores, slots = decode_keys(index.slice(start, stop))
+        entries, rank, previous = [], None, None
+        for position, (score, slot) in enumerate(zip(scores.tolist(), slots.tolist()), start):
+            if score != previous:
+                # the first of equal scores in the slice may not be the first overall
+                rank = position + 1 if previous is not None else index.position(encode_key(score, 0)) + 1
+                previous = score
+            entries.append({"rank": rank, "userId": self._user_ids[slot], "value": score})
+        return entries
+
+    def size(self, metric: str, region: str | None = None) -> int:
+        with self._lock:
+            return len(self._index(metric, region))
+
+    def top(self, metric: str, n: int, region: str | None = None) -> list[dict]:
+        """The n best users as {rank, userId, value}."""
+        with self._lock:
+            return self._entries(self._index(metric, region), 0, n)
+
+    def rank(self, metric: str, user_id: str, region: str | None = None) -> dict | None:
+        """A user's {rank, userId, value}; None if they are not on this leaderboard."""
+        with self._lock:
+            slot = self._slots.get(user_id)
+            if slot is None or (region is not None and self._regions[slot] != region):
+                return None
+            score = int(self._scores[metric][slot])
+            rank = self._index(metric, region).position(encode_key(score, 0)) + 1
+            return {"rank": rank, "userId": user_id, "value": score}
+
+    def around(self, metric: str, user_id: str, k: int, region: str | None = None) -> list[dict]:
+        """The user with the k users placed above and below them; empty if they are not on this leaderboard."""
+        with self._lock:
+            slot = self._slots.get(user_id)
+            if slot is None or (region is not None and self._regions[slot] != region):
+                return []
+            index = self._index(metric, region)
+            position = index.position(encode_key(int(self._scores[metric][slot]), slot))
+            return self._entries(index, position - k, position + k + 1)
+
+    def among(self, metric: str, user_ids: list[str]) -> list[dict]:
+        """Leaderboard of just these users (e.g. someone and their friends); unknown users score 0."""
+        with self._lock:
+            scored = []
+            for user_id in dict.fromkeys(user_ids):
+                slot = self._slots.get(user_id)
+                scored.append((0 if slot is None else int(self._scores[metric][slot]), user_id))
+        scored.sort(key=lambda item: -item[0])
+        entries, rank = [], 0
+        for position, (score, user_id) in enumerate(scored, 1):
+            if not entries or score != entries[-1]["value"]:
+                rank = position
+            entries.append({"rank": rank, "userId": user_id, "value": score})
+        return entries
+
+    def sync(self, db, batch_size: int = 10000) -> int:
+        """Reload the users with events logged since the last sync; returns how many were reloaded."""
+        touched = set()
+        tail = database.EventTail(self.tail.last_id, self.tail.gaps)
+        for batch in tail.batches(db, batch_size=batch_size):
+            touched.update(row.user_id for row in batch)
+        touched = list(touched)
+        for start in range(0, len(touched), 500):
+            self.update_rows(database.get_leaderboard_rows(db, touched[start:start + 500]))
+        self.tail = tail
+        return len(touched)
+
+
+class LeaderboardUpdater:
+    """Calls leaderboards.sync every `interval` seconds in a daemon thread."""
+
+    def __init__(self, leaderboards: Leaderboards, session_factory=None, interval: float = SYNC_INTERVAL):
+        self.leaderboards = leaderboards
+        self.session_factory = session_factory or database.SessionLocal
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            synced = self.leaderboards.sync(db)
+        finally:
+            db.close()
+        if synced:
+            logger.debug("Leaderboards: reloaded %s users", synced)
+        return synced
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Leaderboard sync failed")
+
+    def start(self):
+        """Run in a daemon thread (once per process)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leaderboard-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,158 @@
+"""
+Replay of the wallet event log.
+
+A user's wallet (balance, impact, completed challenges, badges, active
+challenges) is a fold over their wallet_events in id order. Snapshots store
+that fold up to some event id, so rebuilding a wallet only replays the events
+logged after the user's latest snapshot instead of the whole history.
+take_snapshots refreshes the snapshots of users with enough new events; the
+SnapshotWorker runs it periodically in the background. Snapshots only fold the
+settled part of the log (database.get_settled_event_id): an event that commits
+late, below a snapshot's last_event_id, would never be replayed.
+"""
+
+from dataclasses import dataclass, field
+import logging
+import os
+import threading
+
+import database
+from database import (EARNED, REDEEMED, BADGE_AWARDED, CHALLENGE_STARTED, CHALLENGE_STOPPED,
+                      OPENING_EARNED, OPENING_REDEEMED, OPENING_COMPLETED)
+
+logger = logging.getLogger("eco_rewards")
+
+# Snapshot a user once this many events were logged after their latest snapshot
+SNAPSHOT_EVERY = int(os.getenv("WALLET_SNAPSHOT_EVERY", "100"))
+SNAPSHOT_INTERVAL = float(os.getenv("WALLET_SNAPSHOT_INTERVAL", "300"))
+
+
+@dataclass(slots=True)
+class WalletState:
+    last_event_id: int = 0
+    balance: int = 0
+    total_impact: int = 0
+    challenges_completed: int = 0
+    badges: int = 0
+    active_challenges: set = field(default_factory=set)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: database.WalletSnapshot) -> "WalletState":
+        return cls(snapshot.last_event_id, snapshot.balance, snapshot.total_impact,
+                   snapshot.challenges_completed, snapshot.badges, set(snapshot.active_challenges or ()))
+
+    def to_snapshot(self, user_id: str) -> dict:
+        return {
+            "user_id": user_id,
+            "last_event_id": self.last_event_id,
+            "balance": self.balance,
+            "total_impact": self.total_impact,
+            "challenges_completed": self.challenges_completed,
+            "badges": self.badges,
+            "active_challenges": sorted(self.active_challenges),
+        }
+
+
+def replay(events, state: WalletState | None = None) -> WalletState:
+    """
+    Apply (id, user_id, type, amount, challenge_id) events, in id order, to a wallet state.
+
+    The fold runs on local variables; this loop is what bounds replay throughput.
+    """
+    state = state or WalletState()
+    last_event_id, balance, impact = state.last_event_id, state.balance, state.total_impact
+    completed, badges, active = state.challenges_completed, state.badges, state.active_challenges
+
+    for event_id, _, type_, amount, challenge_id in events:
+        if type_ == EARNED:
+            balance += amount
+            impact += amount
+            if challenge_id is not None:
+                completed += 1
+        elif type_ == REDEEMED:
+            balance += amount
+        elif type_ == BADGE_AWARDED:
+            badges += 1
+        elif type_ == CHALLENGE_STARTED:
+            active.add(challenge_id)
+        elif type_ == CHALLENGE_STOPPED:
+            active.discard(challenge_id)
+        elif type_ == OPENING_EARNED:
+            balance += amount
+            impact += amount
+        elif type_ == OPENING_REDEEMED:
+            balance += amount
+        elif type_ == OPENING_COMPLETED:
+            completed += amount
+        last_event_id = event_id
+
+    state.last_event_id, state.balance, state.total_impact = last_event_id, balance, impact
+    state.challenges_completed, state.badges = completed, badges
+    return state
+
+
+def rebuild_wallet(db, user_id: str, use_snapshot: bool = True, until_id: int | None = None) -> WalletState:
+    """
+    A user's wallet, replayed from their latest snapshot (or from the first event):
+    the current one, or as of event until_id.
+    """
+    snapshot = database.get_wallet_snapshot(db, user_id) if use_snapshot else None
+    state = WalletState.from_snapshot(snapshot) if snapshot else WalletState()
+    for batch in database.iter_event_batches(db, user_id, after_id=state.last_event_id, until_id=until_id):
+        replay(batch, state)
+    return state
+
+
+def take_snapshots(db, min_events: int = SNAPSHOT_EVERY, chunk_size: int = 500) -> int:
+    """
+    Snapshot every user with at least `min_events` settled events since their latest snapshot.
+
+    Commits per chunk of users and returns the number of snapshots written.
+    """
+    settled_id = database.get_settled_event_id(db)
+    user_ids = database.users_due_for_snapshot(db, min_events, settled_id)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        database.save_wallet_snapshots(db, [rebuild_wallet(db, user_id, until_id=settled_id).to_snapshot(user_id)
+                                            for user_id in chunk])
+        db.commit()
+    return len(user_ids)
+
+
+class SnapshotWorker:
+    """Calls take_snapshots every `interval` seconds in a daemon thread."""
+
+    def __init__(self, session_factory=None, interval: float = SNAPSHOT_INTERVAL):
+        self.session_factory = session_factory or database.SessionLocal
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            written = take_snapshots(db)
+        finally:
+            db.close()
+        if written:
+            logger.info("Wrote %s wallet snapshots", written)
+        return written
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Wallet snapshots failed")
+
+    def start(self):
+        """Run in a daemon thread (once per process)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="wallet-snapshots", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+snapshot_worker = SnapshotWorker()
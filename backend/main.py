@@ -1,32 +1,50 @@
 # app.py
-from flask import Flask, request, jsonify, abort
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, g, make_response, stream_with_context
 from flask_cors import CORS
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
+from urllib.parse import parse_qs
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
 import logging
+import functools
+import hmac
+import base64
+import gzip
+import csv
+import io
 import json
-import traceback
 import os
-
-# import your recommender (keeps same API)
-from recommendation.recommendation import StaticChallengeRecommender
+import threading
+import time
+
+# NumPy and the recommender are imported on first use (see get_recommender), so importing this module stays cheap
+from recommendation.cache import recommendation_cache
+from catalog_cache import catalog_cache
+from streaks import streak_window, effective_streak, streak_scheduler
+from ledger import snapshot_worker
+from profiles import profile_store
+import observability
+import database
+from database import User, UserChallenge, Badge, Transaction
 
 # --- Setup ---
 
-app = Flask(__name__, static_folder=None, static_url_path=None)
-
-# Configure CORS (same allowed origins as original)
-CORS(app, resources={r"/api/*": {"origins": ["http://localhost:8080", "http://localhost:5173"]}},
-     supports_credentials=True)
+# Routes and request hooks are registered on this blueprint; create_app() builds the Flask app around it
+api = Blueprint("api", __name__)
 
-# Configure logging to stdout
+# Configure logging to stdout; LOG_FORMAT=json emits one JSON object per line including `extra` fields
 logger = logging.getLogger("eco_rewards")
-logger.setLevel(logging.INFO)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 stream_handler = logging.StreamHandler()
-stream_formatter = logging.Formatter(
-    fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+if os.getenv("LOG_FORMAT", "text") == "json":
+    stream_formatter = observability.JsonFormatter()
+else:
+    stream_formatter = logging.Formatter(
+        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
 stream_handler.setFormatter(stream_formatter)
 logger.handlers = []  # clear other handlers
 logger.addHandler(stream_handler)
@@ -58,32 +76,626 @@ def load_json_data(filename: str):
     with open(filepath, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-# Load static data (on startup)
-challenges_data = load_json_data("challenge.json")
-questions_data = load_json_data("question.json")
-user_data = load_json_data("user.json")
+# Requests without an X-User-Id header act on this user (the frontend has no login yet)
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "1")
+# /api/admin/* needs "Authorization: Bearer <ADMIN_TOKEN>"; without a token set they are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+# --- Lazily loaded resources ---
+# The catalogs, the recommender and the seeded database are loaded on first use (or all
+# at once by warmup()), so a cold start only pays for what its first request needs.
+
+_resources = {}
+_resources_lock = threading.RLock()
+# Seconds spent loading each resource in this process, in load order
+startup_timings: dict[str, float] = {}
+
+
+def _resource(name: str, load):
+    """The resource `name`, loaded by load() once per process."""
+    try:
+        return _resources[name]
+    except KeyError:
+        pass
+    with _resources_lock:
+        if name not in _resources:
+            started = time.perf_counter()
+            _resources[name] = load()
+            startup_timings[name] = time.perf_counter() - started
+            logger.debug("Loaded %s in %.1f ms", name, startup_timings[name] * 1000)
+        return _resources[name]
+
+
+def is_loaded(name: str) -> bool:
+    return name in _resources
+
+
+def get_challenges_data() -> list[dict]:
+    # the catalog cache also keeps the encoded responses
+    return _resource("challenges", lambda: catalog_cache.get("challenge.json").data)
+
+
+def get_questions_data() -> list[dict]:
+    return _resource("questions", lambda: catalog_cache.get("question.json").data)
+
+
+def _import_recommendation():
+    from recommendation import recommendation, weights_registry
+    return recommendation, weights_registry
+
+
+def get_catalog():
+    """Challenge catalog with the id index and the filter indexes (see catalog.py)."""
+    challenges = get_challenges_data()
+    _resource("numpy_recommendation_import", _import_recommendation)
+
+    def load():
+        from catalog import Catalog
+        return Catalog(challenges)
+
+    return _resource("catalog", load)
+
+
+def get_weights_registry():
+    """Versioned recommender weights; new versions are hot-swapped by refresh_weights."""
+    catalog, n_questions = get_catalog(), len(get_questions_data())
+    _, registry_module = _resource("numpy_recommendation_import", _import_recommendation)
+    return _resource("weights_registry", lambda: registry_module.WeightsRegistry(catalog, n_questions))
+
+
+def get_recommender():
+    registry, questions = get_weights_registry(), get_questions_data()
+    recommendation_module, _ = _resource("numpy_recommendation_import", _import_recommendation)
+
+    def load():
+        weights_version, weights = registry.load_current()
+        return recommendation_module.StaticChallengeRecommender(questions, weights, weights_version)
+
+    return _resource("recommender", load)
+
+
+def get_collaborative():
+    """Model learned from starts, stops and completions; its updater begins reading the event log when loaded."""
+    catalog = get_catalog()
+
+    def load():
+        from recommendation.collaborative import CollaborativeRecommender, CollaborativeUpdater
+        model = CollaborativeRecommender(catalog.ids)
+        updater = CollaborativeUpdater(model, on_users_changed=recommendation_cache.invalidate)
+        updater.start()
+        return model, updater
+
+    return _resource("collaborative", load)[0]
+
+
+def get_leaderboards():
+    """Ranking indexes for the leaderboards, built from the users table; kept current from the event log."""
+    def load():
+        from leaderboards import Leaderboards, LeaderboardUpdater
+        ensure_database()
+        leaderboards = Leaderboards()
+        db = database.SessionLocal()
+        try:
+            users = leaderboards.rebuild(db)
+        finally:
+            db.close()
+        logger.info("Leaderboards built for %s users", users)
+        LeaderboardUpdater(leaderboards).start()
+        return leaderboards
+
+    return _resource("leaderboards", load)
+
+
+def refresh_leaderboards(db, user_ids: list[str]):
+    """Reload these users into the leaderboards of this process right away, if they are loaded."""
+    if is_loaded("leaderboards"):
+        get_leaderboards().update_rows(database.get_leaderboard_rows(db, user_ids))
+
+
+def get_push_feed():
+    """The broker of this process's event streams, fed from the event log (see push.py)."""
+    def load():
+        import push
+        ensure_database()
+        feed = push.EventFeed(push.LocalBroker())
+        feed.start()
+        return feed
+
+    return _resource("push_feed", load)
+
+
+def notify_push():
+    """Push the events just committed by this process now instead of on the feed's next poll."""
+    if is_loaded("push_feed"):
+        get_push_feed().notify()
+
+
+def get_reranker():
+    """Diversity and exploration re-ranking of the recommender scores (see recommendation/reranking.py)."""
+    catalog = get_catalog()
+
+    def load():
+        from recommendation.reranking import DiversityReranker
+        return DiversityReranker.from_catalog(catalog)
+
+    return _resource("reranker", load)
+
+
+def seed_database():
+    """Create tables, sync the challenge catalog and load the example user if the DB is empty."""
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        database.load_challenges(db, get_challenges_data())
+        if database.get_user_by_id(db, DEFAULT_USER_ID) is None:
+            example_user = load_json_data("user.json")
+            example_user["id"] = DEFAULT_USER_ID
+            database.bulk_load_users(db, [example_user])
+        database.backfill_streak_deadlines(db, streak_window)
+    except IntegrityError:
+        # another worker seeded the same rows first
+        db.rollback()
+    finally:
+        db.close()
+
+
+def ensure_database():
+    """Seed the database once per process, before its first use."""
+    get_challenges_data()
+    _resource("database_engine", database.get_engine)
+    _resource("database_seed", seed_database)
+
+
+def warmup() -> dict[str, float]:
+    """Load every lazy resource now instead of on first use; returns the load times in seconds."""
+    ensure_database()
+    get_recommender()
+    get_reranker()
+    get_collaborative()
+    get_leaderboards()
+    logger.info("Warmed up in %.1f ms", sum(startup_timings.values()) * 1000,
+                extra={"startup_ms": {name: round(s * 1000, 1) for name, s in startup_timings.items()}})
+    return dict(startup_timings)
+
+
+def prewarm():
+    try:
+        warmup()
+    except Exception:
+        logger.exception("Prewarming failed; resources will be loaded on first use")
+
+
+def create_app(config: dict | None = None) -> Flask:
+    """
+    Build the Flask app. This is cheap: heavy resources are loaded on first use.
+
+    `config` overrides Flask config values. DATABASE_URL points this process at
+    another database, DATABASE_REPLICA_URLS (a list) at other read replicas, and PREWARM (default: env PREWARM=1) runs warmup() in a
+    background thread right away, so the first request doesn't pay for it.
+    """
+    app = Flask(__name__, static_folder=None, static_url_path=None)
+    app.config["PREWARM"] = os.getenv("PREWARM", "0") == "1"
+    app.config.update(config or {})
+    if app.config.get("DATABASE_URL") or app.config.get("DATABASE_REPLICA_URLS") is not None:
+        database.configure(app.config.get("DATABASE_URL") or database.DATABASE_URL,
+                           app.config.get("DATABASE_REPLICA_URLS"))
+
+    # Configure CORS (same allowed origins as original)
+    CORS(app, resources={r"/api/*": {"origins": ["http://localhost:8080", "http://localhost:5173"]}},
+         supports_credentials=True, expose_headers=["X-Next-Cursor", "X-Weights-Version"],
+         allow_headers=["Content-Type", "X-User-Id", "Idempotency-Key"])
+    app.register_blueprint(api)
+    app.teardown_appcontext(close_db)
+
+    if app.config["PREWARM"]:
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+    return app
+
+
+# --- Metrics and profiling ---
+
+# every engine, including ones created after a database.configure()
+observability.instrument_engine(Engine)
+observability.REGISTRY.register(observability.GaugeCallback(
+    "recommendation_cache", "Recommendation cache counters and hit ratio in this worker", ("stat",),
+    lambda: {(stat,): value for stat, value in recommendation_cache.stats().items()},
+))
+observability.REGISTRY.register(observability.GaugeCallback(
+    "profile_store", "Profile edits waiting for the write-behind flush and flush counters in this worker", ("stat",),
+    lambda: {("pending",): len(profile_store), **{(stat,): value for stat, value in profile_store.stats.items()}},
+))
+observability.REGISTRY.register(observability.GaugeCallback(
+    "leaderboards", "Users on the leaderboards of this worker and the last event they include", ("stat",),
+    lambda: ({("users",): len(get_leaderboards()), ("last_event_id",): get_leaderboards().last_event_id}
+             if is_loaded("leaderboards") else {}),
+))
+observability.REGISTRY.register(observability.GaugeCallback(
+    "push", "Event streams open on this worker, messages published to them and resyncs sent", ("stat",),
+    lambda: ({("streams",): len(get_push_feed().broker), ("last_event_id",): get_push_feed().last_event_id,
+              **{(stat,): value for stat, value in get_push_feed().broker.stats.items()}}
+             if is_loaded("push_feed") else {}),
+))
+
+
+def route_label() -> str:
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+@api.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.query_stats = observability.start_request_stats()
+    if observability.profiler is not None:
+        observability.profiler.start()
+
+
+@api.after_app_request
+def record_request_metrics(response):
+    if "request_started" not in g:
+        return response
+    elapsed = time.perf_counter() - g.pop("request_started")
+    route = route_label()
+    observability.HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    observability.HTTP_LATENCY.observe(elapsed, method=request.method, route=route)
+    observability.finish_request_stats(g.pop("query_stats"), route)
+
+    if observability.profiler is not None:
+        samples = observability.profiler.stop()
+        if samples and elapsed * 1000 >= observability.PROFILE_SLOW_REQUESTS_MS:
+            path = observability.write_collapsed_stacks(samples, observability.PROFILE_DIR,
+                                                        f"{request.method}-{route}")
+            logger.warning("Slow request profiled", extra={
+                "route": route, "method": request.method, "duration_ms": round(elapsed * 1000, 1),
+                "profile": str(path),
+            })
+    return response
+
+
+@api.route("/metrics", methods=["GET"])
+def metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return Response(observability.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@api.before_app_request
+def start_background_workers():
+    """Seed the database and start the streak expiry, wallet snapshot and profile flush workers with the first request (not at import, so CLI tools stay single-threaded)."""
+    ensure_database()
+    streak_scheduler.start()
+    snapshot_worker.start()
+    profile_store.start()
+
+
+# Resources built from challenge.json and question.json, rebuilt by refresh_catalogs
+CATALOG_RESOURCES = ("challenges", "questions", "catalog", "weights_registry", "recommender", "reranker")
+# (challenges, questions) that could not be loaded; not tried again until the files change
+_failed_catalogs = (None, None)
+
+
+def _same_catalogs(a: tuple, b: tuple) -> bool:
+    return all(x is y for x, y in zip(a, b))
+
+
+@api.before_app_request
+def refresh_catalogs():
+    """
+    Rebuild the catalog, the recommender and the reranker after challenge.json or question.json
+    changed on disk (the catalog cache checks at most every CATALOG_CHECK_INTERVAL seconds).
+    """
+    global _failed_catalogs
+    if not is_loaded("challenges"):
+        return  # loads the current files on first use
+    current = (catalog_cache.get("challenge.json").data, catalog_cache.get("question.json").data)
+    if (_same_catalogs(current, (_resources.get("challenges"), _resources.get("questions", current[1])))
+            or _same_catalogs(current, _failed_catalogs)):
+        return
+    with _resources_lock:
+        old = {name: _resources.pop(name) for name in CATALOG_RESOURCES if name in _resources}
+        try:
+            get_recommender()
+            get_reranker()
+            collaborative = _resources.get("collaborative")
+            if collaborative is not None and list(collaborative[0].positions) != get_catalog().ids:
+                collaborative[1].stop()  # learned for other challenges; relearned from the log
+                del _resources["collaborative"]
+                get_collaborative()
+        except Exception:
+            logger.exception("Could not load the changed catalogs; keeping the previous ones")
+            for name in CATALOG_RESOURCES:
+                _resources.pop(name, None)
+            _resources.update(old)
+            _failed_catalogs = current
+            return
+    if current[0] is not old.get("challenges") and is_loaded("database_seed"):
+        db = database.SessionLocal()
+        try:
+            database.load_challenges(db, current[0])
+        finally:
+            db.close()
+    recommendation_cache.clear()
+    logger.info("Reloaded the challenge and question catalogs")
+
+
+@api.before_app_request
+def refresh_weights():
+    """Pick up newly activated recommender weights (checked at most every few seconds)."""
+    if not is_loaded("recommender"):
+        return  # it loads the current version on first use
+    recommender = get_recommender()
+    try:
+        if get_weights_registry().refresh(recommender):
+            recommendation_cache.clear()
+            logger.info("Switched recommender weights to version %s", recommender.weights_version)
+    except Exception:
+        logger.exception("Could not load new recommender weights; keeping version %s",
+                         recommender.weights_version)
+
+
+# --- Per-request database session and user lookup ---
+
+class UserNotFound(Exception):
+    pass
+
+
+def get_db():
+    """Session for the current request, taken from the engine's connection pool."""
+    if "db" not in g:
+        g.db = database.SessionLocal()
+    return g.db
+
+
+# Cookie holding the time (epoch seconds) until which the client reads from the primary, set by writes
+PRIMARY_COOKIE = "read_primary_until"
+
+
+def reads_from_primary() -> bool:
+    """Whether the current user wrote recently, through this worker or (by cookie) any other."""
+    if database.reads_from_primary(current_user_id()):
+        return True
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def get_read_db():
+    """
+    Session for read-only routes: on a read replica when there are replicas.
+
+    Users who wrote within READ_YOUR_WRITES_SECONDS read from the primary, so they
+    see their own writes despite replication lag; so do requests already using it.
+    """
+    if "db" in g or not database.get_read_engines() or reads_from_primary():
+        return get_db()
+    if "read_db" not in g:
+        g.read_db = database.ReadSessionLocal()
+    return g.read_db
+
+
+def close_db(exception):
+    for name in ("db", "read_db"):
+        db = g.pop(name, None)
+        if db is not None:
+            db.close()
+
+
+@api.after_app_request
+def stick_to_primary(response):
+    """After a successful write, send the user's reads to the primary for a while (read-your-writes)."""
+    if (request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400
+            and request.endpoint != "api.batch" and database.get_read_engines()):  # a batch passes on its writes' cookies
+        database.note_write(current_user_id())
+        response.set_cookie(PRIMARY_COOKIE, str(int(time.time() + database.READ_YOUR_WRITES_SECONDS) + 1),
+                            max_age=int(database.READ_YOUR_WRITES_SECONDS) + 1, httponly=True, samesite="Lax")
+    return response
+
+
+def current_user_id() -> str:
+    return request.headers.get("X-User-Id", DEFAULT_USER_ID)
+
+
+def get_current_user(db) -> User:
+    """The requesting user, loaded once per session and request."""
+    cached = g.get("current_user")
+    if cached is not None and cached[0] is db and cached[1].id == current_user_id():
+        return cached[1]
+    user = database.get_user_by_id(db, current_user_id())
+    if user is None:
+        raise UserNotFound(current_user_id())
+    g.current_user = (db, user)
+    return user
+
+
+def on_commit(callback, *args):
+    """Run callback(*args) once the current request's writes are committed (see commit_writes)."""
+    g.setdefault("after_commit", []).append((callback, args))
+
+
+def commit_writes(db):
+    """
+    Commit a mutating route's writes, then run its on_commit callbacks.
+
+    Under @idempotent the writes are only flushed: the decorator commits them
+    together with the stored response.
+    """
+    if g.get("idempotency_key") is not None:
+        db.flush()
+        return
+    db.commit()
+    for callback, args in g.pop("after_commit", []):
+        callback(*args)
+
+
+def idempotent(view):
+    """
+    Make a mutating route safe to retry by sending the same Idempotency-Key header.
+
+    The key claim, the route's writes and its response are committed in one DB
+    transaction, so the work happens at most once and retries replay the stored
+    response. Routes commit through commit_writes for this.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return view(*args, **kwargs)
+
+        db = get_db()
+        user_id = current_user_id()
+        if not database.claim_idempotency_key(db, user_id, key, request.path):
+            stored = database.get_idempotency_key(db, user_id, key)
+            db.rollback()
+            if stored.endpoint != request.path:
+                return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+            if stored.status_code is None:
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            return jsonify(stored.response), stored.status_code
+
+        g.idempotency_key = key
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code >= 400:
+                # failed requests release the key so the client can retry
+                db.rollback()
+                return response
+            database.store_idempotent_response(db, user_id, key, response.status_code, response.get_json())
+            db.commit()
+        except BaseException:
+            g.pop("after_commit", None)
+            raise
+        finally:
+            g.pop("idempotency_key", None)
+        for callback, args in g.pop("after_commit", []):
+            callback(*args)
+        return response
+
+    return wrapper
+
+
+def catalog_response(filename: str) -> Response:
+    """Serve a static catalog from the cache, with ETag / 304 and gzip / brotli support."""
+    status, body, headers = catalog_cache.respond(
+        filename, request.headers.get("If-None-Match"), request.headers.get("Accept-Encoding")
+    )
+    observability.CATALOG_RESPONSES.inc(catalog=filename, status=status)
+    return Response(body, status=status, headers=headers)
+
+
+def serialize_habit(user_challenge: UserChallenge) -> dict:
+    return {
+        "challengeId": user_challenge.challenge_id,
+        "currentStreak": effective_streak(user_challenge),
+        "lastCompleted": user_challenge.completed_at.isoformat() if user_challenge.completed_at else None,
+        "timeHorizon": user_challenge.time_horizon,
+    }
+
+
+def serialize_badge(badge: Badge) -> dict:
+    return {
+        "id": str(badge.id),
+        "title": badge.title,
+        "icon": badge.icon,
+        "earnedAt": badge.earned_at.isoformat() if badge.earned_at else None,
+        "challengeId": badge.challenge_id,
+    }
+
+
+def serialize_transaction(transaction) -> dict:
+    """Works for Transaction objects and plain rows with the same column names."""
+    return {
+        "id": str(transaction.id),
+        "type": transaction.type,
+        "amount": transaction.amount,
+        "description": transaction.description,
+        "date": transaction.created_at.isoformat() if transaction.created_at else None,
+    }
+
+
+def serialize_user(db, user: User) -> dict:
+    """Build the user profile in the shape the frontend expects (see data/user.json)."""
+    profile = profile_store.overlay(user)
+    return {
+        "id": user.id,
+        "name": profile["name"],
+        "email": profile["email"],
+        "answers": profile["answers"] or {},
+        "region": user.region,
+        "recommendedChallenges": user.recommended_challenges or [],
+        "walletBalance": user.wallet_balance or 0,
+        "totalImpact": user.total_impact or 0,
+        "stats": {
+            "currentStreak": user.current_streak or 0,
+            "longestStreak": user.longest_streak or 0,
+            "totalChallengesCompleted": user.total_challenges_completed or 0,
+            "badges": [serialize_badge(b) for b in database.get_badges(db, user.id)],
+        },
+        "activeHabits": {
+            uc.challenge_id: serialize_habit(uc) for uc in database.get_active_challenges(db, user.id)
+        },
+    }
+
+
+def build_user_stats(db, user: User) -> dict:
+    # Stats are kept up to date on the user row by the ledger functions in database.py
+    return {
+        "currentStreak": user.current_streak or 0,
+        "longestStreak": user.longest_streak or 0,
+        "totalChallengesCompleted": user.total_challenges_completed or 0,
+        "badges": [serialize_badge(b) for b in database.get_badges(db, user.id)],
+    }
+
 
-recommender = StaticChallengeRecommender(questions_data)
+def active_habits_by_challenge(db, user_id: str) -> dict[str, UserChallenge]:
+    return {uc.challenge_id: uc for uc in database.get_active_challenges(db, user_id)}
 
 # --- Error handler to log unexpected exceptions ---
-@app.errorhandler(Exception)
+@api.app_errorhandler(UserNotFound)
+def handle_user_not_found(error):
+    return jsonify({"error": "User not found", "userId": str(error)}), 404
+
+@api.app_errorhandler(Exception)
 def handle_unexpected_error(error):
-    logger.error("Unhandled exception: %s", error)
-    traceback.print_exc()
+    if isinstance(error, HTTPException):
+        # 404 / 405 etc. keep their status (and metrics label)
+        return error
+    logger.exception("Unhandled exception: %s", error, extra={"route": route_label()})
     response = {"error": "Internal server error", "message": str(error)}
     return jsonify(response), 500
 
 # --- Routes ---
-@app.route("/", methods=["GET"])
+@api.route("/", methods=["GET"])
 def root():
     return jsonify({"message": "EcoRewards API is running", "docs": "/docs"})
 
-@app.route("/api/questions", methods=["GET"])
+@api.route("/api/questions", methods=["GET"])
 def get_questions():
     """Get onboarding questions"""
-    return jsonify(questions_data)
+    return catalog_response("question.json")
+
+def parse_answers(raw_answers) -> dict[int, int]:
+    """
+    Onboarding answers as {question id: -1, 0 or 1}; ids may be integer-like strings.
 
-@app.route("/api/onboarding", methods=["POST"])
+    Raises ValueError describing the first invalid entry.
+    """
+    if not isinstance(raw_answers, dict):
+        raise ValueError("'answers' must be an object of question ids to answers")
+    question_ids = {question["id"] for question in get_questions_data()}
+    answers = {}
+    for key, value in raw_answers.items():
+        try:
+            qid = int(key)
+        except (TypeError, ValueError):
+            raise ValueError(f"Question ID must be an integer-like string or int, got {key}") from None
+        if qid not in question_ids:
+            raise ValueError(f"Unknown question ID {qid}")
+        if type(value) is not int or value not in (-1, 0, 1):  # bool is an int subclass
+            raise ValueError(f"Answer for question {qid} must be -1, 0, or 1, got {value}")
+        answers[qid] = value
+    return answers
+
+@api.route("/api/onboarding", methods=["POST"])
 def submit_onboarding():
     """
     Store user onboarding responses and use them for personalization.
@@ -91,91 +703,188 @@ def submit_onboarding():
     """
     try:
         payload = request.get_json(silent=False)
-        print("Received payload:", payload)
-        if not payload:
+        if not payload or not isinstance(payload, dict):
             return jsonify({"error": "Invalid or empty JSON payload"}), 400
     except Exception as e:
-        print("JSON parsing error:", str(e))
+        logger.info("Invalid onboarding JSON", extra={"error": str(e)})
         return jsonify({"error": f"Failed to parse JSON: {str(e)}"}), 400
 
     raw_answers = payload.get("answers")
     if raw_answers is None:
         return jsonify({"error": "Missing 'answers' in payload"}), 400
 
-    # Convert keys to int if possible and validate values
-    answer_dict = {}
+    if not isinstance(raw_answers, dict):
+        return jsonify({"error": "Failed to parse answers", "details": "'answers' must be an object"}), 400
     try:
-        for k, v in raw_answers.items():
-            # keys may come as strings from JSON; try to convert to int
-            try:
-                qid = int(k)
-            except Exception:
-                logger.debug("Question id key could not be converted to int: %s", k)
-                return jsonify({"error": f"Question ID must be an integer-like string or int, got {k}"}), 422
-
-            # Validate answer type and value
-            if not isinstance(v, int) or v not in (-1, 0, 1):
-                return jsonify({"error": f"Answer for question {qid} must be -1, 0, or 1, got {v}"}), 422
+        answer_dict = parse_answers(raw_answers)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
 
-            answer_dict[qid] = v
+    # answers are only logged at DEBUG; this runs on every onboarding
+    logger.debug("Onboarding answers received", extra={"user_id": current_user_id(), "answers": answer_dict})
 
-    except Exception as e:
-        logger.exception("Error parsing onboarding answers")
-        return jsonify({"error": "Failed to parse answers", "details": str(e)}), 400
-
-    # Logging and print
-    logger.info("Received onboarding answers: %s", answer_dict)
-    print("Onboarding answers received:", answer_dict)
-
-    # Update in-memory user_data
-    user_data["answers"] = answer_dict
-
-    if "activeHabits" not in user_data:
-        user_data["activeHabits"] = {}
-
-    # Get personalized challenge recommendations (recommender returns indices)
+    # Get personalized challenge recommendations, stored by catalog id (the recommender returns weight rows)
+    recommender = get_recommender()
+    state = recommender.state
     try:
-        recommended_challenges = recommender.recommend_challenges(answer_dict)
+        with observability.RECOMMENDER_TIME.time(operation="onboarding"):
+            challenge_ids = get_catalog().ids
+            recommended_challenges = [challenge_ids[idx] for idx, _ in recommender.recommend_challenges(
+                answer_dict, state=state, reranker=get_reranker())]
     except Exception:
         logger.exception("Recommender failed; returning empty recommendations")
         recommended_challenges = []
 
-    user_data["recommendedChallenges"] = recommended_challenges
+    # Store answers on the user (created on first onboarding) plus an onboarding record
+    db = get_db()
+    user = database.get_user_by_id(db, current_user_id())
+    stored_answers = {str(qid): v for qid, v in answer_dict.items()}
+    if user is None:
+        user = User(id=current_user_id(), wallet_balance=0, total_impact=0, answers=stored_answers)
+        db.add(user)
+    user.recommended_challenges = recommended_challenges
+    if isinstance(payload.get("region"), str):
+        user.region = payload["region"]
+    db.add(database.OnboardingData(user_id=user.id, answers=stored_answers))
+    db.commit()
+    refresh_leaderboards(db, [user.id])
+    # answers go through the profile store (also for new users), so an older pending edit can't overwrite them
+    profile_store.update(user.id, {"answers": stored_answers})
+    recommendation_cache.invalidate(user.id)
+
+    return jsonify({"status": "success", "message": "Onboarding completed", "weightsVersion": state.version})
+
+# Content types accepted by POST /api/onboarding/bulk
+BULK_ONBOARDING_FORMATS = {"text/csv": "csv", "application/x-ndjson": "ndjson", "application/jsonl": "ndjson"}
+
+@api.route("/api/onboarding/bulk", methods=["POST"])
+def submit_bulk_onboarding():
+    """
+    Onboard many users from a partner export (CSV or NDJSON request body).
 
-    return jsonify({"status": "success", "message": "Onboarding completed"})
+    The body is parsed as it is read and stored in chunks; the response reports
+    how many records were imported and why others were rejected.
+    """
+    import onboarding_import  # imports NumPy; only needed by this route
 
-@app.route("/api/user/profile", methods=["GET"])
+    fmt = request.args.get("format") or BULK_ONBOARDING_FORMATS.get(request.mimetype)
+    if fmt is None:
+        return jsonify({"error": "Send text/csv or application/x-ndjson (or pass ?format=csv|ndjson)"}), 415
+    try:
+        chunk_size = int(request.args.get("chunkSize", onboarding_import.CHUNK_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid 'chunkSize'"}), 400
+
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    try:
+        records = onboarding_import.iter_records(lines, fmt, get_questions_data())
+        report = onboarding_import.ingest(get_db(), records, get_recommender(), get_catalog().ids,
+                                          chunk_size=max(1, chunk_size), reranker=get_reranker())
+    except (onboarding_import.ImportFormatError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Could not import onboarding data: {e}"}), 400
+    return jsonify(report.to_dict())
+
+# Profile fields clients may change through PUT /api/user/profile
+EDITABLE_PROFILE_FIELDS = {"name": "name", "email": "email", "answers": "answers"}
+
+@api.route("/api/user/profile", methods=["GET"])
 def get_user_profile():
-    return jsonify(user_data)
+    db = get_read_db()
+    return jsonify(serialize_user(db, get_current_user(db)))
 
-@app.route("/api/user/profile", methods=["PUT"])
+@api.route("/api/user/profile", methods=["PUT"])
 def update_user_profile():
     payload = request.get_json(silent=True)
-    if not payload:
+    if not payload or not isinstance(payload, dict):
         return jsonify({"error": "Invalid or empty JSON payload"}), 400
-    # merge provided fields into user_data
+    if "answers" in payload:
+        # validated here: the store writes it behind, after this response
+        try:
+            payload["answers"] = {str(qid): v for qid, v in parse_answers(payload["answers"]).items()}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    db = get_db()
+    user = get_current_user(db)
+    # wallet / stats are derived and not editable; the rest is written behind (see profiles.py)
+    changes = {}
     for field, value in payload.items():
-        user_data[field] = value
+        if field in EDITABLE_PROFILE_FIELDS:
+            changes[EDITABLE_PROFILE_FIELDS[field]] = value
+        else:
+            logger.warning("Ignoring non-editable profile field: %s", field)
+    if changes:
+        profile_store.update(user.id, changes)
+    if "answers" in payload:
+        recommendation_cache.invalidate(user.id)
     logger.info("User profile updated: %s", list(payload.keys()))
-    return jsonify(user_data)
+    return jsonify(serialize_user(db, user))
 
-@app.route("/api/challenges/<challenge_id>/stop", methods=["POST"])
+@api.route("/api/challenges/<challenge_id>/stop", methods=["POST"])
 def stop_challenge(challenge_id):
     """Stop an active challenge by removing it from user's activeHabits."""
-    if "activeHabits" not in user_data:
-        user_data["activeHabits"] = {}
-    
-    if challenge_id in user_data["activeHabits"]:
-        del user_data["activeHabits"][challenge_id]
+    db = get_db()
+    user = get_current_user(db)
+
+    # stopping drops the streak, like removing the habit did before
+    if database.stop_user_challenge(db, user.id, challenge_id, datetime.utcnow()):
+        db.commit()
         logger.info("Stopped challenge: %s", challenge_id)
         return jsonify({"status": "success", "message": "Challenge stopped"})
     else:
         return jsonify({"status": "not_found", "message": "Challenge was not active"}), 404
 
-@app.route("/api/challenges/personalized", methods=["GET"])
-def get_personalized_challenges():
-    print("Recommending personalized challenges")
-    if "answers" not in user_data or not user_data["answers"]:
+def rank_challenges(answers: dict, personalized_reasons: bool = False, state=None,
+                    user_id: str | None = None, cf_state=None, mask=None, k: int | None = None) -> list[dict]:
+    """
+    Ranked challenges with ids and reasons; depends only on the answers and the weights,
+    plus, given a user_id, the user's history in the collaborative model. `mask` (see
+    Catalog.mask) and `k` restrict the ranking to the best k allowed challenges.
+
+    The order is re-ranked for diversity, with an exploration slot drawn from a
+    generator seeded by the user and the model versions.
+    """
+    from recommendation.reranking import request_rng
+
+    # Get recommendations and reasons from the recommender
+    recommender = get_recommender()
+    reranker = get_reranker()
+    state = state or recommender.state
+    rng = request_rng(user_id or "", state.version, cf_state.version if cf_state is not None else "")
+    with observability.RECOMMENDER_TIME.time(operation="rank"):
+        if user_id is not None and cf_state is not None:
+            # blending can promote challenges from outside the answer-based top k, so rank all allowed ones;
+            # reasons stay answer-based, only the order blends in what similar users do
+            recommendations = dict(recommender(answers, personalized=personalized_reasons, state=state, mask=mask))
+            scores = get_collaborative().blend(user_id, recommender.score(answers, state=state), cf_state)
+            recommendations = [(idx, recommendations[idx]) for idx in reranker.rank(scores, k, mask, rng)]
+        else:
+            recommendations = recommender(answers, personalized=personalized_reasons, state=state, mask=mask, k=k,
+                                          reranker=reranker, rng=rng)
+
+    challenges = get_catalog().challenges
+    ranked_challenges = []
+
+    for idx, reasons in recommendations:
+        challenge = dict(challenges[idx])  # shallow copy so we don't mutate original unexpectedly
+        challenge["recommendationReasons"] = reasons
+        ranked_challenges.append(challenge)
+
+    return ranked_challenges
+
+# Values of ?exclude= on /api/challenges/personalized
+EXCLUDABLE_CHALLENGES = {"active", "completed"}
+
+def build_personalized_challenges(db, user: User, personalized_reasons: bool = False,
+                                  query=None) -> tuple[list[dict], str]:
+    """
+    Ranked challenges with reasons and the user's streak fields, plus the weights
+    version they were ranked with (shared with the ASGI app).
+
+    `query` holds the optional filters of the request (category, duration, minReward,
+    maxReward, exclude=active,completed and limit); invalid values raise ValueError.
+    """
+    answers = profile_store.overlay(user)["answers"]
+    if not answers:
         raise RuntimeError("User has not completed onboarding with answers yet")
         # Return all challenges with IDs when no personalization is available
         # return jsonify([
@@ -183,224 +892,554 @@ def get_personalized_challenges():
         #     for idx, challenge in enumerate(challenges_data)
         # ])
 
-    # Get recommendations and reasons from the recommender
-    recommendations = recommender(user_data["answers"])
+    from catalog import ChallengeFilter
+
+    query = query or {}
+    limit = int(query["limit"]) if query.get("limit") else None
+    if limit is not None and limit < 1:
+        raise ValueError("'limit' must be at least 1")
+    exclude = {part.strip() for part in (query.get("exclude") or "").split(",") if part.strip()}
+    if exclude - EXCLUDABLE_CHALLENGES:
+        raise ValueError(f"'exclude' accepts {', '.join(sorted(EXCLUDABLE_CHALLENGES))}")
+
+    active_habits = active_habits_by_challenge(db, user.id)
+    excluded_ids = set(active_habits) if "active" in exclude else set()
+    if "completed" in exclude:
+        excluded_ids |= database.get_completed_challenge_ids(db, user.id)
+    filters = ChallengeFilter.from_query(query, excluded_ids)
+
+    # One snapshot of the weights and of the collaborative model is used throughout, even if
+    # they are swapped meanwhile; the version covers both.
+    state = get_recommender().state
+    cf_state = get_collaborative().state
+    version = state.version if cf_state is None else f"{state.version}+{cf_state.version}"
+    if filters.is_empty and limit is None:
+        # The full ranking is cached per user; the per-user fields are merged into copies below.
+        ranked_challenges = recommendation_cache.get_or_compute(
+            user.id, answers, version, personalized_reasons,
+            lambda: rank_challenges(answers, personalized_reasons, state, user.id, cf_state),
+        )
+    else:
+        # filtered rankings are too varied to cache; the filter is applied while scoring
+        ranked_challenges = rank_challenges(answers, personalized_reasons, state, user.id, cf_state,
+                                            mask=get_catalog().mask(filters), k=limit)
 
     personalized_challenges = []
 
-    for rec in recommendations:
-        idx, reasons = rec
-        if 0 <= idx < len(challenges_data):
-            challenge = dict(challenges_data[idx])  # shallow copy so we don't mutate original unexpectedly
-            challenge_id = str(idx + 1)
-            
-            # Add ID and recommendation reasons
-            challenge["id"] = challenge_id
-            challenge["recommendationReasons"] = reasons
+    for ranked in ranked_challenges:
+        challenge = dict(ranked)
+        streak_info = active_habits.get(challenge["id"])
+        challenge["isActive"] = True if streak_info else False
+        challenge["currentStreak"] = 0 if not streak_info else effective_streak(streak_info)
 
-            streak_info = user_data.get("activeHabits", {}).get(challenge_id)
-            challenge["isActive"] = True if streak_info else False
-            challenge["currentStreak"] = 0 if not streak_info else streak_info.get("currentStreak", 0)
+        # last_completed_iso = 0 if not streak_info else streak_info.get("lastCompleted")
+        # time_horizon = streak_info.get("timeHorizon")
+        # if last_completed_iso:
+        #     last_completed = datetime.fromisoformat(last_completed_iso)
 
-            # last_completed_iso = 0 if not streak_info else streak_info.get("lastCompleted")
-            # time_horizon = streak_info.get("timeHorizon")
-            # if last_completed_iso:
-            #     last_completed = datetime.fromisoformat(last_completed_iso)
+        personalized_challenges.append(challenge)
 
-            personalized_challenges.append(challenge)
+    return personalized_challenges, version
 
-    return jsonify(personalized_challenges)
+@api.route("/api/challenges/personalized", methods=["GET"])
+def get_personalized_challenges():
+    """
+    Challenges ranked for the current user.
 
-@app.route("/api/challenges/<challenge_id>", methods=["GET"])
+    Optional filters: category and duration (comma-separated), minReward, maxReward,
+    exclude=active,completed and limit (top k).
+    """
+    db = get_read_db()
+    user = get_current_user(db)
+    # ?reasons=personalized ranks reasons by this user's answers instead of the static weights
+    personalized_reasons = request.args.get("reasons") == "personalized"
+    logger.debug("Recommending personalized challenges",
+                 extra={"user_id": user.id, "personalized_reasons": personalized_reasons})
+    try:
+        challenges, version = build_personalized_challenges(db, user, personalized_reasons, request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+    response = jsonify(challenges)
+    response.headers["X-Weights-Version"] = version
+    return response
+
+@api.route("/api/challenges/<challenge_id>", methods=["GET"])
 def get_challenge(challenge_id):
     """Return a single challenge with user-specific fields (isActive, currentStreak)"""
-    if not challenge_id.isdigit() or not (0 <= int(challenge_id) - 1 < len(challenges_data)):
+    challenge = get_catalog().get(challenge_id)
+    if challenge is None:
         return jsonify({"error": "Challenge not found"}), 404
 
-    idx = int(challenge_id) - 1
-    challenge = dict(challenges_data[idx])
-    challenge_id_str = str(idx + 1)
-
-    # Ensure id and recommendation reasons are available
-    challenge["id"] = challenge_id_str
+    # Ensure recommendation reasons are available
+    challenge = dict(challenge)
     challenge["recommendationReasons"] = challenge.get("recommendationReasons", [])
 
-    streak_info = user_data.get("activeHabits", {}).get(challenge_id_str)
+    db = get_read_db()
+    streak_info = database.get_user_challenge(db, get_current_user(db).id, challenge_id)
+    if streak_info is not None and not streak_info.is_active:
+        streak_info = None
     challenge["isActive"] = True if streak_info else False
-    challenge["currentStreak"] = 0 if not streak_info else streak_info.get("currentStreak", 0)
+    challenge["currentStreak"] = 0 if not streak_info else effective_streak(streak_info)
 
     return jsonify(challenge)
 
-@app.route("/api/challenges/<challenge_id>/start", methods=["POST"])
+@api.route("/api/challenges/<challenge_id>/start", methods=["POST"])
 def start_challenge(challenge_id):
-    if not challenge_id.isdigit() or not (0 <= int(challenge_id) - 1 < len(challenges_data)):
+    challenge = get_catalog().get(challenge_id)
+    if challenge is None:
         return jsonify({"error": "Challenge not found"}), 404
 
-    idx = int(challenge_id) - 1
-    challenge = challenges_data[idx]
-
-    if "activeHabits" not in user_data:
-        user_data["activeHabits"] = {}
-
-    if challenge_id not in user_data["activeHabits"]:
-        user_data["activeHabits"][challenge_id] = {
-            "challengeId": challenge_id,
-            "currentStreak": 0,
-            "lastCompleted": None,
-            "timeHorizon": challenge.get("time_variable")
-        }
+    db = get_db()
+    user = get_current_user(db)
+    database.activate_user_challenge(db, user.id, challenge_id, challenge.get("time_variable"), datetime.utcnow())
+    user_challenge = database.get_user_challenge(db, user.id, challenge_id)
+    db.commit()
 
     # reflect back some state
     result = dict(challenge)
     result["isActive"] = True
-    result["currentStreak"] = user_data["activeHabits"][challenge_id]["currentStreak"]
+    result["currentStreak"] = effective_streak(user_challenge)
     logger.info("Started challenge %s for user", challenge_id)
     return jsonify(result)
 
-@app.route("/api/challenges/<challenge_id>/complete", methods=["POST"])
+@api.route("/api/challenges/<challenge_id>/complete", methods=["POST"])
+@idempotent
 def complete_challenge(challenge_id):
-    if not challenge_id.isdigit() or not (0 <= int(challenge_id) - 1 < len(challenges_data)):
+    challenge = get_catalog().get(challenge_id)
+    if challenge is None:
         return jsonify({"error": "Challenge not found"}), 404
+    now = datetime.utcnow()
 
-    idx = int(challenge_id) - 1
-    challenge = challenges_data[idx]
-    now = datetime.now()
+    db = get_db()
+    user = get_current_user(db)
 
-    if "activeHabits" not in user_data:
-        user_data["activeHabits"] = {}
+    # Completing a challenge that isn't active starts it; the streak update is a single atomic UPDATE.
+    # The streak survives until the challenge's time horizon (plus grace) has passed without a completion.
+    time_horizon = challenge.get("time_variable")
+    database.activate_user_challenge(db, user.id, challenge_id, time_horizon, now)
+    streak = database.advance_streak(db, user.id, challenge_id, now, streak_window(time_horizon))
 
-    streak_info = user_data["activeHabits"].get(challenge_id)
-    if not streak_info:
-        streak_info = {
-            "challengeId": challenge_id,
-            "currentStreak": 0,
-            "lastCompleted": None,
-            "timeHorizon": challenge.get("time_variable")
-        }
-
-    last_completed = None
-    if streak_info.get("lastCompleted"):
-        try:
-            last_completed = datetime.fromisoformat(streak_info["lastCompleted"])
-        except Exception:
-            last_completed = None
-
-    if last_completed:
-        days_since_last = (now - last_completed).days
-        if days_since_last > 7:
-            streak_info["currentStreak"] = 1
-        else:
-            streak_info["currentStreak"] = streak_info.get("currentStreak", 0) + 1
-    else:
-        streak_info["currentStreak"] = 1
-
-    streak_info["lastCompleted"] = now.isoformat()
-    user_data["activeHabits"][challenge_id] = streak_info
-
-    # Safely update numeric fields in user_data
-    user_data["walletBalance"] = user_data.get("walletBalance", 0) + challenge.get("currency_reward_points", 0)
-    user_data["totalImpact"] = user_data.get("totalImpact", 0) + challenge.get("currency_reward_points", 0)
-    if "stats" not in user_data:
-        user_data["stats"] = {
-            "currentStreak": 0,
-            "longestStreak": 0,
-            "totalChallengesCompleted": 0,
-            "badges": []
-        }
-    user_data["stats"]["totalChallengesCompleted"] = user_data["stats"].get("totalChallengesCompleted", 0) + 1
-
-    if streak_info["currentStreak"] > user_data["stats"].get("longestStreak", 0):
-        user_data["stats"]["longestStreak"] = streak_info["currentStreak"]
+    # Ledger entry for the reward; updates balance and stats in the same DB transaction
+    reward = challenge.get("currency_reward_points", 0)
+    database.record_earned(db, user.id, reward, challenge.get("challenge", ""),
+                           challenge_id=challenge_id, streak=streak, created_at=now)
 
     # Create a badge on milestone streaks
-    if streak_info["currentStreak"] in [1, 5, 10, 25, 50, 100]:
-        new_badge = {
-            "id": f"badge_{len(user_data['stats'].get('badges', [])) + 1}",
-            "title": f"{challenge.get('challenge')} - {streak_info['currentStreak']} Streak",
-            "icon": badgeThemeEmojis.get(challenge.get("badge_image_theme", ""), "🏆"),
-            "earnedAt": now.isoformat(),
-            "challengeId": challenge_id
-        }
-        user_data["stats"].setdefault("badges", []).append(new_badge)
+    if streak in [1, 5, 10, 25, 50, 100]:
+        database.award_badge(
+            db, user.id, challenge_id,
+            title=f"{challenge.get('challenge')} - {streak} Streak",
+            icon=badgeThemeEmojis.get(challenge.get("badge_image_theme", ""), "🏆"),
+            earned_at=now,
+        )
+
+    on_commit(refresh_leaderboards, db, [user.id])
+    on_commit(notify_push)
+    commit_writes(db)
 
     logger.info("Completed challenge %s (streak=%s). Reward=%s",
-                challenge_id, streak_info["currentStreak"], challenge.get("currency_reward_points", 0))
+                challenge_id, streak, reward)
 
     return jsonify({
         "challenge": challenge,
-        "reward": challenge.get("currency_reward_points", 0),
-        "streak": streak_info["currentStreak"]
+        "reward": reward,
+        "streak": streak
     })
 
-@app.route("/api/wallet/transactions", methods=["GET"])
+# Page size limits for GET /api/wallet/transactions
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 500
+
+def encode_cursor(transaction: Transaction) -> str:
+    raw = f"{transaction.created_at.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    created_at, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), int(transaction_id)
+
+def build_transactions_page(db, user_id: str, limit: str | None, cursor: str | None) -> tuple[list[dict], str | None]:
+    """One page of serialized transactions and the cursor of the next page (None on the last page)."""
+    limit = int(limit) if limit else TRANSACTIONS_PAGE_SIZE
+    limit = max(1, min(limit, TRANSACTIONS_MAX_PAGE_SIZE))
+    before = decode_cursor(cursor) if cursor else None
+
+    # fetch one extra row to know whether another page exists
+    transactions = database.get_transactions_page(db, user_id, limit + 1, before=before)
+    next_cursor = encode_cursor(transactions[limit - 1]) if len(transactions) > limit else None
+    return [serialize_transaction(t) for t in transactions[:limit]], next_cursor
+
+@api.route("/api/wallet/transactions", methods=["GET"])
 def get_transactions():
-    transactions = user_data.get("transactions", [])
-    if transactions is None:
-        user_data["transactions"] = []
-        transactions = []
-    return jsonify(transactions)
+    """
+    Wallet history, newest first, paginated by cursor.
+
+    Query params: limit (default 50, max 500) and cursor (from the X-Next-Cursor header
+    of the previous page). ?format=ndjson streams the full history, oldest first.
+    """
+    db = get_read_db()
+    user = get_current_user(db)
+
+    if request.args.get("format") == "ndjson":
+        def generate():
+            for batch in database.iter_transaction_batches(db, user.id):
+                yield "".join(json.dumps(serialize_transaction(t)) + "\n" for t in batch)
 
-@app.route("/api/wallet/redeem", methods=["POST"])
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                        headers={"Content-Disposition": "attachment; filename=transactions.ndjson"})
+
+    try:
+        transactions, next_cursor = build_transactions_page(
+            db, user.id, request.args.get("limit"), request.args.get("cursor")
+        )
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({"error": "Invalid 'limit' or 'cursor'"}), 400
+
+    response = jsonify(transactions)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+@api.route("/api/wallet/redeem", methods=["POST"])
+@idempotent
 def redeem_reward():
     payload = request.get_json(silent=True)
-    if not payload:
+    if not payload or not isinstance(payload, dict):
         return jsonify({"error": "Invalid or empty JSON payload"}), 400
 
     amount = payload.get("amount")
     description = payload.get("description", "")
 
-    if amount is None or not isinstance(amount, int):
-        return jsonify({"error": "Missing or invalid 'amount' (must be integer)"}), 400
+    if type(amount) is not int or amount <= 0:  # bool is an int subclass
+        return jsonify({"error": "Missing or invalid 'amount' (must be a positive integer)"}), 400
 
-    if user_data.get("walletBalance", 0) < amount:
-        return jsonify({"error": "Insufficient balance"}), 400
-
-    user_data["walletBalance"] = user_data.get("walletBalance", 0) - amount
+    db = get_db()
+    user = get_current_user(db)
 
-    transaction = {
-        "id": str(datetime.now().timestamp()),
-        "type": "redeemed",
-        "amount": -amount,
-        "description": description,
-        "date": datetime.now().isoformat()
-    }
+    # checks and subtracts the balance atomically
+    transaction = database.record_redeemed(db, user.id, amount, description)
+    if transaction is None:
+        return jsonify({"error": "Insufficient balance"}), 400
+    on_commit(notify_push)
+    commit_writes(db)
 
-    user_data.setdefault("transactions", []).append(transaction)
-    logger.info("Redeemed %s coins: %s", amount, description)
-    print("Redeem transaction:", transaction)
+    transaction = serialize_transaction(transaction)
+    logger.info("Redeemed %s coins", amount, extra={"user_id": user.id, "transaction_id": transaction["id"],
+                                                    "amount": amount, "description": description})
 
     return jsonify(transaction)
 
-@app.route("/api/wallet/redemptions", methods=["GET"])
+@api.route("/api/wallet/redemptions", methods=["GET"])
 def get_redemption_options():
     try:
-        redemptions = load_json_data("redemptions.json")
+        return catalog_response("redemptions.json")
     except Exception:
         logger.exception("Failed to load redemptions.json")
-        redemptions = []
-    return jsonify(redemptions)
+        return jsonify([])
+
+# Sub-requests accepted by one POST /api/batch
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+BATCH_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+# request headers a sub-request may set; X-User-Id always comes from the batch request
+BATCH_REQUEST_HEADERS = ("Idempotency-Key", "If-None-Match")
+# response headers not passed on: they describe the HTTP message, not the sub-response
+BATCH_DROPPED_HEADERS = {"content-length", "content-encoding", "vary", "set-cookie"}
+# combined responses at least this large are gzipped for clients that accept it
+BATCH_COMPRESS_MIN_BYTES = 1024
+# routes that answer with an endless or unbounded stream, which a batch would wait on forever;
+# a value limits it to requests with that query argument
+BATCH_STREAMING_ROUTES = {"api.stream_events": None, "api.get_transactions": ("format", "ndjson")}
+# per-request values in g, set apart for each sub-request
+BATCH_REQUEST_STATE = ("request_started", "query_stats", "db", "read_db", "current_user", "after_commit",
+                       "idempotency_key")
+# the part of it that consecutive GET sub-requests pass on to each other
+BATCH_SHARED_STATE = ("db", "read_db", "current_user")
+
+def streams(method: str, path: str) -> bool:
+    """Whether a request would be answered by one of BATCH_STREAMING_ROUTES."""
+    path, _, query = path.partition("?")
+    try:
+        endpoint, _ = current_app.url_map.bind("localhost").match(path, method=method)
+    except HTTPException:
+        return False  # the sub-request gets its own 404 / 405
+    if endpoint not in BATCH_STREAMING_ROUTES:
+        return False
+    argument = BATCH_STREAMING_ROUTES[endpoint]
+    return argument is None or argument[1] in parse_qs(query).get(argument[0], ())
+
+@api.route("/api/batch", methods=["POST"])
+def batch():
+    """
+    Run several API requests in one round trip:
+    {"requests": [{"id": "profile", "method": "GET", "path": "/api/user/profile?x=1", "body": {...},
+                   "headers": {"Idempotency-Key": "..."}}, ...]}.
+
+    The sub-requests go through the normal routes in order, as the same user.
+    Consecutive GETs share one read session and one load of the user; any other
+    sub-request has a session of its own, like a request of its own: its writes
+    are committed by its route as usual, so later sub-requests see them, and a
+    sub-request that fails discards only its own uncommitted writes. They run
+    one after another rather than concurrently, as a session is not safe to
+    use from several threads; the saving is in the round trips. Returns
+    {"responses": [{"id", "status", "headers", "body"}, ...]} in request order,
+    gzipped when large and the client accepts gzip.
+    """
+    payload = request.get_json(silent=True)
+    subrequests = payload.get("requests") if isinstance(payload, dict) else None
+    if not isinstance(subrequests, list) or not subrequests:
+        return jsonify({"error": "Expected {\"requests\": [...]}"}), 400
+    if len(subrequests) > BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"At most {BATCH_MAX_REQUESTS} requests per batch"}), 400
+    for i, sub in enumerate(subrequests):
+        path = sub.get("path") if isinstance(sub, dict) else None
+        if (not isinstance(path, str) or not path.startswith("/api/") or path.split("?", 1)[0] == request.path
+                or sub.get("method", "GET") not in BATCH_METHODS or not isinstance(sub.get("headers", {}), dict)):
+            return jsonify({"error": f"Invalid request at index {i}: needs an /api/ path other than {request.path} "
+                                     f"and a method in {', '.join(BATCH_METHODS)}"}), 400
+        if streams(sub.get("method", "GET"), path):
+            return jsonify({"error": f"Invalid request at index {i}: {path} streams its response, "
+                                     f"request it on its own"}), 400
+
+    app = current_app._get_current_object()
+    responses, cookies = [], []
+    shared = {}  # session(s) and user of the current run of GETs
+    for sub in subrequests:
+        method = sub.get("method", "GET")
+        headers = {name: value for name, value in sub.get("headers", {}).items() if name in BATCH_REQUEST_HEADERS}
+        headers["X-User-Id"] = current_user_id()
+        path, _, query = sub["path"].partition("?")
+        # this request's own state (g is shared by the sub-requests): each sub-request records
+        # its own metrics under its route, and only reads share sessions
+        outer = {name: g.pop(name) for name in BATCH_REQUEST_STATE if name in g}
+        with app.test_request_context(path, method=method, query_string=query,
+                                      headers=headers, json=sub.get("body")):
+            for name, value in shared.items():
+                setattr(g, name, value)
+            if method != "GET":
+                # a write gets its own session; the reads after it start a new one, which sees its writes
+                close_db(None)
+                g.pop("current_user", None)
+            shared, response = {}, None
+            try:
+                response = app.full_dispatch_request()
+                body = response.get_data()  # inside the context: streamed routes need it
+            except Exception as error:
+                # an error in one sub-request must not hide the others' results
+                response = app.make_response(handle_unexpected_error(error))
+                body = response.get_data()
+            finally:
+                if method == "GET" and response is not None and response.status_code < 500:
+                    shared = {name: g.pop(name) for name in BATCH_SHARED_STATE if name in g}
+                close_db(None)
+                for name in BATCH_REQUEST_STATE:
+                    g.pop(name, None)
+        for name, value in outer.items():
+            setattr(g, name, value)
+        cookies.extend(response.headers.getlist("Set-Cookie"))
+        responses.append({
+            "id": sub.get("id"),
+            "status": response.status_code,
+            "headers": {name: value for name, value in response.headers.items()
+                        if name.lower() not in BATCH_DROPPED_HEADERS and not name.lower().startswith("access-control-")},
+            "body": json.loads(body) if response.is_json and body else body.decode("utf-8", "replace"),
+        })
+
+    for name in ("db", "read_db"):
+        if name in shared:
+            shared[name].close()
+
+    body = json.dumps({"responses": responses}).encode()
+    response = Response(body, mimetype="application/json")
+    for cookie in cookies:
+        response.headers.add("Set-Cookie", cookie)
+    response.vary.add("Accept-Encoding")
+    if len(body) >= BATCH_COMPRESS_MIN_BYTES and "gzip" in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+# Users listed by GET /api/leaderboard
+LEADERBOARD_LIMIT = 10
+LEADERBOARD_MAX_LIMIT = 100
+LEADERBOARD_SCOPES = ("global", "region", "friends")
+
+@api.route("/api/leaderboard", methods=["GET"])
+def get_leaderboard():
+    """
+    Users ranked by ?metric= (totalImpact, longestStreak or challengesCompleted) within
+    ?scope= global, region (the current user's) or friends (theirs, plus themselves).
+
+    Returns the top ?limit= users (default 10, max 100), the current user's rank as "me"
+    and, with ?around=k, the k users placed above and below them. Tied users share a rank.
+    """
+    from leaderboards import METRICS
+
+    metric = request.args.get("metric", "totalImpact")
+    scope = request.args.get("scope", "global")
+    try:
+        limit = max(1, min(int(request.args.get("limit", LEADERBOARD_LIMIT)), LEADERBOARD_MAX_LIMIT))
+        around = max(0, min(int(request.args.get("around", 0)), LEADERBOARD_MAX_LIMIT))
+    except ValueError:
+        return jsonify({"error": "'limit' and 'around' must be integers"}), 400
+    if metric not in METRICS or scope not in LEADERBOARD_SCOPES:
+        return jsonify({"error": f"'metric' must be one of {', '.join(METRICS)} and "
+                                 f"'scope' one of {', '.join(LEADERBOARD_SCOPES)}"}), 400
+
+    db = get_db()
+    user = get_current_user(db)
+    leaderboards = get_leaderboards()
+    members = [user.id, *database.get_friend_ids(db, user.id)] if scope == "friends" else [user.id]
+    missing = [user_id for user_id in members if user_id not in leaderboards]
+    if missing:
+        refresh_leaderboards(db, missing)  # signed up since the last sync
+
+    result = {"metric": metric, "scope": scope}
+    if scope == "friends":
+        ranked = leaderboards.among(metric, members)
+        me = next(entry for entry in ranked if entry["userId"] == user.id)
+        result.update(size=len(ranked), entries=ranked[:limit], me=me)
+        if around:
+            position = ranked.index(me)
+            result["around"] = ranked[max(0, position - around):position + around + 1]
+    else:
+        region = leaderboards.region_of(user.id) if scope == "region" else None
+        if scope == "region":
+            result["region"] = region
+        if scope == "region" and region is None:
+            result.update(size=0, entries=[], me=None)
+        else:
+            result.update(size=leaderboards.size(metric, region), entries=leaderboards.top(metric, limit, region),
+                          me=leaderboards.rank(metric, user.id, region))
+            if around:
+                result["around"] = leaderboards.around(metric, user.id, around, region)
+
+    # names of everyone listed; this process's pending profile edits included
+    listed = [*result["entries"], *result.get("around", []), *([result["me"]] if result["me"] else [])]
+    names = database.get_user_names(db, list({entry["userId"] for entry in listed})) if listed else {}
+    for entry in listed:
+        entry["name"] = profile_store.pending(entry["userId"]).get("name", names.get(entry["userId"]))
+    return jsonify(result)
+
+@api.route("/api/friends/<friend_id>", methods=["PUT"])
+def add_friend(friend_id):
+    """Make the current user and friend_id friends (both ways)."""
+    db = get_db()
+    user = get_current_user(db)
+    if friend_id == user.id or database.get_user_by_id(db, friend_id) is None:
+        return jsonify({"error": "Friend not found"}), 404
+    added = database.add_friend(db, user.id, friend_id)
+    db.commit()
+    return jsonify({"status": "added" if added else "unchanged", "friendId": friend_id})
+
+@api.route("/api/friends/<friend_id>", methods=["DELETE"])
+def remove_friend(friend_id):
+    db = get_db()
+    user = get_current_user(db)
+    removed = database.remove_friend(db, user.id, friend_id)
+    db.commit()
+    if not removed:
+        return jsonify({"status": "not_found", "message": "Not friends"}), 404
+    return jsonify({"status": "removed", "friendId": friend_id})
+
+def last_event_id() -> int | None:
+    """The Last-Event-ID a reconnecting event stream sends (or ?lastEventId=); None for a new stream."""
+    value = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    return int(value) if value else None
+
+@api.route("/api/events", methods=["GET"])
+def stream_events():
+    """
+    Server-Sent Events stream of the current user's changes: "wallet" (balance and
+    total impact), "streak", "badge" and "challenge" (started / stopped) events,
+    each with the id of the wallet event behind it. A reconnecting client sends
+    Last-Event-ID and gets the events it missed; "resync" means reload the profile.
+
+    Each stream holds a thread of a threaded server; asgi.py serves it async.
+    """
+    import push
+
+    try:
+        after_id = last_event_id()
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID must be an event id"}), 400
+    broker = get_push_feed().broker
+    db = get_read_db()
+    user = get_current_user(db)
+    try:
+        subscription = broker.subscribe(user.id)
+    except push.TooManySubscribers:
+        return jsonify({"error": "Too many event streams on this server, retry later"}), 503, {"Retry-After": "5"}
+    try:
+        # subscribed first, so nothing logged in between is lost; the feed may send some of these again
+        replayed = push.replay(db, user.id, after_id) if after_id is not None else []
+    except BaseException:
+        broker.unsubscribe(subscription)
+        raise
+    close_db(None)  # an idle stream holds no pooled connection
+
+    def generate():
+        seen = max([after_id or 0, *(message.get("id", 0) for message in replayed)])
+        try:
+            yield f"retry: {push.RETRY_MS}\n\n" + "".join(push.format_sse(message) for message in replayed)
+            while True:
+                messages = [m for m in subscription.get(push.HEARTBEAT) if m.get("id", seen + 1) > seen]
+                yield "".join(push.format_sse(message) for message in messages) or push.HEARTBEAT_FRAME
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def admin_only(view):
+    """Reject requests to an admin route that don't carry ADMIN_TOKEN."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "The admin API is disabled (ADMIN_TOKEN is not set)"}), 403
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({"error": "Admin token required"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@api.route("/api/admin/recommendation-cache", methods=["GET"])
+@admin_only
+def get_recommendation_cache_stats():
+    """Hit / miss counters of the per-user recommendation cache in this worker"""
+    return jsonify(recommendation_cache.stats())
+
+@api.route("/api/admin/impact", methods=["GET"])
+@admin_only
+def get_impact_report():
+    """
+    Weekly completions, coins earned and redeemed, per challenge and by category,
+    for the weeks from ?since= to ?until= (YYYY-MM-DD; default all).
+
+    Read-only: reports what `manage.py impact` (run periodically, e.g. from
+    cron) last exported, aggregated in this process without a process pool.
+    """
+    import analytics
 
-@app.route("/api/user/stats", methods=["GET"])
+    try:
+        since, until = (date.fromisoformat(request.args[name]) if request.args.get(name) else None
+                        for name in ("since", "until"))
+    except ValueError:
+        return jsonify({"error": "'since' and 'until' must be YYYY-MM-DD dates"}), 400
+    return jsonify(analytics.impact_report(workers=1, since=since, until=until))
+
+@api.route("/api/user/stats", methods=["GET"])
 def get_user_stats():
-    # Return something reasonable; in production compute from DB
-    return jsonify({
-        "currentStreak": user_data.get("stats", {}).get("currentStreak", 7),
-        "longestStreak": user_data.get("stats", {}).get("longestStreak", 14),
-        "totalChallengesCompleted": user_data.get("stats", {}).get("totalChallengesCompleted", 12),
-        "badges": [
-            {
-                "id": "badge_1",
-                "title": "Cycle to work or university",
-                "icon": "🚴",
-                "earnedAt": datetime.now().isoformat(),
-                "challengeId": "challenge_2",
-            },
-        ],
-    })
+    db = get_read_db()
+    return jsonify(build_user_stats(db, get_current_user(db)))
+
+
+# WSGI entry point (gunicorn main:app) and the app mounted by asgi.py
+app = create_app()
 
 
 if __name__ == "__main__":
-    # When running directly, start flask development server
+    # When running directly, start flask development server.
+    # For several workers sharing the database use e.g.: gunicorn -w 4 -b 0.0.0.0:8000 main:app
     logger.info("Starting EcoRewards Flask API on 0.0.0.0:8000")
     # debug=True enables auto-reload and more verbose errors; set to False in prod
     app.run(host="0.0.0.0", port=8000, debug=True)
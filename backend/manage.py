@@ -0,0 +1,227 @@
+"""
+Command line tools for the EcoRewards backend.
+
+    python manage.py init-db
+    python manage.py load-users data/user.json [--batch-size 1000]
+    python manage.py import-onboarding surveys.csv|surveys.ndjson [--chunk-size 10000]
+    python manage.py reconcile [--chunk-size 1000]
+    python manage.py snapshot [--min-events 100]
+    python manage.py replay USER_ID [--no-snapshot]
+    python manage.py weights list | publish FILE.npy [--ids IDS.json] [--no-activate] | activate VERSION
+    python manage.py impact [--since DATE] [--until DATE] [--workers N] [--no-export] [--output FILE]
+"""
+
+from datetime import date
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import analytics
+from catalog import Catalog
+import database
+import ledger
+import onboarding_import
+from recommendation.weights_registry import WeightsRegistry
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def cmd_init_db(args):
+    database.init_db()
+    print("Database tables created")
+
+
+def iter_users(path: str):
+    """Yield users from a JSON file holding one user or a list of users, or from NDJSON."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".ndjson") or path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    yield from (data if isinstance(data, list) else [data])
+
+
+def cmd_load_users(args):
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        loaded = database.bulk_load_users(db, iter_users(args.file), batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Loaded {loaded} users from {args.file}")
+
+
+def cmd_import_onboarding(args):
+    """Validate, score and store onboarding surveys, printing progress per chunk."""
+    from recommendation.recommendation import StaticChallengeRecommender
+    from recommendation.reranking import DiversityReranker
+
+    with open(DATA_DIR / "question.json", encoding="utf-8") as f:
+        questions = json.load(f)
+    registry = weights_registry()
+    version, weights = registry.load_current()
+    recommender = StaticChallengeRecommender(questions, weights, version)
+    fmt = args.format or ("csv" if args.file.endswith(".csv") else "ndjson")
+
+    def progress(report):
+        print(f"\r{report.processed:,} records: {report.imported:,} imported, {report.rejected:,} rejected",
+              end="", file=sys.stderr, flush=True)
+
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        with open(args.file, "r", encoding="utf-8", newline="") as f:
+            report = onboarding_import.ingest(db, onboarding_import.iter_records(f, fmt, questions), recommender,
+                                              registry.catalog.ids, chunk_size=args.chunk_size, progress=progress,
+                                              reranker=DiversityReranker.from_catalog(registry.catalog))
+    finally:
+        db.close()
+    print(file=sys.stderr)
+    for error in report.errors:
+        print(f"record {error['record']} (user {error['userId']}): {error['error']}")
+    print(f"Imported {report.imported} of {report.processed} onboarding records with weights {version}")
+    return 1 if report.rejected else 0
+
+
+def cmd_reconcile(args):
+    db = database.SessionLocal()
+    try:
+        reconciled = database.reconcile_user_summaries(db, chunk_size=args.chunk_size)
+    finally:
+        db.close()
+    print(f"Reconciled wallet and stats summaries of {reconciled} users")
+
+
+def cmd_snapshot(args):
+    db = database.SessionLocal()
+    try:
+        written = ledger.take_snapshots(db, min_events=args.min_events)
+    finally:
+        db.close()
+    print(f"Wrote {written} wallet snapshots")
+
+
+def cmd_replay(args):
+    """Rebuild a wallet from the event log and compare it with the summary row."""
+    db = database.SessionLocal()
+    try:
+        state = ledger.rebuild_wallet(db, args.user_id, use_snapshot=not args.no_snapshot)
+        user = database.get_user_by_id(db, args.user_id)
+    finally:
+        db.close()
+    print(f"last event {state.last_event_id}: balance {state.balance}, impact {state.total_impact}, "
+          f"completed {state.challenges_completed}, badges {state.badges}, "
+          f"active challenges {sorted(state.active_challenges)}")
+    if user is not None and (user.wallet_balance or 0) != state.balance:
+        print(f"summary row differs: wallet_balance {user.wallet_balance}")
+        return 1
+
+
+def weights_registry() -> WeightsRegistry:
+    with open(DATA_DIR / "challenge.json", encoding="utf-8") as f:
+        challenges = json.load(f)
+    with open(DATA_DIR / "question.json", encoding="utf-8") as f:
+        n_questions = len(json.load(f))
+    return WeightsRegistry(Catalog(challenges), n_questions)
+
+
+def cmd_weights(args):
+    registry = weights_registry()
+    if args.action == "list":
+        current = registry.current_version()
+        for version in registry.versions():
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.action == "publish":
+        challenge_ids = json.loads(Path(args.ids).read_text()) if args.ids else None
+        version = registry.publish(np.load(args.target), challenge_ids, activate=not args.no_activate)
+        print(f"Published weights version {version}" + ("" if args.no_activate else " (active)"))
+    elif args.action == "activate":
+        registry.activate(args.target)
+        print(f"Activated weights version {args.target}")
+
+
+def cmd_impact(args):
+    """
+    Export new events to the analytics segments and write the weekly impact report as JSON.
+
+    GET /api/admin/impact only reads the segments: run `impact --no-report` periodically to export.
+    """
+    directory = Path(args.dir)
+    if not args.no_export:
+        db = database.SessionLocal()
+        try:
+            exported = analytics.export(db, directory)
+        finally:
+            db.close()
+        print(f"Exported {exported:,} new events to {directory}", file=sys.stderr)
+    if args.no_report:
+        return
+    report = analytics.impact_report(directory, workers=args.workers, since=args.since, until=args.until)
+    print(f"{report['events']:,} events up to {report['lastEventId']}, {len(report['weeks'])} weeks", file=sys.stderr)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EcoRewards backend tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = subparsers.add_parser("init-db", help="create database tables")
+    init_parser.set_defaults(func=cmd_init_db)
+
+    load_parser = subparsers.add_parser("load-users", help="bulk load users from JSON / NDJSON")
+    load_parser.add_argument("file")
+    load_parser.add_argument("--batch-size", type=int, default=1000)
+    load_parser.set_defaults(func=cmd_load_users)
+
+    import_parser = subparsers.add_parser("import-onboarding", help="bulk onboard users from CSV / NDJSON")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=["csv", "ndjson"], help="default: from the file extension")
+    import_parser.add_argument("--chunk-size", type=int, default=onboarding_import.CHUNK_SIZE)
+    import_parser.set_defaults(func=cmd_import_onboarding)
+
+    reconcile_parser = subparsers.add_parser("reconcile", help="rebuild wallet / stats summaries from the ledger")
+    reconcile_parser.add_argument("--chunk-size", type=int, default=1000)
+    reconcile_parser.set_defaults(func=cmd_reconcile)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="snapshot wallets with new events")
+    snapshot_parser.add_argument("--min-events", type=int, default=ledger.SNAPSHOT_EVERY)
+    snapshot_parser.set_defaults(func=cmd_snapshot)
+
+    replay_parser = subparsers.add_parser("replay", help="rebuild a wallet from the event log")
+    replay_parser.add_argument("user_id")
+    replay_parser.add_argument("--no-snapshot", action="store_true", help="replay from the first event")
+    replay_parser.set_defaults(func=cmd_replay)
+
+    weights_parser = subparsers.add_parser("weights", help="manage recommender weight versions")
+    weights_parser.add_argument("action", choices=["list", "publish", "activate"])
+    weights_parser.add_argument("target", nargs="?", help=".npy file to publish or version to activate")
+    weights_parser.add_argument("--no-activate", action="store_true", help="publish without switching to it")
+    weights_parser.add_argument("--ids", help="JSON list with the challenge id of each row (default: catalog order)")
+    weights_parser.set_defaults(func=cmd_weights)
+
+    impact_parser = subparsers.add_parser("impact", help="weekly completions, coins and category mix report")
+    impact_parser.add_argument("--dir", default=str(analytics.ANALYTICS_DIR), help="analytics segment directory")
+    impact_parser.add_argument("--since", type=date.fromisoformat, help="first week (YYYY-MM-DD within it)")
+    impact_parser.add_argument("--until", type=date.fromisoformat, help="last week (YYYY-MM-DD within it)")
+    impact_parser.add_argument("--workers", type=int, default=analytics.WORKERS, help="aggregation processes")
+    impact_parser.add_argument("--no-export", action="store_true", help="report on the segments exported so far")
+    impact_parser.add_argument("--no-report", action="store_true", help="only export the new events")
+    impact_parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    impact_parser.set_defaults(func=cmd_impact)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "action", "list") != "list" and not args.target:
+        parser.error(f"weights {args.action} needs a target")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+Metrics, per-request DB query accounting, a sampling profiler and log formatting.
+
+Metrics live in this process and are rendered in the Prometheus text format by
+REGISTRY.render() (served on /metrics); like the recommendation cache stats,
+each worker process reports its own numbers. Label sets are kept small: routes
+are labelled by their URL rule, never by the raw path.
+
+The profiler is opt-in (PROFILE_SLOW_REQUESTS_MS): while enabled, a background
+thread samples the stacks of threads serving requests, and requests slower than
+the threshold have their samples written to PROFILE_DIR as collapsed stacks
+("frame;frame;frame count" lines), the input format of flamegraph.pl and speedscope.
+"""
+
+from collections import Counter as _TallyCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+import bisect
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+
+# Seconds; tuned for API latencies from sub-millisecond cache hits to slow exports
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _format_labels(labelnames: tuple, values: tuple) -> str:
+    if not labelnames:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}" for key, value in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # per label set: [count per bucket (+Inf last), sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels((*self.labelnames, "le"), (*key, bound if bound == "+Inf" else f"{bound:g}"))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class GaugeCallback(_Metric):
+    """Gauge whose values are read at scrape time: `collect()` returns {label values tuple: value}."""
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames, collect):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}"
+                for key, value in sorted(self.collect().items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests handled", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")))
+DB_QUERIES = REGISTRY.register(Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", ("route",), buckets=COUNT_BUCKETS))
+DB_TIME = REGISTRY.register(Histogram(
+    "db_query_seconds_per_request", "Time spent in SQL statements per HTTP request", ("route",)))
+RECOMMENDER_TIME = REGISTRY.register(Histogram(
+    "recommender_scoring_seconds", "Time spent scoring challenges", ("operation",)))
+CATALOG_RESPONSES = REGISTRY.register(Counter(
+    "catalog_responses_total", "Static catalog responses (304 = client cache revalidated)", ("catalog", "status")))
+
+
+# --- Per-request DB query accounting ---
+
+# [statement count, seconds] of the request running in this context, None outside requests
+_query_stats: ContextVar[list | None] = ContextVar("query_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Count and time every statement run on `engine` (or on every engine, given the Engine class) against the current request."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _query_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += time.perf_counter() - context._query_started
+
+
+def start_request_stats():
+    return _query_stats.set([0, 0.0])
+
+
+def finish_request_stats(token, route: str):
+    stats = _query_stats.get()
+    _query_stats.reset(token)
+    if stats is not None:
+        DB_QUERIES.observe(stats[0], route=route)
+        DB_TIME.observe(stats[1], route=route)
+
+
+# --- Sampling profiler for slow requests ---
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of registered threads every `interval` seconds.
+
+    Only threads between start() and stop() are sampled, so the cost is one
+    sys._current_frames() call per interval plus the walk of in-flight requests.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._samples: dict[int, _TallyCounter] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @staticmethod
+    def _fold(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, tally in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        tally[self._fold(frame)] += 1
+
+    def start(self):
+        with self._lock:
+            self._samples[threading.get_ident()] = _TallyCounter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> _TallyCounter:
+        with self._lock:
+            return self._samples.pop(threading.get_ident(), _TallyCounter())
+
+
+def write_collapsed_stacks(samples: _TallyCounter, directory: Path, label: str) -> Path:
+    """Write samples as collapsed stacks, one "frame;frame count" line per distinct stack."""
+    directory.mkdir(parents=True, exist_ok=True)
+    safe_label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+    path = directory / f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{safe_label}.folded"
+    path.write_text("".join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+    return path
+
+
+# --- Structured logging ---
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any `extra=` fields."""
+
+    _RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in self._RESERVED)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+PROFILE_SLOW_REQUESTS_MS = float(os.getenv("PROFILE_SLOW_REQUESTS_MS", "0"))  # 0 disables profiling
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", Path(__file__).parent / "profiles"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL_MS / 1000) if PROFILE_SLOW_REQUESTS_MS > 0 else None
@@ -0,0 +1,240 @@
+"""
+Bulk ingestion of onboarding surveys (partner CSV / NDJSON exports).
+
+Records are parsed lazily and processed `chunk_size` at a time, so memory stays
+bounded however large the input is. For each chunk the answers are gathered
+into flat (row, question, value) arrays and validated with numpy against
+question.json, the valid rows are scored with one recommend_batch call, and
+users, onboarding rows and recommendations are written with bulk statements.
+
+CSV: a header row with `user_id` (or `id`), optional `name` / `email`, and one
+column per question named by its id ("3" or "q3"); empty cells are unanswered.
+NDJSON: one {"id": ..., "name": ..., "email": ..., "answers": {"1": 1, ...}} per line.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+import csv
+import json
+import logging
+import math
+
+import numpy as np
+
+import database
+import observability
+
+logger = logging.getLogger("eco_rewards")
+
+ALLOWED_ANSWERS = (-1, 0, 1)
+CHUNK_SIZE = 10_000
+# Rejected rows reported back individually; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Value codes used while validating: unanswered, and present but not an integer
+_MISSING = np.nan
+_INVALID = np.inf
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+@dataclass
+class ImportReport:
+    processed: int = 0
+    imported: int = 0
+    rejected: int = 0
+    chunks: int = 0
+    errors: list = field(default_factory=list)
+
+    def reject(self, record: int, user_id, reason: str):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"record": record, "userId": user_id, "error": reason})
+
+    def to_dict(self) -> dict:
+        return {"processed": self.processed, "imported": self.imported, "rejected": self.rejected,
+                "chunks": self.chunks, "errors": self.errors}
+
+
+def question_columns(questions: list[dict]) -> dict[str, int]:
+    """Map question ids (as strings) to their column in the recommender's answer vectors."""
+    return {str(q["id"]): q["id"] - 1 for q in questions}
+
+
+def _question_column(name: str, question_ids: dict[str, int]) -> int | None:
+    key = name.strip().lower()
+    return question_ids.get(key[1:] if key.startswith("q") else key)
+
+
+def iter_csv_records(lines, question_ids: dict[str, int]):
+    """Yield (user_id, name, email, {column: raw_value}) from CSV lines."""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    lowered = [h.strip().lower() for h in header]
+    id_field = "user_id" if "user_id" in lowered else "id" if "id" in lowered else None
+    if id_field is None:
+        raise ImportFormatError("CSV header needs a 'user_id' or 'id' column")
+    id_col = lowered.index(id_field)
+    name_col = lowered.index("name") if "name" in lowered else None
+    email_col = lowered.index("email") if "email" in lowered else None
+    answer_cols = [(i, col) for i, h in enumerate(header)
+                   if (col := _question_column(h, question_ids)) is not None]
+    unknown = [h for i, h in enumerate(header) if i not in (id_col, name_col, email_col)
+               and _question_column(h, question_ids) is None]
+    if unknown:
+        raise ImportFormatError(f"Unknown CSV columns: {', '.join(unknown)}")
+
+    for row in reader:
+        if not row:
+            continue
+        row += [""] * (len(header) - len(row))
+        yield (row[id_col].strip(),
+               row[name_col].strip() or None if name_col is not None else None,
+               row[email_col].strip() or None if email_col is not None else None,
+               {col: row[i].strip() for i, col in answer_cols})
+
+
+def iter_ndjson_records(lines, question_ids: dict[str, int]):
+    """Yield (user_id, name, email, {column: raw_value}) from NDJSON lines; unknown question ids map to -1."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            answers = record.get("answers") or {}
+            user_id = record.get("id", record.get("userId"))
+            yield (str(user_id) if user_id is not None else "", record.get("name"), record.get("email"),
+                   {question_ids.get(str(k), -1): v for k, v in answers.items()})
+        except (ValueError, AttributeError):
+            # reported as a rejected row by validate_chunk
+            yield "", None, None, None
+
+
+def iter_records(lines, fmt: str, questions: list[dict]):
+    """Parsed records of a "csv" or "ndjson" input, read lazily from `lines`."""
+    question_ids = question_columns(questions)
+    if fmt == "csv":
+        return iter_csv_records(lines, question_ids)
+    if fmt == "ndjson":
+        return iter_ndjson_records(lines, question_ids)
+    raise ImportFormatError(f"Unsupported format {fmt!r}, expected 'csv' or 'ndjson'")
+
+
+def validate_chunk(records: list, n_questions: int) -> tuple[np.ndarray, np.ndarray, list[str | None]]:
+    """
+    Validate a chunk of parsed records with array operations.
+
+    Returns (answers, ok, reasons): an (n_records x n_questions) float matrix with
+    NaN for unanswered questions, a boolean mask of valid records, and per record
+    the reason it was rejected (None if valid).
+    """
+    n = len(records)
+    rows, cols, values = [], [], []
+    malformed = np.zeros(n, dtype=bool)
+    for r, (_, _, _, answers) in enumerate(records):
+        if answers is None:
+            malformed[r] = True
+            continue
+        for col, value in answers.items():
+            rows.append(r)
+            cols.append(col)
+            values.append(value)
+
+    rows = np.fromiter(rows, dtype=np.intp, count=len(rows))
+    cols = np.fromiter(cols, dtype=np.intp, count=len(cols))
+    values = _to_codes(values)
+
+    bad_key = cols < 0
+    bad_value = ~(np.isnan(values) | np.isin(values, ALLOWED_ANSWERS))
+    has_bad_key = np.bincount(rows[bad_key], minlength=n).astype(bool)
+    has_bad_value = np.bincount(rows[bad_value], minlength=n).astype(bool)
+    missing_id = np.fromiter((not rec[0] for rec in records), dtype=bool, count=n)
+
+    answers = np.full((n, n_questions), _MISSING)
+    keep = ~bad_key
+    answers[rows[keep], cols[keep]] = values[keep]
+    answered = (~np.isnan(answers)).any(axis=1)
+
+    ok = ~(malformed | missing_id | has_bad_key | has_bad_value) & answered
+    reasons = [None] * n
+    for r in np.flatnonzero(~ok).tolist():
+        reasons[r] = ("malformed record" if malformed[r] else
+                      "missing user id" if missing_id[r] else
+                      "unknown question id" if has_bad_key[r] else
+                      "answers must be -1, 0 or 1" if has_bad_value[r] else
+                      "no answers")
+    return answers, ok, reasons
+
+
+def _to_codes(values: list) -> np.ndarray:
+    """Raw answers (CSV strings or JSON values) as floats: NaN if empty, inf if not an integer."""
+    codes = np.empty(len(values))
+    for i, value in enumerate(values):
+        if value is None or value == "":
+            codes[i] = _MISSING
+        elif type(value) is int:
+            codes[i] = value
+        elif type(value) is str and value.lstrip("-").isdigit():
+            codes[i] = int(value)
+        else:
+            codes[i] = _INVALID
+    return codes
+
+
+def ingest(db, records, recommender, challenge_ids, chunk_size: int = CHUNK_SIZE, progress=None,
+           reranker=None) -> ImportReport:
+    """
+    Validate, score and store onboarding records `chunk_size` at a time.
+
+    Rankings are stored as catalog ids: `challenge_ids` names the challenge of
+    each weight row (Catalog.ids; the weights registry aligns rows to it).
+
+    `records` is an iterator from iter_csv_records / iter_ndjson_records. Every chunk
+    is committed on its own; `progress(report)` is called after each one. A user
+    appearing more than once keeps their last answers. Rankings go through
+    `reranker` (see recommendation/reranking.py) when one is given.
+    """
+    report = ImportReport()
+    question_keys = [str(col + 1) for col in range(len(recommender.questions))]
+    state = recommender.state
+    rng = np.random.default_rng()
+    records = iter(records)
+    first = 1  # 1-based number of the chunk's first record, for error reports
+
+    while chunk := list(islice(records, chunk_size)):
+        answers, ok, reasons = validate_chunk(chunk, len(question_keys))
+        for r in np.flatnonzero(~ok).tolist():
+            report.reject(first + r, chunk[r][0] or None, reasons[r])
+
+        valid = np.flatnonzero(ok)
+        if valid.size:
+            valid_answers = answers[valid]
+            with observability.RECOMMENDER_TIME.time(operation="bulk_import"):
+                indices, _ = recommender.recommend_batch(np.nan_to_num(valid_answers), state=state,
+                                                          reranker=reranker, rng=rng)
+            onboarded = {}
+            for r, answer_row, ranking in zip(valid.tolist(), valid_answers.tolist(), indices.tolist()):
+                user_id, name, email, _ = chunk[r]
+                onboarded[user_id] = {
+                    "user_id": user_id, "name": name, "email": email,
+                    "answers": {key: int(v) for key, v in zip(question_keys, answer_row) if not math.isnan(v)},
+                    "recommended_challenges": [challenge_ids[row] for row in ranking],
+                }
+            database.bulk_save_onboarding(db, list(onboarded.values()), datetime.utcnow())
+            db.commit()
+            report.imported += int(valid.size)
+
+        report.processed += len(chunk)
+        report.chunks += 1
+        first += len(chunk)
+        logger.info("Onboarding import: %s processed, %s imported, %s rejected",
+                    report.processed, report.imported, report.rejected)
+        if progress is not None:
+            progress(report)
+
+    return report
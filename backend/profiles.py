@@ -0,0 +1,222 @@
+"""
+Write-behind store for the editable profile fields (name, email, answers).
+
+Profile edits are applied in memory and acknowledged right away. A background
+worker writes them to the users table in batches: one executemany per cycle
+instead of a commit per request. Users are spread over SHARDS partitions by a
+hash of their id, each with its own lock, so requests for different users do
+not wait on each other and a hot user only holds up their own shard.
+
+Only users with unflushed edits are held in memory. Readers overlay those
+pending fields on the database row (see ProfileStore.overlay), so this process
+sees its own writes before they are flushed. Other worker processes see them
+after the flush, at most FLUSH_INTERVAL later.
+
+At most MAX_PENDING users wait for a flush. When that is reached, writers
+wait up to BACKPRESSURE_TIMEOUT for the worker to catch up and then write their
+own change through. Entries only count as flushed once their batch committed:
+a failed batch is retried on the next cycle. close() flushes everything left;
+start() registers it to run at exit. Wallet, challenge and ledger writes do not go through
+here; they stay synchronous and transactional.
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+import atexit
+import logging
+import os
+import threading
+import time
+import zlib
+
+import database
+
+logger = logging.getLogger("eco_rewards")
+
+SHARDS = int(os.getenv("PROFILE_SHARDS", "16"))
+FLUSH_INTERVAL = float(os.getenv("PROFILE_FLUSH_INTERVAL", "1.0"))
+FLUSH_BATCH_SIZE = int(os.getenv("PROFILE_FLUSH_BATCH_SIZE", "500"))
+MAX_PENDING = int(os.getenv("PROFILE_MAX_PENDING", "10000"))
+BACKPRESSURE_TIMEOUT = float(os.getenv("PROFILE_BACKPRESSURE_TIMEOUT", "0.5"))
+
+# Profile fields this store owns, by the name of their users column
+PROFILE_COLUMNS = ("name", "email", "answers")
+
+
+@dataclass(slots=True)
+class _Entry:
+    fields: dict = field(default_factory=dict)  # pending column values
+    version: int = 0  # bumped by every edit
+    queued: bool = False  # waiting in the pending queue or being flushed
+
+
+@dataclass(slots=True)
+class _Shard:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    entries: dict[str, _Entry] = field(default_factory=dict)
+
+
+class ProfileStore:
+    def __init__(self, session_factory=None, shards: int = SHARDS, flush_interval: float = FLUSH_INTERVAL,
+                 batch_size: int = FLUSH_BATCH_SIZE, max_pending: int = MAX_PENDING,
+                 backpressure_timeout: float = BACKPRESSURE_TIMEOUT):
+        self.session_factory = session_factory or database.SessionLocal
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.backpressure_timeout = backpressure_timeout
+        self._shards = [_Shard() for _ in range(shards)]
+        self._pending: deque[str] = deque()  # user ids with unflushed edits, oldest first
+        self._pending_changed = threading.Condition()
+        self._closed = False
+        self._thread: threading.Thread | None = None
+        # counters, updated under _pending_changed
+        self.stats = {"flushed": 0, "batches": 0, "write_through": 0, "failed_batches": 0}
+
+    def _shard(self, user_id: str) -> _Shard:
+        return self._shards[zlib.crc32(user_id.encode()) % len(self._shards)]
+
+    def update(self, user_id: str, changes: dict):
+        """Apply edits to a user's profile columns; they reach the database with a later flush."""
+        unknown = set(changes) - set(PROFILE_COLUMNS)
+        if unknown:
+            raise ValueError(f"not profile columns: {sorted(unknown)}")
+        shard = self._shard(user_id)
+        with shard.lock:
+            entry = shard.entries.setdefault(user_id, _Entry())
+            entry.fields.update(changes)
+            entry.version += 1
+            enqueue = not entry.queued
+            entry.queued = True
+        if enqueue and not self._enqueue(user_id):
+            self._count("write_through")
+            self._write([user_id])
+
+    def pending(self, user_id: str) -> dict:
+        """The user's edits not flushed yet (empty if none)."""
+        shard = self._shard(user_id)
+        with shard.lock:
+            entry = shard.entries.get(user_id)
+            return dict(entry.fields) if entry is not None else {}
+
+    def overlay(self, user) -> dict:
+        """A users row's profile columns with this process's pending edits applied."""
+        profile = {column: getattr(user, column) for column in PROFILE_COLUMNS}
+        profile.update(self.pending(user.id))
+        return profile
+
+    def __len__(self) -> int:
+        """Users waiting for a flush."""
+        return len(self._pending)
+
+    def _count(self, stat: str, n: int = 1):
+        with self._pending_changed:
+            self.stats[stat] += n
+
+    def _enqueue(self, user_id: str) -> bool:
+        """Queue a user for flushing; False if the queue stayed full for backpressure_timeout."""
+        with self._pending_changed:
+            if len(self._pending) >= self.max_pending:
+                self._pending_changed.notify_all()  # wake the worker for an early cycle
+                if not self._pending_changed.wait_for(
+                        lambda: len(self._pending) < self.max_pending or self._closed, self.backpressure_timeout):
+                    return False
+            self._pending.append(user_id)
+            if len(self._pending) >= self.batch_size:
+                self._pending_changed.notify_all()
+            return True
+
+    def _take(self, limit: int) -> list[str]:
+        with self._pending_changed:
+            taken = [self._pending.popleft() for _ in range(min(limit, len(self._pending)))]
+            self._pending_changed.notify_all()  # room for writers waiting on backpressure
+            return taken
+
+    def _write(self, user_ids: list[str]) -> int:
+        """Write the users' pending edits in one transaction; returns the number written."""
+        rows, versions = [], {}
+        for user_id in user_ids:
+            shard = self._shard(user_id)
+            with shard.lock:
+                entry = shard.entries[user_id]
+                rows.append({"id": user_id, **entry.fields})
+                versions[user_id] = entry.version
+
+        db = self.session_factory()
+        try:
+            database.bulk_update_users(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Writing %s profiles failed; retrying on the next flush", len(rows))
+            with self._pending_changed:
+                self.stats["failed_batches"] += 1
+                self._pending.extendleft(reversed(user_ids))
+            return 0
+        finally:
+            db.close()
+
+        # forget entries that were not edited again meanwhile; the others go back in the queue
+        requeue = []
+        for user_id in user_ids:
+            shard = self._shard(user_id)
+            with shard.lock:
+                entry = shard.entries[user_id]
+                if entry.version == versions[user_id]:
+                    del shard.entries[user_id]
+                else:
+                    requeue.append(user_id)
+        with self._pending_changed:
+            self._pending.extend(requeue)
+            self.stats["flushed"] += len(rows)
+            self.stats["batches"] += 1
+        return len(rows)
+
+    def flush(self) -> int:
+        """Write every pending edit now, in batches; returns the number of rows written."""
+        written = 0
+        while batch := self._take(self.batch_size):
+            flushed = self._write(batch)
+            if not flushed:
+                break  # the database is failing; the batch is queued again
+            written += flushed
+        return written
+
+    def _run(self):
+        while True:
+            with self._pending_changed:
+                self._pending_changed.wait_for(lambda: len(self._pending) >= self.batch_size or self._closed,
+                                               self.flush_interval)
+                if self._closed:
+                    return
+            started = time.perf_counter()
+            try:
+                written = self.flush()
+            except Exception:
+                logger.exception("Profile flush failed")
+                continue
+            if written:
+                logger.debug("Flushed %s profiles in %.1f ms", written, (time.perf_counter() - started) * 1000)
+
+    def start(self):
+        """Run the flush worker in a daemon thread (once per process); close() runs at exit."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="profile-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def close(self):
+        """Stop the worker and flush what is left."""
+        with self._pending_changed:
+            self._closed = True
+            self._pending_changed.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        written = self.flush()
+        if written:
+            logger.info("Flushed %s profiles on shutdown", written)
+        if len(self):
+            logger.error("%s profile edits could not be written on shutdown", len(self))
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,289 @@
+"""
+Server push of wallet, streak, badge and challenge changes (GET /api/events).
+
+Clients hold a Server-Sent Events stream instead of polling the profile and
+stats. Each stream is a Subscription in a broker, which fans messages out by
+user id. LocalBroker does this inside the process. Another broker (e.g. on
+Redis pub/sub) only needs the same subscribe / unsubscribe / publish /
+subscribed methods.
+
+EventFeed tails wallet_events (database.EventTail), like the leaderboards and
+the collaborative model do. Every PUSH_POLL_INTERVAL seconds, and right away after a commit in
+this process (notify()), it turns the new events of users subscribed here into
+small delta messages with their current totals. So every worker process pushes
+the writes of every other worker, without a message bus between them. Streaks
+reset by the expiry job arrive the same way, as streak_expired events.
+
+Each message carries the wallet event id as its SSE id: a client that
+reconnects with Last-Event-ID gets what it missed replayed from the log (up to
+REPLAY_LIMIT events). Backpressure: a subscription holds at most MAX_QUEUED
+messages. A client that falls further behind gets one "resync" message instead,
+telling it to reload its profile. A process holds at most MAX_SUBSCRIBERS
+streams. Idle streams get a comment every HEARTBEAT seconds, which keeps proxies
+from closing them and finds disconnected clients.
+"""
+
+from collections import deque
+import asyncio
+import json
+import logging
+import os
+import threading
+
+from sqlalchemy import select, tuple_
+
+import database
+
+logger = logging.getLogger("eco_rewards")
+
+POLL_INTERVAL = float(os.getenv("PUSH_POLL_INTERVAL", "1.0"))
+HEARTBEAT = float(os.getenv("PUSH_HEARTBEAT_SECONDS", "15"))
+MAX_QUEUED = int(os.getenv("PUSH_MAX_QUEUED", "100"))
+MAX_SUBSCRIBERS = int(os.getenv("PUSH_MAX_SUBSCRIBERS", "10000"))
+REPLAY_LIMIT = int(os.getenv("PUSH_REPLAY_LIMIT", "100"))
+# client reconnect delay sent at the start of a stream, in milliseconds
+RETRY_MS = 3000
+
+RESYNC = {"event": "resync", "data": {}}
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def format_sse(message: dict) -> str:
+    """A message as a Server-Sent Events frame."""
+    head = f"id: {message['id']}\n" if "id" in message else ""
+    return f"{head}event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+HEARTBEAT_FRAME = ": ping\n\n"
+
+
+class Subscription:
+    """One stream's queue of messages, read from a thread (get) or an event loop (get_async)."""
+
+    def __init__(self, user_id: str, max_queued: int = MAX_QUEUED):
+        self.user_id = user_id
+        self.max_queued = max_queued
+        self._queue: deque[dict] = deque()
+        self._changed = threading.Condition()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._ready: asyncio.Event | None = None
+
+    def put(self, message: dict) -> bool:
+        """Queue a message; False if the backlog was replaced with a resync to make room."""
+        with self._changed:
+            overflow = len(self._queue) >= self.max_queued
+            if overflow:
+                # the client can't keep up: replace its backlog with one resync
+                self._queue.clear()
+                self._queue.append(RESYNC)
+            self._queue.append(message)
+            self._changed.notify()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        return not overflow
+
+    def _drain(self) -> list[dict]:
+        messages = list(self._queue)
+        self._queue.clear()
+        return messages
+
+    def get(self, timeout: float) -> list[dict]:
+        """Queued messages, waiting up to timeout for one; empty on timeout."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._queue, timeout)
+            return self._drain()
+
+    async def get_async(self, timeout: float) -> list[dict]:
+        if self._loop is None:
+            self._loop, self._ready = asyncio.get_running_loop(), asyncio.Event()
+        self._ready.clear()
+        with self._changed:
+            if self._queue:
+                return self._drain()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._changed:
+            return self._drain()
+
+
+class LocalBroker:
+    """In-process pub/sub: delivers messages to this process's subscriptions of a user."""
+
+    def __init__(self, max_subscribers: int = MAX_SUBSCRIBERS, max_queued: int = MAX_QUEUED):
+        self.max_subscribers = max_subscribers
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._count = 0
+        self.stats = {"published": 0, "delivered": 0, "resyncs": 0}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(user_id, self.max_queued)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers(self.max_subscribers)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+            self._count -= 1
+
+    def subscribed(self) -> set[str]:
+        """Users with at least one subscription here."""
+        with self._lock:
+            return set(self._subscriptions)
+
+    def publish(self, user_id: str, message: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+            self.stats["published"] += 1
+            self.stats["delivered"] += len(subscriptions)
+        resyncs = sum(not subscription.put(message) for subscription in subscriptions)
+        if resyncs:
+            with self._lock:
+                self.stats["resyncs"] += resyncs
+
+
+def build_messages(db, rows) -> list[tuple[str, dict]]:
+    """(user id, message) pairs for wallet event rows, with the users' current totals."""
+    if not rows:
+        return []
+    user_ids = {row.user_id for row in rows}
+    totals = {row.id: row for row in db.execute(
+        select(database.User.id, database.User.wallet_balance, database.User.total_impact,
+               database.User.current_streak, database.User.longest_streak,
+               database.User.total_challenges_completed).where(database.User.id.in_(user_ids)))}
+    pairs = {(row.user_id, row.challenge_id) for row in rows if row.challenge_id is not None}
+    streaks, badges = {}, {}
+    if pairs:
+        streaks = {(r.user_id, r.challenge_id): r for r in db.execute(
+            select(database.UserChallenge.user_id, database.UserChallenge.challenge_id,
+                   database.UserChallenge.current_streak)
+            .where(tuple_(database.UserChallenge.user_id, database.UserChallenge.challenge_id).in_(pairs)))}
+    badge_pairs = {(row.user_id, row.challenge_id) for row in rows if row.type == database.BADGE_AWARDED}
+    if badge_pairs:
+        # the newest badge of each (user, challenge)
+        for badge in db.execute(select(database.Badge).where(
+                tuple_(database.Badge.user_id, database.Badge.challenge_id).in_(badge_pairs))
+                .order_by(database.Badge.id)).scalars():
+            badges[(badge.user_id, badge.challenge_id)] = badge
+
+    messages = []
+    for row in rows:
+        user = totals.get(row.user_id)
+        if user is None:
+            continue
+        habit = streaks.get((row.user_id, row.challenge_id))
+        if row.type in (database.EARNED, database.REDEEMED):
+            messages.append((row.user_id, {"id": row.id, "event": "wallet", "data": {
+                "change": row.amount, "balance": user.wallet_balance or 0, "totalImpact": user.total_impact or 0}}))
+        if row.type in (database.EARNED, database.STREAK_EXPIRED) and row.challenge_id is not None:
+            messages.append((row.user_id, {"id": row.id, "event": "streak", "data": {
+                "challengeId": row.challenge_id, "streak": habit.current_streak if habit else 0,
+                "currentStreak": user.current_streak or 0, "longestStreak": user.longest_streak or 0,
+                "totalChallengesCompleted": user.total_challenges_completed or 0}}))
+        elif row.type == database.BADGE_AWARDED:
+            badge = badges.get((row.user_id, row.challenge_id))
+            if badge is not None:
+                messages.append((row.user_id, {"id": row.id, "event": "badge", "data": {
+                    "id": str(badge.id), "title": badge.title, "icon": badge.icon,
+                    "earnedAt": badge.earned_at.isoformat() if badge.earned_at else None,
+                    "challengeId": badge.challenge_id}}))
+        elif row.type in (database.CHALLENGE_STARTED, database.CHALLENGE_STOPPED):
+            messages.append((row.user_id, {"id": row.id, "event": "challenge", "data": {
+                "challengeId": row.challenge_id, "isActive": row.type == database.CHALLENGE_STARTED}}))
+    return messages
+
+
+def replay(db, user_id: str, after_id: int, limit: int = REPLAY_LIMIT,
+           gap_seconds: float = database.EVENT_GAP_SECONDS) -> list[dict]:
+    """
+    The user's messages after event after_id, for a reconnecting client; a resync if there are more than limit.
+
+    Events below after_id may have committed after the client saw after_id, so
+    the messages of events not yet settled (database.get_settled_event_id) are
+    sent again. They carry the current totals, so a repeat is harmless.
+    """
+    after_id = min(after_id, database.get_settled_event_id(db, gap_seconds))
+    rows = next(database.iter_event_batches(db, user_id=user_id, after_id=after_id, batch_size=limit + 1), [])
+    if len(rows) > limit:
+        return [RESYNC]
+    return [message for _, message in build_messages(db, rows)]
+
+
+class EventFeed:
+    """Publishes the wallet events of this process's subscribers into the broker, in a daemon thread."""
+
+    def __init__(self, broker, session_factory=None, interval: float = POLL_INTERVAL):
+        self.broker = broker
+        self.session_factory = session_factory or database.SessionLocal
+        self.interval = interval
+        self.tail: database.EventTail | None = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def last_event_id(self) -> int | None:
+        return None if self.tail is None else self.tail.last_id
+
+    def notify(self):
+        """Poll now: this process just committed events."""
+        self._wake.set()
+
+    def run_once(self) -> int:
+        """Publish the events logged since the last run; returns the number of messages."""
+        db = self.session_factory()
+        try:
+            if self.tail is None or not len(self.broker):
+                # nobody to tell here: skip to the end of the log (read before checking again, so a
+                # stream opened in between still gets what is logged after it)
+                last_event_id = database.get_last_event_id(db)
+                if self.tail is None or not len(self.broker):
+                    self.tail = database.EventTail(last_event_id)
+                    return 0
+            subscribed = self.broker.subscribed()
+            published = 0
+            for batch in self.tail.batches(db, batch_size=1000):
+                for user_id, message in build_messages(db, [row for row in batch if row.user_id in subscribed]):
+                    self.broker.publish(user_id, message)
+                    published += 1
+            return published
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Push feed failed")
+
+    def start(self):
+        """Start from the end of the log and run in a daemon thread (once per process)."""
+        if self._thread is None:
+            self.run_once()
+            self._thread = threading.Thread(target=self._run, name="push-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
@@ -0,0 +1,99 @@
+"""
+Bounded LRU / TTL cache of ranked recommendations per user.
+
+An entry holds the user-independent part of /api/challenges/personalized (the
+ranked challenge dicts with ids and reasons) and is only served while the user's
+answers and the recommender weights are the ones it was computed from. Cached
+dicts are never mutated; callers merge per-user fields into copies.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def answers_fingerprint(answers: dict) -> str:
+    """Stable hash of an answers dict, independent of key type and order."""
+    canonical = json.dumps({str(k): v for k, v in answers.items()}, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+
+
+@dataclass(frozen=True)
+class _Entry:
+    answers_hash: str
+    weights_version: str
+    expires_at: float
+    value: tuple
+
+
+class RecommendationCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600.0):
+        # maxsize counts users; each user holds one entry per variant
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, user_id: str, answers: dict, weights_version: str, variant, compute) -> tuple:
+        """
+        Cached ranking for (user, answers, weights, variant), calling compute() on a miss.
+
+        `variant` separates rankings of the same user that differ in options
+        (e.g. personalized reasons); compute must return a sequence of dicts.
+        """
+        answers_hash = answers_fingerprint(answers)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(user_id, {}).get(variant)
+            if (entry is not None and entry.answers_hash == answers_hash
+                    and entry.weights_version == weights_version and entry.expires_at > now):
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+
+        value = tuple(compute())
+
+        with self._lock:
+            variants = self._entries.setdefault(user_id, {})
+            variants[variant] = _Entry(answers_hash, weights_version, now + self.ttl, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, user_id: str):
+        """Drop all cached rankings of a user (after their answers changed)."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Drop everything, e.g. after new weights were loaded."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRatio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+recommendation_cache = RecommendationCache(
+    maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "3600")),
+)
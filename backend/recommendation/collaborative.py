@@ -0,0 +1,242 @@
+"""
+Collaborative-filtering recommender learned from what users start, stop and complete.
+
+Implicit feedback from the wallet event log is folded into per-user interaction
+strengths with each challenge (log-scaled completions, plus START_WEIGHT per
+start and minus it per stop) and from those into an item-item co-occurrence
+matrix C = sum over users of r r^T. New events update C incrementally: for the
+users they touch, C += r' r'^T - r r^T where r and r' are the strengths before
+and after, summed as one matrix product per batch of events.
+
+Every CF_REFRESH_EVENTS interactions, or CF_REFRESH_INTERVAL seconds after the
+last refresh, the cosine similarities of C are factorized into low-rank item
+embeddings E (similarity ~ E E^T), swapped in as one CollaborativeState. Its
+version keys cached rankings, so it changes only then; a user's own new events
+count right away (the updater drops that user's cached rankings). Scoring
+a user is then two small matrix-vector products, (r E) E^T. The ranking blends
+these scores with the answer-based ones of StaticChallengeRecommender, weighted
+by n / (n + BLEND_SHRINKAGE) for a user with n interactions, so new users get
+the answer-based ranking and the history takes over as it grows.
+
+Every worker process reads the event log itself (like the snapshot worker), so
+the model costs memory per process in proportion to the users with history.
+"""
+
+from dataclasses import dataclass
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import database
+from database import EARNED, CHALLENGE_STARTED, CHALLENGE_STOPPED
+
+logger = logging.getLogger("eco_rewards")
+
+START_WEIGHT = 0.5
+EMBEDDING_DIM = int(os.getenv("CF_EMBEDDING_DIM", "16"))
+# Interactions after which a user's ranking is half collaborative, half answer-based
+BLEND_SHRINKAGE = float(os.getenv("CF_BLEND_SHRINKAGE", "5"))
+UPDATE_INTERVAL = float(os.getenv("CF_UPDATE_INTERVAL", "30"))
+# New embeddings after this many new interactions, or this many seconds after the last ones
+REFRESH_EVENTS = int(os.getenv("CF_REFRESH_EVENTS", "1000"))
+REFRESH_INTERVAL = float(os.getenv("CF_REFRESH_INTERVAL", "3600"))
+
+# Position of each event type in a user's per-challenge [completions, starts, stops] counts
+_COUNTS = {EARNED: 0, CHALLENGE_STARTED: 1, CHALLENGE_STOPPED: 2}
+
+
+@dataclass(frozen=True)
+class CollaborativeState:
+    """Item embeddings learned from the log up to last_event_id; swapped as one unit, on a refresh."""
+    embeddings: np.ndarray  # (n_items x dim)
+    last_event_id: int
+
+    @property
+    def version(self) -> str:
+        return f"cf{self.last_event_id}"
+
+
+def interaction_strength(counts: list[int]) -> float:
+    completions, starts, stops = counts
+    return max(0.0, math.log1p(completions) + START_WEIGHT * (starts - stops))
+
+
+def item_embeddings(cooccurrence: np.ndarray, dim: int) -> np.ndarray:
+    """Factors E with E @ E.T ~ the cosine similarity of the items (self-similarity left out)."""
+    norms = np.sqrt(np.diag(cooccurrence))
+    norms[norms == 0] = 1.0
+    similarity = cooccurrence / np.outer(norms, norms)
+    np.fill_diagonal(similarity, 0.0)
+    eigenvalues, eigenvectors = np.linalg.eigh(similarity)
+    top = np.argsort(eigenvalues)[::-1][:dim]
+    top = top[eigenvalues[top] > 1e-9]
+    return np.ascontiguousarray(eigenvectors[:, top] * np.sqrt(eigenvalues[top]))
+
+
+def _standardize(scores: np.ndarray) -> np.ndarray:
+    std = scores.std()
+    return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+
+
+class CollaborativeRecommender:
+    def __init__(self, challenge_ids: list[str], dim: int = EMBEDDING_DIM, shrinkage: float = BLEND_SHRINKAGE,
+                 refresh_events: int = REFRESH_EVENTS, refresh_interval: float = REFRESH_INTERVAL):
+        # items are catalog rows; events name challenges by id
+        self.positions = {challenge_id: row for row, challenge_id in enumerate(challenge_ids)}
+        self.n_items = n_items = len(challenge_ids)
+        self.dim = dim
+        self.shrinkage = shrinkage
+        # user id -> {challenge index: [completions, starts, stops]}
+        self._counts: dict[str, dict[int, list[int]]] = {}
+        self._cooccurrence = np.zeros((n_items, n_items))
+        self.refresh_events = refresh_events
+        self.refresh_interval = refresh_interval
+        self._pending = 0  # interactions applied since the embeddings were refreshed
+        self._refreshed_at = 0.0
+        self._changed_users: set[str] = set()
+        self._tail = database.EventTail()
+        self._lock = threading.Lock()
+        # None until the first update that saw any interactions; rankings stay answer-based until then
+        self.state: CollaborativeState | None = None
+
+    def apply_events(self, events) -> int:
+        """
+        Fold (id, user_id, type, amount, challenge_id) events into the
+        counts and the co-occurrence matrix. Returns the number of interactions applied.
+        """
+        before: dict[str, dict[int, float]] = {}  # strengths of the touched users before these events
+        applied = 0
+        for _, user_id, type, _, challenge_id in events:
+            position = _COUNTS.get(type)
+            item = self.positions.get(challenge_id) if position is not None else None
+            if item is None:
+                continue
+            user_counts = self._counts.setdefault(user_id, {})
+            if user_id not in before:
+                before[user_id] = {i: interaction_strength(c) for i, c in user_counts.items()}
+            user_counts.setdefault(item, [0, 0, 0])[position] += 1
+            applied += 1
+        self._changed_users.update(before)
+
+        # one (touched users x items) matrix product per batch instead of an update per user
+        old = np.zeros((len(before), self.n_items))
+        new = np.zeros((len(before), self.n_items))
+        for row, (user_id, old_strengths) in enumerate(before.items()):
+            for item, strength in old_strengths.items():
+                old[row, item] = strength
+            for item, counts in self._counts[user_id].items():
+                new[row, item] = interaction_strength(counts)
+        self._cooccurrence += new.T @ new - old.T @ old
+        return applied
+
+    def update(self, db, batch_size: int = 10000) -> int:
+        """
+        Apply the events logged since the last update; refresh the embeddings when
+        refresh_events interactions or refresh_interval seconds have passed since the last refresh.
+        """
+        with self._lock:
+            applied = 0
+            for batch in self._tail.batches(db, batch_size=batch_size):
+                applied += self.apply_events(batch)
+            self._pending += applied
+            now = time.monotonic()
+            if self._pending and (self.state is None or self._pending >= self.refresh_events
+                                  or now - self._refreshed_at >= self.refresh_interval):
+                self.state = CollaborativeState(item_embeddings(self._cooccurrence, self.dim), self._tail.last_id)
+                self._pending, self._refreshed_at = 0, now
+            return applied
+
+    def take_changed_users(self) -> set[str]:
+        """The users with new interactions since the last call."""
+        with self._lock:
+            changed, self._changed_users = self._changed_users, set()
+            return changed
+
+    def user_vector(self, user_id: str) -> tuple[np.ndarray, int]:
+        """A user's interaction strengths per challenge and their number of starts and completions."""
+        vector = np.zeros(self.n_items)
+        interactions = 0
+        for item, counts in list(self._counts.get(user_id, {}).items()):
+            vector[item] = interaction_strength(counts)
+            interactions += counts[0] + counts[1]
+        return vector, interactions
+
+    def score(self, user_id: str, state: CollaborativeState | None = None) -> tuple[np.ndarray, int] | None:
+        """Collaborative score of every challenge for a user and their interaction count; None without history."""
+        state = state or self.state
+        if state is None:
+            return None
+        vector, interactions = self.user_vector(user_id)
+        if not interactions:
+            return None
+        return state.embeddings @ (vector @ state.embeddings), interactions
+
+    def blend(self, user_id: str, static_scores: np.ndarray, state: CollaborativeState | None = None) -> np.ndarray:
+        """
+        The answer-based scores blended with the collaborative ones, per challenge.
+
+        Users without history keep the answer-based scores, and so does everyone until the first update.
+        """
+        scored = self.score(user_id, state)
+        if scored is None:
+            return static_scores
+        cf_scores, interactions = scored
+        weight = interactions / (interactions + self.shrinkage)
+        return (1 - weight) * _standardize(static_scores) + weight * _standardize(cf_scores)
+
+
+class CollaborativeUpdater:
+    """
+    Calls model.update every `interval` seconds in a daemon thread; the first call reads the whole log.
+
+    Between refreshes of the embeddings, on_users_changed(user_id) is called for
+    each user with new interactions, e.g. to drop their cached rankings.
+    """
+
+    def __init__(self, model: CollaborativeRecommender, session_factory=None, interval: float = UPDATE_INTERVAL,
+                 on_users_changed=None):
+        self.model = model
+        self.session_factory = session_factory or database.SessionLocal
+        self.interval = interval
+        self.on_users_changed = on_users_changed
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> int:
+        state = self.model.state
+        db = self.session_factory()
+        try:
+            applied = self.model.update(db)
+        finally:
+            db.close()
+        changed = self.model.take_changed_users()
+        if self.on_users_changed is not None and self.model.state is state:
+            # a new state has a new version, which already misses every cached ranking
+            for user_id in changed:
+                self.on_users_changed(user_id)
+        if applied:
+            logger.info("Collaborative model learned %s interactions (version %s)",
+                        applied, self.model.state.version)
+        return applied
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Collaborative model update failed")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        """Run in a daemon thread (once per process)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="collaborative-updates", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
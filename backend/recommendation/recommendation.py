@@ -1,33 +1,194 @@
 import numpy as np
+from dataclasses import dataclass
 from pathlib import Path
+import hashlib
+import sys
+
+# Rows scored per matrix product in recommend_batch; keeps the temporary score
+# matrix small when re-scoring the whole user base.
+BATCH_CHUNK_SIZE = 65536
+
+
+def weights_fingerprint(weights: np.ndarray, challenge_ids: list[str] | None = None) -> str:
+    """Content hash identifying a weight matrix (and the challenge ids of its rows)."""
+    digest = hashlib.sha256(str(weights.shape).encode())
+    digest.update(np.ascontiguousarray(weights).tobytes())
+    if challenge_ids is not None:
+        digest.update("\n".join(challenge_ids).encode())
+    return digest.hexdigest()[:12]
+
+
+@dataclass(frozen=True)
+class WeightsState:
+    """A weight matrix together with everything derived from it; swapped as one unit."""
+    weights: np.ndarray
+    version: str
+    reason_indices: tuple[tuple[int, ...], ...]
+    reason_short_forms: tuple[tuple[str, ...], ...]
+
 
 class StaticChallengeRecommender:
-    def __init__(self, questions: list[dict]):
-        file_path = Path(__file__).parent.parent / "data" / "challenge_prediction.npy"
-        self.weights = np.load(str(file_path))
+    def __init__(self, questions: list[dict], weights: np.ndarray | None = None, version: str | None = None):
         self.questions = questions
         self.questions_dict = {q['id']: q for q in self.questions}
+        self.short_forms = tuple(sys.intern(self.questions_dict[i + 1]["shortForm"]) for i in range(len(questions)))
+        if weights is None:
+            file_path = Path(__file__).parent.parent / "data" / "challenge_prediction.npy"
+            weights = np.load(str(file_path))
+        self.set_weights(weights, version)
+
+    def set_weights(self, weights: np.ndarray, version: str | None = None):
+        """
+        Install a weight matrix and the reason table derived from it.
+
+        Everything is built before the single assignment to self.state, so
+        requests running concurrently see either the old or the new weights.
+        """
+        self.state = WeightsState(weights=weights, version=version or weights_fingerprint(weights),
+                                  **self._build_reason_table(weights))
+
+    # Read-only views of the current state
+    @property
+    def weights(self) -> np.ndarray:
+        return self.state.weights
+
+    @property
+    def weights_version(self) -> str:
+        return self.state.version
+
+    @property
+    def reason_indices(self):
+        return self.state.reason_indices
+
+    @property
+    def reason_short_forms(self):
+        return self.state.reason_short_forms
+
+    def _build_reason_table(self, weights: np.ndarray) -> dict:
+        """
+        Precompute, per challenge, the question indices ordered by weight and their shortForms.
+
+        Reasons only depend on the weights, so they are computed once here and served by lookup.
+        """
+        reason_order = np.argsort(weights, axis=1)[:, ::-1]
+        reason_indices = tuple(tuple(row) for row in reason_order.tolist())
+        return {
+            "reason_indices": reason_indices,
+            "reason_short_forms": tuple(tuple(self.short_forms[i] for i in row) for row in reason_indices),
+        }
+
+    def answers_to_vector(self, answers: dict[int, int]) -> np.ndarray:
+        """Convert an {question_id: answer} dict into a dense answer vector."""
+        input_vector = np.zeros(len(self.questions), dtype=np.float64)
+        if answers:
+            q_ids = np.fromiter((int(q_id) for q_id in answers.keys()), dtype=np.intp, count=len(answers))
+            input_vector[q_ids - 1] = np.fromiter(answers.values(), dtype=np.float64, count=len(answers))
+        return input_vector
+
+    def answers_to_matrix(self, answers_list: list[dict[int, int]]) -> np.ndarray:
+        """Stack several answer dicts into an (n_users x n_questions) matrix."""
+        matrix = np.zeros((len(answers_list), len(self.questions)), dtype=np.float64)
+        for row, answers in enumerate(answers_list):
+            matrix[row] = self.answers_to_vector(answers)
+        return matrix
+
+    def recommend_batch(self, answers_matrix: np.ndarray, k: int | None = None,
+                        chunk_size: int = BATCH_CHUNK_SIZE,
+                        state: WeightsState | None = None,
+                        mask: np.ndarray | None = None, reranker=None,
+                        rng: np.random.Generator | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score many users at once.
+
+        Takes an (n_users x n_questions) answer matrix and returns (indices, scores),
+        both (n_users x k), where each row holds the top-k challenge indices ordered
+        from best to worst. Indices use the smallest unsigned dtype that fits.
+
+        `mask` (a boolean per challenge, see Catalog.mask) restricts the ranking to
+        the allowed challenges: the others score -inf before the top-k selection
+        and k is capped at the number allowed.
+
+        With a `reranker` (see reranking.DiversityReranker) the top k are chosen by
+        it instead of by score alone, drawing exploration from `rng`.
+        """
+        weights = (state or self.state).weights
+        answers_matrix = np.asarray(answers_matrix)
+        if answers_matrix.ndim == 1:
+            answers_matrix = answers_matrix[np.newaxis, :]
+
+        n_users = answers_matrix.shape[0]
+        n_challenges = weights.shape[0]
+        n_allowed = n_challenges if mask is None else int(np.count_nonzero(mask))
+        k = n_allowed if k is None else max(0, min(k, n_allowed))
+
+        indices = np.empty((n_users, k), dtype=np.min_scalar_type(max(n_challenges - 1, 0)))
+        scores = np.empty((n_users, k), dtype=weights.dtype)
+        if k == 0:
+            return indices, scores
+        weights_t = weights.T
+
+        for start in range(0, n_users, chunk_size):
+            stop = min(start + chunk_size, n_users)
+            chunk_scores = answers_matrix[start:stop].astype(weights.dtype, copy=False) @ weights_t
+            if mask is not None:
+                chunk_scores[:, ~mask] = -np.inf
+
+            if reranker is not None:
+                top, top_scores = reranker.select(chunk_scores, k, rng)
+                indices[start:stop] = top
+                scores[start:stop] = top_scores
+                continue
+
+            # argpartition only pays off when we keep fewer than all challenges
+            if k < n_challenges:
+                top = np.argpartition(-chunk_scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(n_challenges), chunk_scores.shape)
+            top_scores = np.take_along_axis(chunk_scores, top, axis=1)
+
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            indices[start:stop] = np.take_along_axis(top, order, axis=1)
+            scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+
+        return indices, scores
+
+    def score(self, answers: dict[int, int], state: WeightsState | None = None) -> np.ndarray:
+        """Score of every challenge for one user's answers, in challenge order."""
+        return (state or self.state).weights @ self.answers_to_vector(answers)
+
+    def personalized_reasons(self, answers_vector: np.ndarray, indices: np.ndarray,
+                             state: WeightsState | None = None) -> np.ndarray:
+        """
+        Rank questions per challenge by their contribution (weight x answer) for one user.
+
+        Returns an (len(indices) x n_questions) array of question indices, strongest first.
+        """
+        contributions = (state or self.state).weights[indices] * answers_vector
+        return np.argsort(-contributions, axis=1, kind="stable")
 
-    def recommend_challenges(self, answers: dict[int, int]) -> list[tuple[int, list[int]]]:
-        # Convert answers to input vector
-        max_questions = len(self.questions)
-        input_vector = np.zeros(max_questions)
-        for q_id, answer in answers.items():
-            input_vector[int(q_id) - 1] = answer
-        
-        scores = self.weights @ input_vector
-        recommended_indices = np.argsort(scores)[::-1]
+    def recommend_challenges(self, answers: dict[int, int], personalized: bool = False,
+                             state: WeightsState | None = None, mask: np.ndarray | None = None,
+                             k: int | None = None, reranker=None,
+                             rng: np.random.Generator | None = None) -> list[tuple[int, tuple[int, ...]]]:
+        state = state or self.state
+        answers_vector = self.answers_to_vector(answers)
+        indices, _ = self.recommend_batch(answers_vector, k=k, state=state, mask=mask, reranker=reranker, rng=rng)
+        indices = indices[0]
 
-        return [(i, self.weights[i].argsort()[::-1].tolist()) for i in range(len(recommended_indices))]
-    
-    def __call__(self, answers: dict[int, int]):
-        recs_reasons = self.recommend_challenges(answers)
+        if personalized:
+            reasons = self.personalized_reasons(answers_vector, indices, state=state).tolist()
+            return [(i, tuple(r)) for i, r in zip(indices.tolist(), reasons)]
 
-        return [
-            (rec, [self.questions_dict[i+1]["shortForm"] for i in reasons]) for rec, reasons in recs_reasons
-        ]
+        return [(i, state.reason_indices[i]) for i in indices.tolist()]
 
+    def __call__(self, answers: dict[int, int], personalized: bool = False, state: WeightsState | None = None,
+                 mask: np.ndarray | None = None, k: int | None = None, reranker=None,
+                 rng: np.random.Generator | None = None):
+        state = state or self.state
+        recs_reasons = self.recommend_challenges(answers, personalized=personalized, state=state, mask=mask, k=k,
+                                                 reranker=reranker, rng=rng)
 
-        
+        if personalized:
+            return [(rec, tuple(self.short_forms[i] for i in reasons)) for rec, reasons in recs_reasons]
 
-    
+        return [(rec, state.reason_short_forms[rec]) for rec, _ in recs_reasons]
@@ -1,9 +1,15 @@
 # Creating a conservative correlation matrix (14 challenges x 10 questions),
 # scaling each row so the maximum absolute value per row is 1,
-# and saving to /mnt/data/challenge_prediction.npy
+# and publishing it as a new version in the weights registry (data/weights/).
+# Run from the backend directory: python -m recommendation.recommendation_weights
+
+import json
 
 import numpy as np
 
+from catalog import Catalog
+from recommendation.weights_registry import DATA_DIR, WeightsRegistry, legacy_challenge_ids
+
 # Raw conservative correlation estimates (rows = challenges, cols = questions Q1..Q10)
 raw = np.array([
     # Q1  Q2   Q3   Q4   Q5   Q6   Q7   Q8   Q9   Q10
@@ -28,10 +34,16 @@ row_max = np.max(np.abs(raw), axis=1, keepdims=True)
 row_max[row_max == 0] = 1.0
 scaled = raw / row_max
 
-# Save to file
-np.save('data/challenge_prediction.npy', scaled)
+if __name__ == "__main__":
+    with open(DATA_DIR / "challenge.json", encoding="utf-8") as f:
+        catalog = Catalog(json.load(f))
+    with open(DATA_DIR / "question.json", encoding="utf-8") as f:
+        n_questions = len(json.load(f))
+
+    # Publish and activate; running workers switch to it on their next refresh
+    # rows are challenges "1".."14", matched to the catalog by id
+    version = WeightsRegistry(catalog, n_questions).publish(scaled, legacy_challenge_ids(len(scaled)))
 
-# Show summary
-print('Saved /mnt/data/challenge_prediction.npy with shape', scaled.shape)
-scaled
+    # Show summary
+    print('Published weights version', version, 'with shape', scaled.shape)
 
@@ -0,0 +1,135 @@
+"""
+Re-ranking of recommender scores for diversity and exploration.
+
+A pure score ranking shows users with similar answers the same handful of
+similar challenges. DiversityReranker selects the top positions greedily by
+maximal marginal relevance (MMR): each position takes the challenge maximizing
+
+    DIVERSITY * relevance - (1 - DIVERSITY) * max similarity to those already chosen
+
+where relevance is the user's score scaled to [0, 1] and two challenges are
+similar when they share a category and/or a badge theme. With probability
+EPSILON a user's EXPLORE_SLOT position instead goes to a random challenge not
+chosen yet (epsilon-greedy), so challenges that never score high still get
+shown and logged.
+
+Every step runs on a whole (users x challenges) score matrix at once, so the
+same code serves one request and the batch scoring path. Only the first
+MMR_DEPTH positions are re-ranked; the rest follow in score order.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+# 1.0 keeps the score order, lower values trade relevance for variety
+DIVERSITY = float(os.getenv("RERANK_DIVERSITY", "0.7"))
+EPSILON = float(os.getenv("RERANK_EPSILON", "0.1"))
+# 0-based position of the exploration slot; the app shows the first four challenges
+EXPLORE_SLOT = int(os.getenv("RERANK_EXPLORE_SLOT", "3"))
+MMR_DEPTH = int(os.getenv("RERANK_DEPTH", "8"))
+
+# Challenge fields whose shared values make two challenges similar
+SIMILARITY_FIELDS = ("category", "badge_image_theme")
+
+
+def request_rng(*key) -> np.random.Generator:
+    """
+    Generator seeded from the key, e.g. (user id, weights version).
+
+    The exploration pick then stays the same for a user until the models change,
+    so cached and freshly computed rankings agree.
+    """
+    seed = hashlib.blake2b(":".join(map(str, key)).encode(), digest_size=8).digest()
+    return np.random.default_rng(int.from_bytes(seed, "little"))
+
+
+def feature_similarity(challenges: list[dict], fields=SIMILARITY_FIELDS) -> np.ndarray:
+    """(n x n) share of the fields on which two challenges agree; missing values never match."""
+    similarity = np.zeros((len(challenges), len(challenges)))
+    for field in fields:
+        values = [challenge.get(field) for challenge in challenges]
+        codes = {value: code for code, value in enumerate(dict.fromkeys(v for v in values if v is not None))}
+        column = np.array([codes.get(value, -1) for value in values])
+        similarity += (column[:, None] == column[None, :]) & (column[:, None] >= 0)
+    return similarity / max(len(fields), 1)
+
+
+class DiversityReranker:
+    def __init__(self, similarity: np.ndarray, diversity: float = DIVERSITY, epsilon: float = EPSILON,
+                 explore_slot: int = EXPLORE_SLOT, depth: int = MMR_DEPTH):
+        if not 0.0 <= diversity <= 1.0 or not 0.0 <= epsilon <= 1.0:
+            raise ValueError("diversity and epsilon must be between 0 and 1")
+        self.similarity = similarity
+        self.diversity = diversity
+        self.epsilon = epsilon
+        self.explore_slot = explore_slot
+        self.depth = depth
+
+    @classmethod
+    def from_catalog(cls, catalog, **kwargs) -> "DiversityReranker":
+        return cls(feature_similarity(catalog.challenges), **kwargs)
+
+    @property
+    def is_noop(self) -> bool:
+        """True if select() returns the plain score order."""
+        return self.diversity >= 1.0 and self.epsilon <= 0.0
+
+    def select(self, scores: np.ndarray, k: int, rng: np.random.Generator | None = None
+               ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k challenge indices per row of an (n_users x n_challenges) score matrix,
+        and their scores. Excluded challenges score -inf; every row must allow at
+        least k of them.
+        """
+        n_users, n_challenges = scores.shape
+        k = min(k, n_challenges)
+        explore = self.epsilon > 0 and self.explore_slot < k
+        depth = 0 if self.is_noop else min(k, max(self.depth, self.explore_slot + 1) if explore else self.depth)
+
+        available = np.isfinite(scores)
+        indices = np.empty((n_users, k), dtype=np.intp)
+        if depth:
+            # relevance scaled per user to [0, 1] over the allowed challenges
+            low = np.where(available, scores, np.inf).min(axis=1, keepdims=True)
+            high = np.where(available, scores, -np.inf).max(axis=1, keepdims=True)
+            relevance = (scores - low) / np.where(high > low, high - low, 1.0)
+            penalty = np.zeros_like(relevance)
+            if explore:
+                rng = rng or np.random.default_rng()
+                explorers = rng.random(n_users) < self.epsilon
+            rows = np.arange(n_users)
+            for position in range(depth):
+                if explore and position == self.explore_slot:
+                    mmr = np.where(explorers[:, None], rng.random((n_users, n_challenges)),
+                                   self.diversity * relevance - (1 - self.diversity) * penalty)
+                else:
+                    mmr = self.diversity * relevance - (1 - self.diversity) * penalty
+                mmr[~available] = -np.inf
+                chosen = mmr.argmax(axis=1)
+                indices[:, position] = chosen
+                available[rows, chosen] = False
+                np.maximum(penalty, self.similarity[chosen], out=penalty)
+
+        if depth < k:
+            rest = np.where(available, scores, -np.inf)
+            remaining = k - depth
+            if remaining < n_challenges:
+                top = np.argpartition(-rest, remaining - 1, axis=1)[:, :remaining]
+            else:
+                top = np.broadcast_to(np.arange(n_challenges), rest.shape)
+            order = np.argsort(-np.take_along_axis(rest, top, axis=1), axis=1, kind="stable")
+            indices[:, depth:] = np.take_along_axis(top, order, axis=1)
+
+        return indices, np.take_along_axis(scores, indices, axis=1)
+
+    def rank(self, scores: np.ndarray, k: int | None = None, mask: np.ndarray | None = None,
+             rng: np.random.Generator | None = None) -> list[int]:
+        """Ranked challenge indices for one user's score vector, restricted to `mask` if given."""
+        scores = np.array(scores, dtype=np.float64)
+        if mask is not None:
+            scores[~mask] = -np.inf
+        n_allowed = int(np.count_nonzero(np.isfinite(scores)))
+        k = n_allowed if k is None else min(k, n_allowed)
+        return self.select(scores[np.newaxis], k, rng)[0][0].tolist()
@@ -0,0 +1,166 @@
+"""
+Versioned store of recommender weight matrices.
+
+Each version is an immutable .npy file named after its content hash inside
+WEIGHTS_DIR, next to a <version>.ids.json file with the challenge id of each
+row; a CURRENT file names the active one. Rows are matched to the catalog by
+challenge id when loaded, so the catalog can be reordered or grow without
+retraining (new challenges score neutrally until they have weights). Versions
+published before ids were recorded hold challenges "1".."n" in file order. Weights are loaded with
+mmap_mode="r", so all worker processes on a host share the same page-cache
+copy instead of each holding its own. Publishing writes the new file and then
+swaps CURRENT with an atomic rename; running workers pick the change up on
+their next refresh() and swap their recommender state in one assignment.
+"""
+
+from pathlib import Path
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from recommendation.recommendation import weights_fingerprint
+
+logger = logging.getLogger("eco_rewards")
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+WEIGHTS_DIR = Path(os.getenv("WEIGHTS_DIR", DATA_DIR / "weights"))
+# Weights shipped with the repo; published as the first version of an empty registry
+SEED_WEIGHTS = DATA_DIR / "challenge_prediction.npy"
+CHECK_INTERVAL = float(os.getenv("WEIGHTS_CHECK_INTERVAL", "5.0"))
+
+
+class InvalidWeights(ValueError):
+    pass
+
+
+def legacy_challenge_ids(n_rows: int) -> list[str]:
+    """Row ids of versions without an ids file (and of the seed weights): challenges "1".."n"."""
+    return [str(row + 1) for row in range(n_rows)]
+
+
+class WeightsRegistry:
+    def __init__(self, catalog, n_questions: int, weights_dir: Path = WEIGHTS_DIR,
+                 check_interval: float = CHECK_INTERVAL):
+        self.catalog = catalog
+        self.n_questions = n_questions
+        self.weights_dir = Path(weights_dir)
+        self.check_interval = check_interval
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def validate(self, weights: np.ndarray, challenge_ids: list[str]):
+        """Weights must be a finite float matrix with a row per (distinct) challenge id and a column per question."""
+        if weights.ndim != 2 or weights.shape != (len(challenge_ids), self.n_questions):
+            raise InvalidWeights(f"weights have shape {weights.shape}, expected {(len(challenge_ids), self.n_questions)} "
+                                 "(challenge ids x question.json)")
+        if len(set(challenge_ids)) != len(challenge_ids):
+            raise InvalidWeights("challenge ids of the weight rows must be unique")
+        if not np.issubdtype(weights.dtype, np.floating):
+            raise InvalidWeights(f"weights must be floating point, got {weights.dtype}")
+        if not np.isfinite(weights).all():
+            raise InvalidWeights("weights contain NaN or infinite values")
+
+    def path_for(self, version: str) -> Path:
+        return self.weights_dir / f"{version}.npy"
+
+    def ids_path_for(self, version: str) -> Path:
+        return self.weights_dir / f"{version}.ids.json"
+
+    def challenge_ids(self, version: str, n_rows: int) -> list[str]:
+        """Challenge id of each weight row of a version."""
+        try:
+            return json.loads(self.ids_path_for(version).read_text())
+        except FileNotFoundError:
+            return legacy_challenge_ids(n_rows)
+
+    def _atomic_write(self, path: Path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.weights_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def publish(self, weights: np.ndarray, challenge_ids: list[str] | None = None, activate: bool = True) -> str:
+        """
+        Store a new version (idempotent for identical weights) and optionally make it current.
+
+        `challenge_ids` names the challenge of each row; by default the rows follow the catalog.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        challenge_ids = list(self.catalog.ids if challenge_ids is None else challenge_ids)
+        self.validate(weights, challenge_ids)
+        self.weights_dir.mkdir(parents=True, exist_ok=True)
+
+        version = weights_fingerprint(weights, challenge_ids)
+        if not self.path_for(version).exists():
+            # ids first, so every visible version has them
+            self._atomic_write(self.ids_path_for(version), lambda f: f.write(json.dumps(challenge_ids).encode()))
+            self._atomic_write(self.path_for(version), lambda f: np.save(f, weights))
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version: str):
+        """Point CURRENT at an already published version."""
+        self.load(version)
+        self._atomic_write(self.weights_dir / "CURRENT", lambda f: f.write(version.encode()))
+
+    def versions(self) -> list[str]:
+        """Published versions, oldest first."""
+        paths = sorted(self.weights_dir.glob("*.npy"), key=lambda p: p.stat().st_mtime)
+        return [p.stem for p in paths]
+
+    def current_version(self) -> str | None:
+        try:
+            return (self.weights_dir / "CURRENT").read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def load(self, version: str) -> np.ndarray:
+        """Weights of a version with their rows in catalog order (memory-mapped if already in that order)."""
+        weights = np.load(self.path_for(version), mmap_mode="r")
+        challenge_ids = self.challenge_ids(version, len(weights))
+        self.validate(weights, challenge_ids)
+        weights, missing = self.catalog.align(weights, challenge_ids)
+        if missing:
+            logger.warning("Weights version %s has no rows for %s challenges (%s...); they score 0",
+                           version, len(missing), ", ".join(missing[:5]))
+        return weights
+
+    def load_current(self) -> tuple[str, np.ndarray]:
+        """(version, weights in catalog order) of the active version; seeds an empty registry."""
+        version = self.current_version()
+        if version is None:
+            seed = np.load(SEED_WEIGHTS)
+            version = self.publish(seed, legacy_challenge_ids(len(seed)))
+        return version, self.load(version)
+
+    def refresh(self, recommender) -> bool:
+        """
+        Swap the recommender to the current version if it changed.
+
+        Checks CURRENT at most once per check_interval; returns True if new weights
+        were installed. Invalid versions are refused and the old weights kept.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+            version = self.current_version()
+            if version is None or version == recommender.weights_version:
+                return False
+            recommender.set_weights(self.load(version), version)
+            return True
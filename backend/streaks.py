@@ -0,0 +1,158 @@
+"""
+Streak engine: challenge time horizons and expiry of lapsed streaks.
+
+Challenges carry an ISO-8601 duration (`time_variable`, e.g. "P1W"). A streak
+survives as long as the challenge is completed again within that period plus
+STREAK_GRACE; every completion stores the resulting deadline on the
+user_challenges row. StreakExpiryScheduler loads the deadlines that fall due
+soon from the (indexed) database into a min-heap and resets lapsed streaks in
+bulk batches as their deadlines pass, so reads never have to scan a user's habits.
+"""
+
+from datetime import datetime, timedelta
+from functools import lru_cache
+import heapq
+import logging
+import os
+import re
+import threading
+
+import database
+
+logger = logging.getLogger("eco_rewards")
+
+# Slack after the challenge period before a streak breaks (a weekly challenge may be done 8 days apart)
+STREAK_GRACE = timedelta(days=1)
+DEFAULT_PERIOD = timedelta(weeks=1)
+
+_DURATION = re.compile(
+    r"^P(?:(?P<years>\d+(?:\.\d+)?)Y)?(?:(?P<months>\d+(?:\.\d+)?)M)?(?:(?P<weeks>\d+(?:\.\d+)?)W)?"
+    r"(?:(?P<days>\d+(?:\.\d+)?)D)?(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?"
+    r"(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$"
+)
+
+
+@lru_cache(maxsize=256)
+def parse_iso_duration(value: str) -> timedelta:
+    """
+    Parse an ISO-8601 duration such as "P1W", "P1DT12H" or "PT30M".
+
+    Years and months are approximated as 365 and 30 days. Raises ValueError for
+    anything else. Results are cached, so each distinct horizon is parsed once.
+    """
+    match = _DURATION.match(value or "")
+    if not match or value in ("P", "PT") or value.endswith("T"):
+        raise ValueError(f"Invalid ISO-8601 duration: {value!r}")
+    parts = {name: float(amount) for name, amount in match.groupdict().items() if amount}
+    return timedelta(
+        days=parts.get("years", 0) * 365 + parts.get("months", 0) * 30 + parts.get("days", 0),
+        weeks=parts.get("weeks", 0),
+        hours=parts.get("hours", 0),
+        minutes=parts.get("minutes", 0),
+        seconds=parts.get("seconds", 0),
+    )
+
+
+def streak_window(time_horizon: str | None) -> timedelta:
+    """How long after a completion the streak survives without another one."""
+    try:
+        period = parse_iso_duration(time_horizon) if time_horizon else DEFAULT_PERIOD
+    except ValueError:
+        logger.warning("Invalid time horizon %r, using %s", time_horizon, DEFAULT_PERIOD)
+        period = DEFAULT_PERIOD
+    return period + STREAK_GRACE
+
+
+def effective_streak(user_challenge, now: datetime | None = None) -> int:
+    """Current streak of a habit, already 0 if its deadline passed before the expiry job ran."""
+    deadline = user_challenge.streak_deadline
+    if deadline is not None and deadline <= (now or datetime.utcnow()):
+        return 0
+    return user_challenge.current_streak or 0
+
+
+class StreakExpiryScheduler:
+    """
+    Resets lapsed streaks as their deadlines pass.
+
+    Every `horizon` the deadlines due within the next horizon are loaded from
+    the streak_deadline index into a min-heap; the worker sleeps until the
+    earliest one and expires everything due in batches of `batch_size`. Running
+    it in several processes is safe: expiry re-checks the deadline in SQL.
+    """
+
+    def __init__(self, session_factory=None, horizon: timedelta = timedelta(minutes=10),
+                 batch_size: int = 1000, max_entries: int = 100_000):
+        self.session_factory = session_factory or database.SessionLocal
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+        self._heap: list[tuple[datetime, str, str]] = []
+        self._loaded_until: datetime | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def reload(self, db, now: datetime):
+        """Replace the heap with the deadlines due before now + horizon."""
+        entries = database.get_streak_deadlines(db, now + self.horizon, self.max_entries)
+        self._heap = [tuple(entry) for entry in entries]
+        heapq.heapify(self._heap)
+        # if the limit was hit, reload as soon as the loaded entries are used up
+        self._loaded_until = entries[-1][0] if len(entries) == self.max_entries else now + self.horizon
+
+    def run_due(self, db, now: datetime) -> int:
+        """Expire every loaded streak whose deadline is <= now. Returns the number reset."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, user_id, challenge_id = heapq.heappop(self._heap)
+            due.append((user_id, challenge_id))
+
+        expired = 0
+        for start in range(0, len(due), self.batch_size):
+            expired += database.expire_streaks(db, due[start:start + self.batch_size], now)
+            db.commit()
+        return expired
+
+    def tick(self, now: datetime | None = None) -> int:
+        """One scheduling step: reload if the horizon ran out, then expire what is due."""
+        now = now or datetime.utcnow()
+        db = self.session_factory()
+        try:
+            if self._loaded_until is None or now >= self._loaded_until:
+                self.reload(db, now)
+            expired = self.run_due(db, now)
+        finally:
+            db.close()
+        if expired:
+            logger.info("Expired %s lapsed streaks", expired)
+        return expired
+
+    def seconds_until_next(self, now: datetime) -> float:
+        wake_at = self._loaded_until or now
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        return max(0.0, (wake_at - now).total_seconds())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Streak expiry failed")
+                self._loaded_until = None
+            self._stop.wait(min(max(self.seconds_until_next(datetime.utcnow()), 1.0),
+                                self.horizon.total_seconds()))
+
+    def start(self):
+        """Run in a daemon thread (once per process)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="streak-expiry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+streak_scheduler = StreakExpiryScheduler(
+    horizon=timedelta(seconds=float(os.getenv("STREAK_EXPIRY_HORIZON", "600"))),
+)
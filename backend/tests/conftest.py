@@ -0,0 +1,54 @@
+"""
+Shared fixtures: the Flask app on a throwaway SQLite database.
+
+The environment is set before any app module is imported, so database.py,
+the weights registry and the analytics export never touch the repo's data.
+Tests create their own users (make_user) instead of resetting the database.
+"""
+
+import os
+import tempfile
+import uuid
+
+tmp_dir = tempfile.mkdtemp(prefix="ecorewards-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/test.db"
+os.environ["WEIGHTS_DIR"] = f"{tmp_dir}/weights"
+os.environ["ANALYTICS_DIR"] = f"{tmp_dir}/analytics"
+
+import pytest
+
+import database
+import main
+
+
+@pytest.fixture(scope="session")
+def app():
+    main.ensure_database()
+    return main.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def db(app):
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_user(db):
+    """Create a user, with `coins` earned through the ledger; returns its id."""
+    def make(coins: int = 0, **columns) -> str:
+        user_id = f"test-{uuid.uuid4().hex[:12]}"
+        database.create_user(db, {"id": user_id, "name": "Test User", "wallet_balance": 0, "total_impact": 0,
+                                  **columns})
+        if coins:
+            database.record_earned(db, user_id, coins, "Test coins")
+            db.commit()
+        return user_id
+
+    return make
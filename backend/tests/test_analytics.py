@@ -0,0 +1,99 @@
+from datetime import date, datetime
+
+from sqlalchemy import func, insert, select
+
+import analytics
+import database
+import ledger
+import main
+
+
+def count_events(db) -> int:
+    return db.execute(select(func.count()).select_from(database.WalletEvent)).scalar()
+
+
+def log_event(db, user_id: str, event_id: int, amount: int):
+    db.execute(insert(database.WalletEvent), [{"id": event_id, "user_id": user_id, "type": database.EARNED,
+                                               "amount": amount, "challenge_id": "1",
+                                               "created_at": datetime.utcnow()}])
+    db.commit()
+
+
+def test_export_picks_up_late_commits(db, make_user, tmp_path):
+    user_id = make_user()
+    analytics.export(db, tmp_path)
+    last = database.get_last_event_id(db)
+
+    # last + 1 is still being committed by another transaction when last + 2 is exported
+    log_event(db, user_id, last + 2, 7)
+    assert analytics.export(db, tmp_path) == 1
+    assert analytics.read_manifest(tmp_path)["gaps"].keys() == {last + 1}
+    log_event(db, user_id, last + 1, 5)
+    assert analytics.export(db, tmp_path) == 1
+
+    assert analytics.read_manifest(tmp_path)["gaps"] == {}
+    assert analytics.impact_report(tmp_path, workers=1)["events"] == count_events(db)
+
+
+def test_export_only_adds_files(db, make_user, tmp_path):
+    make_user(coins=10)
+    first = database.get_last_event_id(db)
+    segment_events = first + 3
+    analytics.export(db, tmp_path, segment_events)
+    [name] = analytics.read_manifest(tmp_path)["files"]
+    written = (tmp_path / name).stat().st_mtime_ns
+
+    make_user(coins=10)
+    analytics.export(db, tmp_path, segment_events)
+    files = analytics.read_manifest(tmp_path)["files"]
+    assert len(files) == 2 and (tmp_path / name).stat().st_mtime_ns == written
+
+    for _ in range(3):
+        make_user(coins=10)
+    analytics.export(db, tmp_path, segment_events)
+    # the log moved past segment 0: its files were compacted into one
+    files = analytics.read_manifest(tmp_path)["files"]
+    assert [analytics.segment_of(f) for f in files] == [0, 1]
+    analytics.export(db, tmp_path, segment_events)
+    assert sorted(p.name for p in tmp_path.glob("events-*.npz")) == analytics.read_manifest(tmp_path)["files"]
+    assert analytics.impact_report(tmp_path, workers=1)["events"] == count_events(db)
+
+
+def test_opening_balances_are_not_earned_this_week(db, tmp_path):
+    user_id = "test-imported"
+    database.bulk_load_users(db, [{"id": user_id, "name": "Imported", "walletBalance": 300, "totalImpact": 5000}])
+    types = db.execute(select(database.WalletEvent.type, database.WalletEvent.amount)
+                       .where(database.WalletEvent.user_id == user_id)).all()
+    assert sorted(types) == [(database.OPENING_EARNED, 5000), (database.OPENING_REDEEMED, -4700)]
+    state = ledger.rebuild_wallet(db, user_id, use_snapshot=False)
+    assert (state.balance, state.total_impact) == (300, 5000)
+
+    analytics.export(db, tmp_path)
+    this_week = analytics.week_start(analytics.week_of(date.today()))
+    [week] = analytics.impact_report(tmp_path, workers=1, since=this_week)["weeks"]
+    earned = db.execute(select(func.coalesce(func.sum(database.WalletEvent.amount), 0))
+                        .where(database.WalletEvent.type == database.EARNED,
+                               database.WalletEvent.created_at >= datetime.combine(this_week, datetime.min.time()))
+                        ).scalar()
+    assert week["coinsEarned"] == earned
+
+
+def test_admin_routes_need_the_token(client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.get("/api/admin/impact").status_code == 403
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    for path in ("/api/admin/impact", "/api/admin/recommendation-cache"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer secret"}).status_code == 200
+
+
+def test_impact_report_does_not_export(client, db, make_user, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    headers = {"Authorization": "Bearer secret"}
+    before = client.get("/api/admin/impact", headers=headers).get_json()["events"]
+    make_user(coins=10)
+    assert client.get("/api/admin/impact?refresh=1", headers=headers).get_json()["events"] == before
+
+    analytics.export(db)
+    assert client.get("/api/admin/impact", headers=headers).get_json()["events"] == count_events(db)
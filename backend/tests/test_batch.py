@@ -0,0 +1,81 @@
+import main
+from test_wallet import assert_ledger_consistent, balance
+
+
+def run_batch(client, user_id: str, *subrequests):
+    response = client.post("/api/batch", json={"requests": [
+        {"id": str(i), "method": method, "path": path, **({"body": body} if body is not None else {})}
+        for i, (method, path, body) in enumerate(subrequests)
+    ]}, headers={"X-User-Id": user_id})
+    assert response.status_code == 200
+    return response.get_json()["responses"]
+
+
+def test_failed_subrequest_keeps_the_others_writes(client, db, make_user, monkeypatch):
+    user_id = make_user(coins=100)
+    commit_writes, calls = main.commit_writes, []
+
+    def fail_second_commit(session):
+        calls.append(session)
+        if len(calls) == 2:
+            raise RuntimeError("database went away")
+        commit_writes(session)
+
+    monkeypatch.setattr(main, "commit_writes", fail_second_commit)
+    responses = run_batch(client, user_id,
+                          ("POST", "/api/wallet/redeem", {"amount": 30}),
+                          ("POST", "/api/wallet/redeem", {"amount": 20}),
+                          ("POST", "/api/wallet/redeem", {"amount": 10}),
+                          ("GET", "/api/user/profile", None))
+
+    assert [r["status"] for r in responses] == [200, 500, 200, 200]
+    # every sub-request had a session of its own
+    assert len({id(session) for session in calls}) == 3
+    assert responses[3]["body"]["walletBalance"] == 60
+    assert balance(db, user_id) == 60
+    assert_ledger_consistent(db, user_id)
+
+
+def test_rejected_subrequest_does_not_undo_earlier_ones(client, db, make_user):
+    user_id = make_user(coins=100)
+    responses = run_batch(client, user_id,
+                          ("POST", "/api/wallet/redeem", {"amount": 30}),
+                          ("POST", "/api/wallet/redeem", {"amount": 1000}),
+                          ("GET", "/api/user/profile", None))
+
+    assert [r["status"] for r in responses] == [200, 400, 200]
+    assert responses[2]["body"]["walletBalance"] == 70
+    assert balance(db, user_id) == 70
+    assert_ledger_consistent(db, user_id)
+
+
+def test_streaming_routes_are_rejected(client, make_user):
+    user_id = make_user()
+    for path in ("/api/events", "/api/events?lastEventId=1", "/api/wallet/transactions?format=ndjson"):
+        response = client.post("/api/batch", json={"requests": [{"path": "/api/user/profile"}, {"path": path}]},
+                               headers={"X-User-Id": user_id})
+        assert response.status_code == 400
+        assert "index 1" in response.get_json()["error"]
+    assert run_batch(client, user_id, ("GET", "/api/wallet/transactions?limit=5", None))[0]["status"] == 200
+
+
+def test_reads_share_a_session_and_the_user(client, make_user, monkeypatch):
+    user_id = make_user(coins=100)
+    get_user_by_id, loads = main.database.get_user_by_id, []
+
+    def counted_get_user_by_id(session, user):
+        loads.append(session)
+        return get_user_by_id(session, user)
+
+    monkeypatch.setattr(main.database, "get_user_by_id", counted_get_user_by_id)
+    responses = run_batch(client, user_id,
+                          ("GET", "/api/user/profile", None),
+                          ("GET", "/api/user/stats", None),
+                          ("GET", "/api/wallet/transactions", None),
+                          ("POST", "/api/wallet/redeem", {"amount": 30}),
+                          ("GET", "/api/user/profile", None))
+
+    assert [r["status"] for r in responses] == [200] * 5
+    # one load for the three reads, one for the write, one for the read after it
+    assert len(loads) == 3 and len({id(session) for session in loads}) == 3
+    assert responses[4]["body"]["walletBalance"] == 70
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+import dataclasses
+
+from sqlalchemy import update
+
+from catalog_cache import catalog_cache
+import database
+import main
+
+
+def test_start_reports_a_lapsed_streak_as_zero(client, db, make_user):
+    user_id = make_user()
+    headers = {"X-User-Id": user_id}
+    assert client.post("/api/challenges/1/complete", headers=headers).status_code == 200
+    assert client.post("/api/challenges/1/start", headers=headers).get_json()["currentStreak"] == 1
+
+    # the deadline passed, but the expiry job has not reset the streak yet
+    db.execute(update(database.UserChallenge).where(database.UserChallenge.user_id == user_id)
+               .values(streak_deadline=datetime.utcnow() - timedelta(minutes=1)))
+    db.commit()
+    response = client.post("/api/challenges/1/start", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["currentStreak"] == 0
+
+
+def test_changed_catalog_reaches_the_routes(client, make_user, monkeypatch):
+    user_id = make_user(answers={"1": 1, "2": -1})
+    headers = {"X-User-Id": user_id}
+    assert client.get("/api/challenges/personalized", headers=headers).status_code == 200
+    entry = catalog_cache.get("challenge.json")
+    renamed = [dict(challenge, challenge="Renamed") if challenge["id"] == "1" else challenge
+               for challenge in entry.data]
+    # as if challenge.json changed on disk and the cache had just read it
+    monkeypatch.setitem(catalog_cache._entries, "challenge.json", dataclasses.replace(entry, data=renamed))
+    monkeypatch.setitem(catalog_cache._checked_at, "challenge.json", float("inf"))
+
+    assert client.get("/api/challenges/1", headers=headers).get_json()["challenge"] == "Renamed"
+    ranked = client.get("/api/challenges/personalized", headers=headers).get_json()
+    assert {challenge["challenge"] for challenge in ranked if challenge["id"] == "1"} == {"Renamed"}
+    assert main.get_catalog().get("1")["challenge"] == "Renamed"
@@ -0,0 +1,64 @@
+import numpy as np
+
+from database import EARNED, CHALLENGE_STARTED
+from recommendation.collaborative import CollaborativeRecommender, CollaborativeState, item_embeddings
+
+
+def trained_model() -> CollaborativeRecommender:
+    model = CollaborativeRecommender(["1", "2", "3"], dim=2)
+    events = []
+    # users who do challenge 1 also do challenge 2; challenge 3 is done on its own
+    for user in range(20):
+        for challenge_id in ("1", "2") if user % 2 else ("3",):
+            events.append((len(events) + 1, f"user-{user}", EARNED, 10, challenge_id))
+    for _ in range(10):
+        events.append((len(events) + 1, "new", CHALLENGE_STARTED, 0, "1"))
+    model.apply_events(events)
+    model.state = CollaborativeState(item_embeddings(model._cooccurrence, model.dim), len(events))
+    return model
+
+
+def test_users_without_history_keep_the_answer_based_scores():
+    model = trained_model()
+    static_scores = np.array([0.5, 0.1, 0.9])
+    assert model.blend("nobody", static_scores) is static_scores
+
+
+def test_history_moves_similar_challenges_up():
+    model = trained_model()
+    static_scores = np.array([0.5, 0.1, 0.9])
+    blended = model.blend("new", static_scores)
+    # "new" started challenge 1, which is done together with challenge 2
+    assert blended[1] > blended[2]
+    np.testing.assert_array_equal(model.blend("new", static_scores), blended)
+
+
+def test_update_reads_the_event_log(client, db, make_user):
+    user_id = make_user()
+    assert client.post("/api/challenges/1/complete", headers={"X-User-Id": user_id}).status_code == 200
+    model = CollaborativeRecommender([str(i) for i in range(1, 15)])
+    assert model.update(db) > 0
+    assert model.state is not None and model.score(user_id) is not None
+    assert model.update(db) == 0
+
+
+def test_version_changes_on_refresh_only(client, db, make_user):
+    user_id = make_user()
+    assert client.post("/api/challenges/1/complete", headers={"X-User-Id": user_id}).status_code == 200
+    model = CollaborativeRecommender([str(i) for i in range(1, 15)], refresh_events=5, refresh_interval=3600)
+    model.update(db)
+    version = model.state.version
+    model.take_changed_users()
+
+    assert client.post("/api/challenges/2/complete", headers={"X-User-Id": user_id}).status_code == 200
+    assert model.update(db) == 2  # started and completed
+    # the embeddings (and the version cached rankings are keyed on) stay; the user's own history moves
+    assert model.state.version == version
+    assert model.take_changed_users() == {user_id}
+    assert model.user_vector(user_id)[1] == 4
+
+    for challenge_id in ("3", "4"):
+        assert client.post(f"/api/challenges/{challenge_id}/complete",
+                           headers={"X-User-Id": user_id}).status_code == 200
+    assert model.update(db) == 4
+    assert model.state.version != version
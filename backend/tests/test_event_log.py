@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+import database
+import ledger
+
+
+def log_event(db, user_id: str, event_id: int, created_at: datetime | None = None):
+    db.execute(insert(database.WalletEvent), [{"id": event_id, "user_id": user_id, "type": database.EARNED,
+                                               "amount": 1, "challenge_id": "1",
+                                               "created_at": created_at or datetime.utcnow()}])
+    db.commit()
+
+
+def read(tail, db) -> list[int]:
+    return [row.id for batch in tail.batches(db, batch_size=2) for row in batch]
+
+
+def test_tail_reads_late_commits(db, make_user):
+    user_id = make_user()
+    last = database.get_last_event_id(db)
+    tail = database.EventTail(last)
+    log_event(db, user_id, last + 3)
+    assert read(tail, db) == [last + 3]
+    assert tail.gaps.keys() == {last + 1, last + 2}
+
+    log_event(db, user_id, last + 2)
+    log_event(db, user_id, last + 4)
+    assert read(tail, db) == [last + 2, last + 4]
+    assert tail.gaps.keys() == {last + 1}
+    assert read(tail, db) == []
+
+
+def test_tail_gives_up_on_old_gaps(db, make_user):
+    user_id = make_user()
+    last = database.get_last_event_id(db)
+    tail = database.EventTail(last, gap_seconds=0)
+    log_event(db, user_id, last + 2)
+    assert read(tail, db) == [last + 2]
+    assert tail.gaps.keys() == {last + 1}
+    # checked once more, then dropped
+    assert read(tail, db) == []
+    assert tail.gaps == {}
+
+
+def test_tail_reads_a_failed_batch_again(db, make_user):
+    user_id = make_user()
+    last = database.get_last_event_id(db)
+    tail = database.EventTail(last)
+    for event_id in range(last + 1, last + 4):
+        log_event(db, user_id, event_id)
+    for batch in tail.batches(db, batch_size=2):
+        break  # the reader failed on its first batch
+    assert tail.last_id == last
+    assert read(tail, db) == [last + 1, last + 2, last + 3]
+
+
+def test_snapshots_leave_out_events_that_may_still_commit(db, make_user):
+    user_id = make_user()
+    last = database.get_last_event_id(db)
+    long_ago = datetime.utcnow() - timedelta(seconds=database.EVENT_GAP_SECONDS * 2)
+    log_event(db, user_id, last + 1, long_ago)
+    log_event(db, user_id, last + 2, long_ago)
+    log_event(db, user_id, last + 4)  # last + 3 is not committed yet
+    assert database.get_settled_event_id(db) == last + 2
+
+    assert ledger.take_snapshots(db, min_events=1) >= 1
+    assert database.get_wallet_snapshot(db, user_id).last_event_id == last + 2
+    log_event(db, user_id, last + 3)
+    state = ledger.rebuild_wallet(db, user_id)
+    assert state == ledger.rebuild_wallet(db, user_id, use_snapshot=False)
+    assert state.balance == 4
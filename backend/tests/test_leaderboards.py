@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+
+import database
+import leaderboards
+from leaderboards import Leaderboards, RankingIndex, encode_key
+
+
+def test_ranking_index_matches_a_sorted_list(monkeypatch):
+    # small blocks, so blocks are split and emptied
+    monkeypatch.setattr(leaderboards, "BLOCK_SIZE", 4)
+    rng = random.Random(0)
+    keys = [rng.randrange(100) for _ in range(50)]
+    index = RankingIndex(np.array(keys))
+    for _ in range(2000):
+        key = rng.randrange(100)
+        if rng.random() < 0.5:
+            index.insert(key)
+            keys.append(key)
+        else:
+            assert index.remove(key) == (key in keys)
+            if key in keys:
+                keys.remove(key)
+        keys.sort()
+        assert len(index) == len(keys)
+        probe = rng.randrange(101)
+        assert index.position(probe) == sum(k < probe for k in keys)
+        start = rng.randrange(len(keys) + 1)
+        assert index.slice(start, start + 5).tolist() == keys[start:start + 5]
+
+
+def test_ties_share_a_rank():
+    boards = Leaderboards()
+    boards.load(["a", "b", "c", "d"], ["eu", "eu", "us", "eu"],
+                {metric: np.array([30, 50, 50, 10]) for metric in leaderboards.METRICS})
+    metric = "totalImpact"
+    assert [(e["rank"], e["userId"]) for e in boards.top(metric, 4)] == [(1, "b"), (1, "c"), (3, "a"), (4, "d")]
+    assert boards.rank(metric, "a") == {"rank": 3, "userId": "a", "value": 30}
+    assert boards.rank(metric, "a", region="eu")["rank"] == 2
+    assert boards.rank(metric, "c", region="eu") is None
+    # higher scores sort first, whatever the slot
+    assert encode_key(50, 1) < encode_key(30, 0)
+
+
+def test_sync_picks_up_new_events(client, db, make_user):
+    boards = Leaderboards()
+    boards.rebuild(db)
+    user_id = make_user()
+    assert client.post("/api/challenges/1/complete", headers={"X-User-Id": user_id}).status_code == 200
+
+    assert boards.sync(db) >= 1
+    assert boards.rank("totalImpact", user_id)["value"] > 0
+    assert boards.last_event_id == database.get_last_event_id(db)
+    assert boards.sync(db) == 0
@@ -0,0 +1,33 @@
+import json
+
+import database
+import main
+
+
+def stored_ranking(db, user_id: str) -> list:
+    db.expire_all()
+    return database.get_user_by_id(db, user_id).recommended_challenges
+
+
+def test_onboarding_stores_catalog_ids(client, db, make_user):
+    user_id = make_user()
+    answers = {str(q): 1 for q in range(1, 11)}
+    assert client.post("/api/onboarding", json={"answers": answers}, headers={"X-User-Id": user_id}).status_code == 200
+
+    ranking = stored_ranking(db, user_id)
+    catalog_ids = set(main.get_catalog().ids)
+    assert ranking and all(isinstance(challenge_id, str) and challenge_id in catalog_ids for challenge_id in ranking)
+    assert client.get("/api/user/profile", headers={"X-User-Id": user_id}).get_json()["recommendedChallenges"] == ranking
+
+
+def test_bulk_onboarding_stores_catalog_ids(client, db):
+    lines = "".join(json.dumps({"id": f"bulk-{n}", "name": "Bulk", "answers": {"1": 1, "2": -1}}) + "\n"
+                    for n in range(3))
+    response = client.post("/api/onboarding/bulk", data=lines, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    assert response.get_json()["imported"] == 3
+
+    catalog_ids = set(main.get_catalog().ids)
+    for n in range(3):
+        ranking = stored_ranking(db, f"bulk-{n}")
+        assert ranking and all(challenge_id in catalog_ids for challenge_id in ranking)
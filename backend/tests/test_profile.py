@@ -0,0 +1,37 @@
+import pytest
+
+from profiles import profile_store
+
+
+@pytest.mark.parametrize("answers", ["garbage", [1, 0], {"1": 2}, {"1": True}, {"x": 1}, {"99": 1}])
+def test_update_profile_rejects_invalid_answers(client, make_user, answers):
+    user_id = make_user(answers={"1": 1})
+    response = client.put("/api/user/profile", json={"answers": answers}, headers={"X-User-Id": user_id})
+
+    assert response.status_code == 400
+    assert "answers" not in profile_store.pending(user_id)
+    assert client.get("/api/challenges/personalized", headers={"X-User-Id": user_id}).status_code == 200
+
+
+def test_update_profile_answers_feed_personalized_ranking(client, make_user):
+    user_id = make_user(answers={"1": 1})
+    response = client.put("/api/user/profile", json={"name": "Renamed", "answers": {"1": 1, "2": -1}},
+                          headers={"X-User-Id": user_id})
+
+    assert response.status_code == 200
+    assert response.get_json()["name"] == "Renamed"
+    profile_store.flush()
+    assert client.get("/api/challenges/personalized", headers={"X-User-Id": user_id}).status_code == 200
+
+
+@pytest.mark.parametrize("answers, status", [("garbage", 400), ({"1": 5}, 422), ({"1": False}, 422),
+                                             ({"42": 1}, 422)])
+def test_onboarding_rejects_invalid_answers(client, make_user, answers, status):
+    response = client.post("/api/onboarding", json={"answers": answers}, headers={"X-User-Id": make_user()})
+    assert response.status_code == status
+
+
+@pytest.mark.parametrize("payload", [[{"answers": {"1": 1}}], "answers", 1])
+def test_onboarding_rejects_non_object_payload(client, make_user, payload):
+    response = client.post("/api/onboarding", json=payload, headers={"X-User-Id": make_user()})
+    assert response.status_code == 400
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, update
+
+import database
+import main
+import push
+
+
+def test_complete_challenge_wakes_the_feed(client, make_user):
+    user_id = make_user()
+    feed = main.get_push_feed()
+    subscription = feed.broker.subscribe(user_id)
+    try:
+        response = client.post("/api/challenges/1/complete", headers={"X-User-Id": user_id})
+        assert response.status_code == 200
+        # well before the feed's next poll
+        messages = subscription.get(timeout=push.POLL_INTERVAL * 0.8)
+    finally:
+        feed.broker.unsubscribe(subscription)
+    events = {message["event"]: message["data"] for message in messages}
+    assert events["wallet"]["change"] == response.get_json()["reward"]
+    assert events["streak"] == {"challengeId": "1", "streak": 1, "currentStreak": 1, "longestStreak": 1,
+                                "totalChallengesCompleted": 1}
+    assert events["badge"]["challengeId"] == "1"
+
+
+def test_expired_streak_is_logged_and_pushed(client, db, make_user):
+    user_id = make_user()
+    assert client.post("/api/challenges/1/complete", headers={"X-User-Id": user_id}).status_code == 200
+    now = datetime.utcnow()
+    db.execute(update(database.UserChallenge).where(database.UserChallenge.user_id == user_id)
+               .values(streak_deadline=now - timedelta(minutes=1)))
+    db.commit()
+
+    assert database.expire_streaks(db, [(user_id, "1")], now) == 1
+    db.commit()
+
+    rows = db.execute(select(database.WalletEvent.id, database.WalletEvent.user_id, database.WalletEvent.type,
+                             database.WalletEvent.amount, database.WalletEvent.challenge_id)
+                      .where(database.WalletEvent.user_id == user_id,
+                             database.WalletEvent.type == database.STREAK_EXPIRED)).all()
+    assert len(rows) == 1
+    [(_, message)] = push.build_messages(db, rows)
+    assert message["event"] == "streak"
+    assert message["data"]["streak"] == 0 and message["data"]["currentStreak"] == 0
+    # nothing to reset the second time
+    assert database.expire_streaks(db, [(user_id, "1")], now) == 0
+
+
+def test_slow_subscriber_gets_a_resync():
+    broker = push.LocalBroker(max_queued=3)
+    subscription = broker.subscribe("u")
+    for event_id in range(5):
+        broker.publish("u", {"id": event_id, "event": "wallet", "data": {}})
+
+    assert [message.get("id") for message in subscription.get(timeout=0)] == [None, 3, 4]
+    assert broker.stats["resyncs"] == 1
+
+
+def test_replay_after_last_event_id(client, db, make_user):
+    user_id = make_user(coins=100)
+    first = database.get_last_event_id(db)
+    client.post("/api/wallet/redeem", json={"amount": 10}, headers={"X-User-Id": user_id})
+    client.post("/api/wallet/redeem", json={"amount": 20}, headers={"X-User-Id": user_id})
+
+    replayed = push.replay(db, user_id, first, gap_seconds=0)
+    assert [message["data"]["change"] for message in replayed] == [-10, -20]
+    assert push.replay(db, user_id, first, limit=1, gap_seconds=0) == [push.RESYNC]
+
+
+def test_replay_resends_events_that_may_have_committed_late(db, make_user):
+    user_id = make_user()
+    last = database.get_last_event_id(db)
+    for event_id, amount in ((last + 2, 10), (last + 1, 5)):  # last + 1 commits after the client saw last + 2
+        db.execute(insert(database.WalletEvent), [{"id": event_id, "user_id": user_id, "type": database.EARNED,
+                                                   "amount": amount, "created_at": datetime.utcnow()}])
+        db.commit()
+
+    assert [message["data"]["change"] for message in push.replay(db, user_id, last + 2)] == [5, 10]
+    assert push.replay(db, user_id, last + 2, gap_seconds=0) == []
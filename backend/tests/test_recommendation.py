@@ -0,0 +1,29 @@
+import numpy as np
+
+import main
+
+
+def test_recommend_batch_matches_single_user_ranking(app):
+    recommender = main.get_recommender()
+    rng = np.random.default_rng(0)
+    answers = [{q + 1: int(v) for q, v in enumerate(rng.integers(-1, 2, size=len(recommender.questions)))}
+               for _ in range(50)]
+
+    indices, scores = recommender.recommend_batch(recommender.answers_to_matrix(answers), k=5, chunk_size=7)
+
+    for row, user_answers in enumerate(answers):
+        expected = recommender.score(user_answers)
+        assert np.allclose(scores[row], np.sort(expected)[::-1][:5])
+        assert np.allclose(expected[indices[row]], scores[row])
+
+
+def test_recommend_batch_mask_and_k(app):
+    recommender = main.get_recommender()
+    n_challenges = recommender.weights.shape[0]
+    mask = np.zeros(n_challenges, dtype=bool)
+    mask[[1, 3]] = True
+
+    indices, _ = recommender.recommend_batch(np.ones(len(recommender.questions)), k=10, mask=mask)
+
+    assert indices.shape == (1, 2)
+    assert set(indices[0].tolist()) == {1, 3}
@@ -0,0 +1,51 @@
+import numpy as np
+
+import main
+from recommendation.reranking import DiversityReranker, request_rng
+
+
+def reranker(**kwargs) -> DiversityReranker:
+    # challenges 0-2 share a category, 3-5 another
+    category = np.array([0, 0, 0, 1, 1, 1])
+    return DiversityReranker((category[:, None] == category[None, :]).astype(float), **kwargs)
+
+
+SCORES = np.array([0.9, 0.85, 0.8, 0.5, 0.4, 0.1])
+
+
+def test_same_key_same_ranking():
+    rank = reranker(epsilon=0.5)
+    first = [rank.rank(SCORES, rng=request_rng("user-1", "v1")) for _ in range(3)]
+    assert first[0] == first[1] == first[2]
+    # the exploration draw is per user: over many users some explore
+    rankings = {tuple(rank.rank(SCORES, rng=request_rng(f"user-{u}", "v1"))) for u in range(50)}
+    assert len(rankings) > 1
+
+
+def test_batch_rows_match_single_rankings():
+    rank = reranker(epsilon=0.0)
+    scores = np.stack([SCORES, SCORES[::-1], np.roll(SCORES, 2)])
+    indices, _ = rank.select(scores, k=4)
+    assert [row.tolist() for row in indices] == [rank.rank(row, k=4) for row in scores]
+
+
+def test_diversity_mixes_categories_and_noop_keeps_score_order():
+    assert reranker(diversity=1.0, epsilon=0.0).rank(SCORES) == [0, 1, 2, 3, 4, 5]
+    assert reranker(diversity=0.5, epsilon=0.0).rank(SCORES, k=2) == [0, 3]
+
+
+def test_mask_is_respected():
+    mask = np.array([False, True, True, True, False, True])
+    ranking = reranker(epsilon=1.0).rank(SCORES, mask=mask, rng=request_rng("u"))
+    assert sorted(ranking) == [1, 2, 3, 5]
+
+
+def test_personalized_ranking_is_stable(client, make_user):
+    user_id = make_user(answers={"1": 1, "2": -1})
+    response = client.get("/api/challenges/personalized", headers={"X-User-Id": user_id})
+    assert response.status_code == 200
+    first = response.get_json()
+    # computed again, not served from the cache
+    main.recommendation_cache.clear()
+    second = client.get("/api/challenges/personalized", headers={"X-User-Id": user_id}).get_json()
+    assert first == second
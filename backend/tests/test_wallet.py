@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+import database
+import ledger
+
+
+def balance(db, user_id: str) -> int:
+    db.expire_all()
+    return database.get_user_by_id(db, user_id).wallet_balance
+
+
+def assert_ledger_consistent(db, user_id: str):
+    """The summary row, the transactions and the event log agree."""
+    db.expire_all()
+    user = database.get_user_by_id(db, user_id)
+    transactions = db.scalar(select(func.coalesce(func.sum(database.Transaction.amount), 0))
+                             .where(database.Transaction.user_id == user_id))
+    wallet = ledger.rebuild_wallet(db, user_id, use_snapshot=False)
+    assert user.wallet_balance == transactions == wallet.balance
+    assert user.total_impact == wallet.total_impact
+
+
+def redeem(client, user_id: str, body, **headers):
+    return client.post("/api/wallet/redeem", json=body, headers={"X-User-Id": user_id, **headers})
+
+
+@pytest.mark.parametrize("amount", [True, False, "10", 1.5, 0, -5, None])
+def test_redeem_rejects_invalid_amounts(client, db, make_user, amount):
+    user_id = make_user(coins=100)
+    assert redeem(client, user_id, {"amount": amount}).status_code == 400
+    assert balance(db, user_id) == 100
+
+
+def test_redeem_rejects_non_object_payload(client, make_user):
+    assert redeem(client, make_user(coins=100), [10]).status_code == 400
+
+
+def test_redeem_insufficient_balance_writes_nothing(client, db, make_user):
+    user_id = make_user(coins=50)
+    assert redeem(client, user_id, {"amount": 60}).status_code == 400
+    assert balance(db, user_id) == 50
+    assert_ledger_consistent(db, user_id)
+
+
+def test_concurrent_redeems_never_overdraw(app, db, make_user):
+    user_id = make_user(coins=100)
+
+    def spend(_):
+        return redeem(app.test_client(), user_id, {"amount": 30}).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(spend, range(8)))
+
+    assert statuses.count(200) == 3
+    assert statuses.count(400) == 5
+    assert balance(db, user_id) == 10
+    assert_ledger_consistent(db, user_id)
+
+
+def test_replayed_idempotency_key_spends_once(client, db, make_user):
+    user_id = make_user(coins=100)
+    first = redeem(client, user_id, {"amount": 30}, **{"Idempotency-Key": "k1"})
+    retry = redeem(client, user_id, {"amount": 30}, **{"Idempotency-Key": "k1"})
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert balance(db, user_id) == 70
+    assert_ledger_consistent(db, user_id)
+
+
+def test_idempotency_key_of_another_endpoint_is_rejected(client, make_user):
+    user_id = make_user(coins=100)
+    assert redeem(client, user_id, {"amount": 30}, **{"Idempotency-Key": "k2"}).status_code == 200
+    response = client.post("/api/challenges/1/complete", headers={"X-User-Id": user_id, "Idempotency-Key": "k2"})
+    assert response.status_code == 422
+
+
+def test_failed_idempotent_request_releases_the_key(client, db, make_user):
+    user_id = make_user(coins=100)
+    assert redeem(client, user_id, {"amount": 300}, **{"Idempotency-Key": "k3"}).status_code == 400
+    assert redeem(client, user_id, {"amount": 30}, **{"Idempotency-Key": "k3"}).status_code == 200
+    assert balance(db, user_id) == 70
+
+
+def test_crash_before_storing_the_response_commits_nothing(client, db, make_user, monkeypatch):
+    user_id = make_user(coins=100)
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("worker died")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(database, "store_idempotent_response", crash)
+        assert redeem(client, user_id, {"amount": 30}, **{"Idempotency-Key": "k4"}).status_code == 500
+    assert balance(db, user_id) == 100
+    assert database.get_idempotency_key(db, user_id, "k4") is None
+
+    # the retry does the work once, instead of answering 409 "in progress" forever
+    assert redeem(client, user_id, {"amount": 30}, **{"Idempotency-Key": "k4"}).status_code == 200
+    assert balance(db, user_id) == 70
+    assert_ledger_consistent(db, user_id)
+
+
+def test_complete_challenge_rewards_and_replays(client, db, make_user):
+    user_id = make_user()
+    headers = {"X-User-Id": user_id, "Idempotency-Key": "c1"}
+    first = client.post("/api/challenges/1/complete", headers=headers)
+    retry = client.post("/api/challenges/1/complete", headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert first.get_json()["streak"] == 1
+    assert balance(db, user_id) == first.get_json()["reward"]
+    assert_ledger_consistent(db, user_id)
+
+
+def test_imported_users_survive_a_reconcile(client, db):
+    user_id = f"test-imported-{uuid.uuid4().hex[:8]}"
+    database.bulk_load_users(db, [{
+        "id": user_id, "name": "Imported", "walletBalance": 300, "totalImpact": 500,
+        "stats": {"totalChallengesCompleted": 7},
+        # described like the opening entries, but an ordinary transaction; and without a date
+        "transactions": [{"type": "earned", "amount": 50, "challengeId": "1", "description": "Opening balance"}],
+    }])
+    database.reconcile_user_summaries(db)
+
+    db.expire_all()
+    user = database.get_user_by_id(db, user_id)
+    assert (user.wallet_balance, user.total_impact, user.total_challenges_completed) == (300, 500, 7)
+    wallet = ledger.rebuild_wallet(db, user_id, use_snapshot=False)
+    assert (wallet.balance, wallet.challenges_completed) == (300, 7)
+    assert_ledger_consistent(db, user_id)
+
+    response = client.get("/api/wallet/transactions", headers={"X-User-Id": user_id})
+    assert response.status_code == 200
+    assert {t["amount"] for t in response.get_json()} == {50, 450, -200}